@@ -1,15 +1,27 @@
 from fastapi import FastAPI, responses, status
+from prometheus_client import CONTENT_TYPE_LATEST
 
-
-from controller import task_manager, tokenization_manager
-from misc import util
+from controller import (
+    cost_estimator,
+    record_dispatcher,
+    task_manager,
+    token_reader,
+    tokenization_manager,
+)
+from misc import metrics as metrics_util, query, task_estimate, util
 from handler import config_handler, tokenizer_handler
 from request_classes import (
     AttributeTokenizationRequest,
+    EstimateRequest,
     RatsRequest,
+    RecordsTokenizationRequest,
+    RemoveDuplicates,
     Request,
+    RetokenizationRequest,
     ReuploadDocbins,
     SaveTokenizer,
+    TokenizerMigrationRequest,
+    TokenRequest,
 )
 from submodules.model.business_objects import general
 from submodules.model import enums
@@ -18,6 +30,11 @@ from submodules.model import session
 app = FastAPI()
 
 
+@app.on_event("shutdown")
+async def shutdown() -> None:
+    await record_dispatcher.shutdown()
+
+
 @app.middleware("http")
 async def handle_db_session(request: Request, call_next):
     session_token = general.get_ctx_token()
@@ -32,15 +49,44 @@ async def handle_db_session(request: Request, call_next):
 
 
 @app.post("/tokenize_record")
-def tokenize_record(request: Request) -> responses.PlainTextResponse:
-    tokenization_manager.tokenize_record(request.project_id, request.record_id)
+async def tokenize_record(request: Request) -> responses.PlainTextResponse:
+    try:
+        await record_dispatcher.submit(request.project_id, request.record_id)
+    except record_dispatcher.QueueFullError as e:
+        return responses.PlainTextResponse(
+            str(e), status_code=status.HTTP_429_TOO_MANY_REQUESTS
+        )
     return responses.PlainTextResponse(status_code=status.HTTP_200_OK)
 
 
+@app.post("/tokenize_records")
+def tokenize_records(request: RecordsTokenizationRequest) -> responses.JSONResponse:
+    status_by_record = tokenization_manager.tokenize_records(
+        request.project_id, request.record_ids
+    )
+    return responses.JSONResponse(
+        content={"status": status_by_record},
+        status_code=status.HTTP_200_OK,
+    )
+
+
+@app.post("/tokens")
+def get_tokens(request: TokenRequest) -> responses.JSONResponse:
+    tokens_by_record = token_reader.get_tokens(
+        request.project_id, request.record_ids, request.attribute_names
+    )
+    return responses.JSONResponse(
+        content={"tokens": tokens_by_record},
+        status_code=status.HTTP_200_OK,
+    )
+
+
 @app.post("/tokenize_calculated_attribute")
 def tokenize_calculated_attribute(
     request: AttributeTokenizationRequest,
 ) -> responses.PlainTextResponse:
+    if task_manager.is_tokenizer_migration_running(request.project_id):
+        return __migration_running_response()
     record_tokenization_task_id = task_manager.start_tokenization_task(
         request.project_id,
         request.user_id,
@@ -48,6 +94,7 @@ def tokenize_calculated_attribute(
         request.include_rats,
         False,
         request.attribute_id,
+        request.profile,
     )
     return responses.JSONResponse(
         content={"tokenization_task_id": str(record_tokenization_task_id)},
@@ -57,32 +104,117 @@ def tokenize_calculated_attribute(
 
 @app.post("/tokenize_project")
 def tokenize_project(request: Request) -> responses.PlainTextResponse:
+    # records added during a tokenizer migration are tokenized once it's done
+    if task_manager.is_tokenizer_migration_running(request.project_id):
+        return __migration_running_response()
     record_tokenization_task_id = task_manager.start_tokenization_task(
         request.project_id,
         request.user_id,
         enums.TokenizationTaskTypes.PROJECT.value,
         request.include_rats,
         request.only_uploaded_attributes,
+        profile=request.profile,
+    )
+    return responses.JSONResponse(
+        content={"tokenization_task_id": str(record_tokenization_task_id)},
+        status_code=status.HTTP_200_OK,
+    )
+
+
+@app.post("/retokenize_project")
+def retokenize_project(request: RetokenizationRequest) -> responses.JSONResponse:
+    # delta mode, only records whose content or tokenizer changed are tokenized again
+    if task_manager.is_tokenizer_migration_running(request.project_id):
+        return __migration_running_response()
+    record_tokenization_task_id = task_manager.start_retokenization_task(
+        request.project_id, request.user_id, request.include_rats, request.profile
+    )
+    return responses.JSONResponse(
+        content={"tokenization_task_id": str(record_tokenization_task_id)},
+        status_code=status.HTTP_200_OK,
     )
+
+
+@app.post("/migrate_tokenizer")
+def migrate_tokenizer(request: TokenizerMigrationRequest) -> responses.Response:
+    # docbins of the new tokenizer replace the current ones at once when all are done
+    record_tokenization_task_id = task_manager.start_tokenizer_migration_task(
+        request.project_id, request.user_id, request.tokenizer, request.profile
+    )
+    if not record_tokenization_task_id:
+        return responses.PlainTextResponse(
+            "Tokenizer already in use or tokenization running",
+            status_code=status.HTTP_409_CONFLICT,
+        )
     return responses.JSONResponse(
         content={"tokenization_task_id": str(record_tokenization_task_id)},
         status_code=status.HTTP_200_OK,
     )
 
 
+def __migration_running_response() -> responses.PlainTextResponse:
+    return responses.PlainTextResponse(
+        "Tokenizer migration running", status_code=status.HTTP_409_CONFLICT
+    )
+
+
+@app.post("/estimate_tokenization")
+def estimate_tokenization(request: EstimateRequest) -> responses.JSONResponse:
+    # pre-flight, samples the project without writing anything. With an attribute_id
+    # for tokenize_calculated_attribute, without for tokenize_project
+    return responses.JSONResponse(
+        content=cost_estimator.estimate_for_project(
+            request.project_id, request.attribute_id
+        ),
+        status_code=status.HTTP_200_OK,
+    )
+
+
+@app.get("/task_estimate/{project_id}/{task_id}")
+def get_task_estimate(project_id: str, task_id: str) -> responses.Response:
+    estimate = task_estimate.get(project_id, task_id)
+    if not estimate:
+        return responses.PlainTextResponse(status_code=status.HTTP_404_NOT_FOUND)
+    return responses.JSONResponse(content=estimate, status_code=status.HTTP_200_OK)
+
+
 # rats = record_attribute_token_statistics
 @app.post("/create_rats")
 def create_rats(request: RatsRequest) -> responses.PlainTextResponse:
     attribute_id = request.attribute_id if request.attribute_id != "" else None
     task_manager.start_rats_task(
-        request.project_id, request.user_id, False, attribute_id
+        request.project_id, request.user_id, False, attribute_id, request.profile
+    )
+    return responses.PlainTextResponse(status_code=status.HTTP_200_OK)
+
+
+@app.get("/token_statistics/{project_id}")
+def get_token_statistics(project_id: str) -> responses.Response:
+    # aggregates per text attribute, read only
+    return responses.JSONResponse(
+        content={"attributes": tokenization_manager.get_token_statistics(project_id)},
+        status_code=status.HTTP_200_OK,
     )
+
+
+@app.post("/token_statistics/{project_id}/refresh")
+def refresh_token_statistics(project_id: str) -> responses.PlainTextResponse:
+    # rebuilds the aggregates from the statistic rows, e.g. after records were deleted
+    tokenization_manager.refresh_token_statistics(project_id)
     return responses.PlainTextResponse(status_code=status.HTTP_200_OK)
 
 
+@app.put("/cancel_task/{project_id}/{task_id}")
+def cancel_task(project_id: str, task_id: str) -> responses.PlainTextResponse:
+    status_code = task_manager.cancel_task(project_id, task_id)
+    return responses.PlainTextResponse(status_code=status_code)
+
+
 @app.put("/tokenize_project_for_migration/{project_id}")
 def tokenize_project_no_use(project_id: str) -> responses.PlainTextResponse:
     user_id = util.get_migration_user()
+    if task_manager.is_tokenizer_migration_running(project_id):
+        return __migration_running_response()
     status_code = task_manager.start_tokenization_task(
         project_id, user_id, enums.TokenizationTaskTypes.PROJECT.value
     )
@@ -95,6 +227,12 @@ def reupload_docbins(request: ReuploadDocbins) -> responses.PlainTextResponse:
     return responses.PlainTextResponse(status_code=status.HTTP_200_OK)
 
 
+@app.post("/remove_duplicates")
+def remove_duplicates(request: RemoveDuplicates) -> responses.PlainTextResponse:
+    query.delete_duplicates(request.project_id)
+    return responses.PlainTextResponse(status_code=status.HTTP_200_OK)
+
+
 @app.post("/save_tokenizer")
 def save_tokenizer_as_pickle(request: SaveTokenizer) -> responses.PlainTextResponse:
     tokenizer_handler.save_tokenizer_as_pickle(request.config_string, request.overwrite)
@@ -103,7 +241,15 @@ def save_tokenizer_as_pickle(request: SaveTokenizer) -> responses.PlainTextRespo
 
 @app.put("/config_changed")
 def config_changed() -> responses.PlainTextResponse:
-    config_handler.refresh_config()
+    # returns once this process uses the new config, the other workers of serve.py
+    # reload it from the shared snapshot on their next access
+    try:
+        config_handler.refresh_config()
+    except Exception as e:
+        return responses.PlainTextResponse(
+            f"Config refresh failed: {e}",
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        )
     return responses.PlainTextResponse(status_code=status.HTTP_200_OK)
 
 
@@ -121,6 +267,9 @@ def healthcheck() -> responses.PlainTextResponse:
     return responses.PlainTextResponse(text, status_code=status_code)
 
 
+@app.get("/metrics")
+def metrics() -> responses.Response:
+    return responses.Response(metrics_util.generate(), media_type=CONTENT_TYPE_LATEST)
 
 
-session.start_session_cleanup_thread()
\ No newline at end of file
+session.start_session_cleanup_thread()
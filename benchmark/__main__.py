@@ -0,0 +1,108 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+from typing import Optional
+
+from benchmark import data, stubs
+
+
+def main() -> None:
+    args = __parse_args()
+    sink = stubs.NotificationSink()
+    os.environ["WS_NOTIFY_ENDPOINT"] = sink.endpoint
+    os.environ["CONFIG_SNAPSHOT_PATH"] = stubs.write_config_snapshot([args.tokenizer])
+    # service modules read the environment on import
+    from benchmark import pipeline
+    from misc import export, util
+
+    storage = stubs.FakeObjectStorage()
+    util.s3 = storage
+    export.s3 = storage
+
+    attribute_names = [f"text_{idx}" for idx in range(args.attributes)]
+    records = data.generate_records(
+        args.records,
+        attribute_names,
+        args.mean_words,
+        args.length_distribution,
+        args.duplication_ratio,
+        args.seed,
+    )
+    organization_id, user_id, project_id = pipeline.create_project(
+        records, attribute_names, args.tokenizer
+    )
+    results = {}
+    try:
+        results["tokenize_initial_project"] = pipeline.run_tokenize_initial_project(
+            project_id, user_id
+        )
+        pipeline.add_calculated_attribute(
+            project_id,
+            "calculated",
+            lambda record_data: record_data[attribute_names[0]][::-1],
+        )
+        results["tokenize_calculated_attribute"] = (
+            pipeline.run_tokenize_calculated_attribute(
+                project_id, user_id, "calculated"
+            )
+        )
+        results["create_rats_entries"] = pipeline.run_create_rats_entries(
+            project_id, user_id
+        )
+        results["put_data_in_minio_bucket"] = pipeline.run_put_data_in_minio_bucket(
+            project_id
+        )
+        results["put_data_in_minio_bucket"]["uploaded_bytes"] = storage.uploads[-1][
+            "bytes"
+        ]
+    finally:
+        if not args.keep_project:
+            pipeline.delete_project(organization_id, user_id, project_id)
+        sink.stop()
+
+    output = {
+        "commit": __get_commit(),
+        "python": platform.python_version(),
+        "config": vars(args),
+        "notifications_sent": sink.count,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=2)
+    print(json.dumps(output, indent=2), flush=True)
+
+
+def __parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Offline benchmark of the tokenization pipeline. "
+        "Needs POSTGRES pointing to a database with the refinery schema."
+    )
+    parser.add_argument("--records", type=int, default=5000)
+    parser.add_argument("--attributes", type=int, default=2)
+    parser.add_argument("--mean-words", type=int, default=50)
+    parser.add_argument(
+        "--length-distribution",
+        choices=["fixed", "uniform", "lognormal"],
+        default="lognormal",
+    )
+    parser.add_argument("--duplication-ratio", type=float, default=0.0)
+    parser.add_argument("--tokenizer", default="en_core_web_sm")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--keep-project", action="store_true")
+    return parser.parse_args()
+
+
+def __get_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+if __name__ == "__main__":
+    main()
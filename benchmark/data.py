@@ -0,0 +1,51 @@
+import math
+import random
+from typing import Any, Dict, List
+
+
+def generate_records(
+    record_count: int,
+    attribute_names: List[str],
+    mean_words: int,
+    length_distribution: str = "lognormal",
+    duplication_ratio: float = 0.0,
+    seed: int = 42,
+) -> List[Dict[str, Any]]:
+    # same arguments always produce the same records so runs are comparable across commits
+    rng = random.Random(seed)
+    vocabulary = __generate_vocabulary(rng, 5000)
+    records = []
+    for idx in range(record_count):
+        if records and rng.random() < duplication_ratio:
+            records.append({**rng.choice(records), "running_id": idx})
+            continue
+        data = {"running_id": idx}
+        for name in attribute_names:
+            word_count = __draw_length(rng, mean_words, length_distribution)
+            data[name] = " ".join(rng.choice(vocabulary) for _ in range(word_count))
+        records.append(data)
+    return records
+
+
+def __draw_length(rng: random.Random, mean_words: int, distribution: str) -> int:
+    if distribution == "fixed":
+        return mean_words
+    if distribution == "uniform":
+        return rng.randint(1, 2 * mean_words)
+    if distribution == "lognormal":
+        # long tail similar to real uploads, a few documents are much longer than the mean
+        sigma = 1.0
+        mu = math.log(mean_words) - sigma**2 / 2
+        return max(1, int(rng.lognormvariate(mu, sigma)))
+    raise ValueError(f"Unknown length distribution {distribution}")
+
+
+def __generate_vocabulary(rng: random.Random, size: int) -> List[str]:
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    vocabulary = []
+    for _ in range(size):
+        word = "".join(rng.choice(letters) for _ in range(rng.randint(1, 10)))
+        if rng.random() < 0.1:
+            word += rng.choice([".", ",", "!", "?"])
+        vocabulary.append(word)
+    return vocabulary
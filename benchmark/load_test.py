@@ -0,0 +1,267 @@
+import argparse
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+import requests
+
+from benchmark import data, stubs
+from benchmark.postgres import DisposablePostgres
+
+# HTTP load test of the service with local stand-ins for everything around it:
+# refinery-config (config snapshot), websocket notifier (sink), object storage (in
+# memory) and postgres (docker container unless --postgres is given).
+# python -m benchmark.load_test --help
+
+ENDPOINTS = [
+    "tokenize_record",
+    "tokenize_project",
+    "tokenize_calculated_attribute",
+    "create_rats",
+]
+
+
+def main() -> None:
+    args = __parse_args()
+    mix = __parse_mix(args.mix)
+    postgres = None
+    if args.postgres:
+        os.environ["POSTGRES"] = args.postgres
+    else:
+        postgres = DisposablePostgres()
+        os.environ["POSTGRES"] = postgres.start()
+    sink = stubs.NotificationSink()
+    os.environ["WS_NOTIFY_ENDPOINT"] = sink.endpoint
+    os.environ["CONFIG_SNAPSHOT_PATH"] = stubs.write_config_snapshot([args.tokenizer])
+    service = None
+    projects = []
+    try:
+        # service modules read the environment on import
+        from benchmark import pipeline
+
+        if not args.postgres:
+            __create_schema()
+        for seed in range(args.projects):
+            projects.append(__create_project(pipeline, args, seed))
+
+        port = __get_free_port()
+        service = subprocess.Popen(
+            [sys.executable, "-m", "benchmark.stub_app", str(port)],
+            env=os.environ.copy(),
+        )
+        base_url = f"http://127.0.0.1:{port}"
+        __wait_for_service(base_url)
+
+        stats_before = requests.get(f"{base_url}/loadtest/stats").json()
+        latencies, status_counts, wall = __run_load(
+            base_url, projects, mix, args.concurrency, args.duration, args.seed
+        )
+        stats_after = requests.get(f"{base_url}/loadtest/stats").json()
+    finally:
+        if service:
+            service.terminate()
+            service.wait()
+        if args.postgres:
+            for project_item in projects:
+                pipeline.delete_project(
+                    project_item["organization_id"],
+                    project_item["user_id"],
+                    project_item["project_id"],
+                )
+        sink.stop()
+        if postgres:
+            postgres.stop()
+
+    request_count = sum(len(values) for values in latencies.values())
+    output = {
+        "config": vars(args),
+        "requests": request_count,
+        "wall_seconds": round(wall, 2),
+        "requests_per_second": round(request_count / wall, 2),
+        "db_queries": stats_after["queries"] - stats_before["queries"],
+        "db_queries_per_request": (
+            round((stats_after["queries"] - stats_before["queries"]) / request_count, 2)
+            if request_count
+            else None
+        ),
+        "peak_rss_bytes": stats_after["peak_rss_bytes"],
+        "notifications_sent": sink.count,
+        "endpoints": {
+            endpoint: {
+                "requests": len(values),
+                "status": status_counts[endpoint],
+                **__get_percentiles(values),
+            }
+            for endpoint, values in latencies.items()
+        },
+    }
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=2)
+    print(json.dumps(output, indent=2), flush=True)
+
+
+def __create_schema() -> None:
+    from submodules.model import models
+    from submodules.model.session import session
+
+    models.Base.metadata.create_all(session.get_bind())
+
+
+def __create_project(pipeline: Any, args: argparse.Namespace, seed: int) -> Dict:
+    from submodules.model.business_objects import attribute
+
+    attribute_names = [f"text_{idx}" for idx in range(args.attributes)]
+    records = data.generate_records(
+        args.records, attribute_names, args.mean_words, seed=args.seed + seed
+    )
+    organization_id, user_id, project_id = pipeline.create_project(
+        records, attribute_names, args.tokenizer
+    )
+    pipeline.add_calculated_attribute(
+        project_id,
+        "calculated",
+        lambda record_data: record_data[attribute_names[0]][::-1],
+    )
+    return {
+        "organization_id": organization_id,
+        "project_id": project_id,
+        "user_id": user_id,
+        "attribute_id": str(attribute.get_by_name(project_id, "calculated").id),
+        "record_ids": pipeline.get_record_ids(project_id),
+    }
+
+
+def __run_load(
+    base_url: str,
+    projects: List[Dict],
+    mix: Dict[str, float],
+    concurrency: int,
+    duration: float,
+    seed: int,
+) -> Any:
+    latencies = {endpoint: [] for endpoint in mix}
+    status_counts = {endpoint: {} for endpoint in mix}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def drive(worker: int) -> None:
+        rng = random.Random(seed + worker)
+        http = requests.Session()
+        endpoints, weights = zip(*mix.items())
+        while time.monotonic() < deadline:
+            endpoint = rng.choices(endpoints, weights)[0]
+            project_item = rng.choice(projects)
+            start = time.perf_counter()
+            response = http.post(
+                f"{base_url}/{endpoint}",
+                json=__get_payload(endpoint, project_item, rng),
+            )
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies[endpoint].append(elapsed)
+                code = str(response.status_code)
+                status_counts[endpoint][code] = status_counts[endpoint].get(code, 0) + 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(drive, range(concurrency)))
+    return latencies, status_counts, time.perf_counter() - start
+
+
+def __get_payload(
+    endpoint: str, project_item: Dict, rng: random.Random
+) -> Dict[str, Any]:
+    payload = {
+        "project_id": project_item["project_id"],
+        "user_id": project_item["user_id"],
+    }
+    if endpoint in ["tokenize_record", "tokenize_project"]:
+        payload["record_id"] = rng.choice(project_item["record_ids"])
+        payload["include_rats"] = True
+        payload["only_uploaded_attributes"] = False
+    elif endpoint == "tokenize_calculated_attribute":
+        payload["attribute_id"] = project_item["attribute_id"]
+        payload["include_rats"] = True
+    elif endpoint == "create_rats":
+        payload["attribute_id"] = ""
+    return payload
+
+
+def __get_percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    values = sorted(values)
+    result = {}
+    for percentile in [50, 90, 95, 99]:
+        # nearest rank
+        idx = max(0, math.ceil(len(values) * percentile / 100) - 1)
+        result[f"p{percentile}_ms"] = round(values[idx] * 1000, 2)
+    result["max_ms"] = round(values[-1] * 1000, 2)
+    return result
+
+
+def __parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        endpoint, weight = part.split("=")
+        if endpoint not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint {endpoint}, use one of {ENDPOINTS}")
+        weights[endpoint] = float(weight)
+    return weights
+
+
+def __get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def __wait_for_service(base_url: str, timeout: int = 120) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"{base_url}/healthcheck", timeout=2).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    raise TimeoutError("Service didn't start")
+
+
+def __parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="HTTP load test of the tokenizer with local service stand-ins."
+    )
+    parser.add_argument(
+        "--postgres",
+        help="url of an existing database with the refinery schema, "
+        "by default a disposable docker container is started",
+    )
+    parser.add_argument("--projects", type=int, default=2)
+    parser.add_argument("--records", type=int, default=2000)
+    parser.add_argument("--attributes", type=int, default=2)
+    parser.add_argument("--mean-words", type=int, default=50)
+    parser.add_argument("--tokenizer", default="en_core_web_sm")
+    parser.add_argument(
+        "--mix",
+        default="tokenize_record=90,tokenize_project=4,"
+        "tokenize_calculated_attribute=2,create_rats=4",
+        help="relative weights of the endpoints",
+    )
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=60, help="seconds")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="load-test-results.json")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
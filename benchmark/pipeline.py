@@ -0,0 +1,201 @@
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from controller import rats_manager, tokenization_manager
+from misc import metrics, util
+from submodules.model import enums
+from submodules.model.business_objects import general, record, tokenization
+from submodules.model.models import Attribute, Organization, Project, Record, User
+from submodules.model.session import session
+
+
+def create_project(
+    records: List[Dict[str, Any]], attribute_names: List[str], tokenizer: str
+) -> Tuple[str, str, str]:
+    organization_item = Organization(name=f"benchmark-{uuid.uuid4()}")
+    general.add(organization_item)
+    general.flush()
+    user_item = User(id=uuid.uuid4(), organization_id=organization_item.id)
+    project_item = Project(
+        organization_id=organization_item.id,
+        name="tokenizer benchmark",
+        description="synthetic project created by the benchmark suite",
+        tokenizer=tokenizer,
+        tokenizer_blank=tokenizer[:2],
+    )
+    general.add_all([user_item, project_item])
+    general.flush()
+    add_attributes(project_item.id, ["running_id"], enums.DataTypes.INTEGER.value)
+    add_attributes(project_item.id, attribute_names, enums.DataTypes.TEXT.value)
+    general.add_all(
+        [
+            Record(project_id=project_item.id, data=data, category="SCALE")
+            for data in records
+        ]
+    )
+    general.commit()
+    return str(organization_item.id), str(user_item.id), str(project_item.id)
+
+
+def add_attributes(project_id: str, names: List[str], data_type: str) -> None:
+    general.add_all(
+        [
+            Attribute(
+                project_id=project_id,
+                name=name,
+                data_type=data_type,
+                is_primary_key=False,
+                relative_position=idx,
+                user_created=False,
+                state=enums.AttributeState.UPLOADED.value,
+            )
+            for idx, name in enumerate(names)
+        ]
+    )
+
+
+def add_calculated_attribute(
+    project_id: str, name: str, values_by_record: Callable[[Dict[str, Any]], str]
+) -> None:
+    for record_item in session.query(Record).filter(Record.project_id == project_id):
+        # reassign so the json column is recognized as changed
+        record_item.data = {
+            **record_item.data,
+            name: values_by_record(record_item.data),
+        }
+    general.add(
+        Attribute(
+            project_id=project_id,
+            name=name,
+            data_type=enums.DataTypes.TEXT.value,
+            is_primary_key=False,
+            relative_position=999,
+            user_created=True,
+            state=enums.AttributeState.USABLE.value,
+        )
+    )
+    general.commit()
+
+
+def get_record_ids(project_id: str) -> List[str]:
+    return [
+        str(row.id)
+        for row in session.query(Record.id).filter(Record.project_id == project_id)
+    ]
+
+
+def delete_project(organization_id: str, user_id: str, project_id: str) -> None:
+    session.query(Project).filter(Project.id == project_id).delete()
+    session.query(User).filter(User.id == user_id).delete()
+    session.query(Organization).filter(Organization.id == organization_id).delete()
+    general.commit()
+
+
+def run_tokenize_initial_project(project_id: str, user_id: str) -> Dict[str, Any]:
+    initial_count = record.count_records_without_tokenization(project_id)
+    task = __create_task(project_id, user_id, enums.TokenizerTask.TYPE_DOC_BIN.value)
+    result = __measure(
+        metrics.TASK_TYPE_PROJECT,
+        initial_count,
+        tokenization_manager.tokenize_initial_project,
+        project_id,
+        user_id,
+        str(task.id),
+        initial_count,
+        False,
+        False,
+    )
+    result["state"] = tokenization.get(project_id, str(task.id)).state
+    return result
+
+
+def run_tokenize_calculated_attribute(
+    project_id: str, user_id: str, attribute_name: str
+) -> Dict[str, Any]:
+    initial_count = record.get_count_all_records(project_id)
+    task = __create_task(
+        project_id,
+        user_id,
+        enums.TokenizerTask.TYPE_DOC_BIN.value,
+        enums.RecordTokenizationScope.ATTRIBUTE.value,
+        attribute_name,
+    )
+    result = __measure(
+        metrics.TASK_TYPE_ATTRIBUTE,
+        initial_count,
+        tokenization_manager.tokenize_calculated_attribute,
+        project_id,
+        user_id,
+        str(task.id),
+        initial_count,
+        attribute_name,
+        False,
+    )
+    result["state"] = tokenization.get(project_id, str(task.id)).state
+    return result
+
+
+def run_create_rats_entries(project_id: str, user_id: str) -> Dict[str, Any]:
+    initial_count = record.count_missing_rats_records(project_id)
+    task = __create_task(
+        project_id, user_id, enums.TokenizerTask.TYPE_TOKEN_STATISTICS.value
+    )
+    result = __measure(
+        metrics.TASK_TYPE_RATS,
+        initial_count,
+        rats_manager.create_rats_entries,
+        project_id,
+        user_id,
+        str(task.id),
+        initial_count,
+    )
+    result["state"] = tokenization.get(project_id, str(task.id)).state
+    return result
+
+
+def run_put_data_in_minio_bucket(project_id: str) -> Dict[str, Any]:
+    return __measure(
+        "export",
+        record.get_count_all_records(project_id),
+        util.put_data_in_minio_bucket,
+        project_id,
+        ["running_id"],
+    )
+
+
+def __create_task(
+    project_id: str,
+    user_id: str,
+    type: str,
+    scope: str = enums.RecordTokenizationScope.PROJECT.value,
+    attribute_name: Optional[str] = None,
+) -> Any:
+    return tokenization.create_tokenization_task(
+        project_id,
+        user_id,
+        type,
+        scope=scope,
+        attribute_name=attribute_name,
+        with_commit=True,
+    )
+
+
+def __measure(task_type: str, record_count: int, fn: Callable, *args) -> Dict[str, Any]:
+    stages_before = metrics.get_stage_seconds(task_type)
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    fn(*args)
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    stages_after = metrics.get_stage_seconds(task_type)
+    return {
+        "records": record_count,
+        "wall_seconds": round(wall, 4),
+        "cpu_seconds": round(cpu, 4),
+        "records_per_second": round(record_count / wall, 2) if wall else None,
+        "stages": {
+            stage: round(seconds - stages_before.get(stage, 0), 4)
+            for stage, seconds in stages_after.items()
+        },
+    }
@@ -0,0 +1,50 @@
+import resource
+import sys
+import threading
+
+import uvicorn
+from fastapi import responses
+from sqlalchemy import event
+
+from benchmark import stubs
+
+# the service as started by the load test: the real app with object storage replaced
+# and an extra route reporting query count and peak memory of this process.
+# Config and notifier stand-ins are passed in through the environment.
+
+__query_count = 0
+__lock = threading.Lock()
+
+
+def main(port: int) -> None:
+    from app import app
+    from misc import export, util
+    from submodules.model.session import session
+
+    storage = stubs.FakeObjectStorage()
+    util.s3 = storage
+    export.s3 = storage
+    event.listen(session.get_bind(), "before_cursor_execute", __count_query)
+
+    @app.get("/loadtest/stats")
+    def stats() -> responses.JSONResponse:
+        return responses.JSONResponse(
+            content={
+                "queries": __query_count,
+                "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                * 1024,
+                "uploads": len(storage.uploads),
+            }
+        )
+
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def __count_query(*args) -> None:
+    global __query_count
+    with __lock:
+        __query_count += 1
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]))
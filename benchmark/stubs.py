@@ -0,0 +1,67 @@
+import json
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+
+# local stand-ins for the services around the tokenizer, nothing leaves the machine
+
+
+class NotificationSink:
+    def __init__(self) -> None:
+        self.count = 0
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self) -> None:
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                sink.count += 1
+                self.send_response(200)
+                self.end_headers()
+
+            def log_message(self, *args) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def endpoint(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def stop(self) -> None:
+        self.server.shutdown()
+
+
+class FakeObjectStorage:
+    def __init__(self) -> None:
+        self.uploads: List[Dict[str, Any]] = []
+        self.objects: Dict[str, str] = {}
+
+    def upload_tokenizer_data(self, org_id: str, project_id: str, data: Any) -> None:
+        if isinstance(data, (str, bytes)):
+            size = len(data)
+        else:
+            size = len(json.dumps(data, default=str))
+        self.uploads.append({"project_id": str(project_id), "bytes": size})
+
+    def put_object(self, bucket: str, object_name: str, data: str) -> None:
+        self.objects[object_name] = data
+
+    def object_exists(self, bucket: str, object_name: str) -> bool:
+        return object_name in self.objects
+
+    def get_object(self, bucket: str, object_name: str) -> str:
+        return self.objects[object_name]
+
+    def delete_object(self, bucket: str, object_name: str) -> None:
+        self.objects.pop(object_name, None)
+
+
+def write_config_snapshot(spacy_downloads: List[str]) -> str:
+    # picked up by the config handler instead of asking refinery-config
+    fd, path = tempfile.mkstemp(prefix="tokenizer-bench-config-", suffix=".json")
+    with os.fdopen(fd, "w") as f:
+        json.dump({"spacy_downloads": spacy_downloads}, f)
+    return path
@@ -1,10 +1,12 @@
 import pytest
 from fastapi.testclient import TestClient
 from typing import Iterator
-from app import app
 
 
 @pytest.fixture
 def client() -> Iterator[TestClient]:
+    # imported here so tests that don't need the app (or the submodules) still collect
+    from app import app
+
     with TestClient(app) as client:
         yield client
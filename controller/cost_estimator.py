@@ -0,0 +1,133 @@
+import json
+import os
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+from spacy.language import Language
+
+from controller.tokenizer import get_doc_bin_dry_run, get_text_length
+from handler.tokenizer_handler import get_tokenizer_by_project
+from misc import export, metrics, query
+from submodules.model.business_objects import attribute, record
+
+# pre-flight estimate of a tokenization task from a random sample of the project.
+# Sizes are what the task adds: for an attribute task the docbin growth of that attribute
+ESTIMATE_SAMPLE_SIZE = int(os.getenv("ESTIMATE_SAMPLE_SIZE", 200))
+# the sample delays the start of a task, so tasks only estimate themselves on request
+ESTIMATE_ON_TASK_START = os.getenv("TASK_ESTIMATE_ON_START", "false").lower() == "true"
+# records per chunk in tokenization_manager, their docbins are held until the chunk is written
+CHUNK_SIZE = 500
+
+
+def estimate_for_project(
+    project_id: str, attribute_id: Optional[str] = None
+) -> Dict[str, Any]:
+    # same scope and record count a task started now would have
+    if attribute_id:
+        task_type = metrics.TASK_TYPE_ATTRIBUTE
+        text_attributes = [attribute.get(project_id, attribute_id).name]
+        record_count = record.get_count_all_records(project_id)
+    else:
+        task_type = metrics.TASK_TYPE_PROJECT
+        text_attributes = list(attribute.get_text_attributes(project_id).keys())
+        record_count = record.count_records_without_tokenization(project_id)
+    return estimate(
+        project_id,
+        get_tokenizer_by_project(project_id),
+        task_type,
+        text_attributes,
+        list(attribute.get_non_text_attributes(project_id).keys()),
+        record_count,
+    )
+
+
+def estimate(
+    project_id: str,
+    tokenizer: Language,
+    task_type: str,
+    text_attributes: List[str],
+    non_text_attributes: List[str],
+    record_count: int,
+) -> Dict[str, Any]:
+    # a project task only tokenizes the records without docbin
+    records = query.get_sample_records(
+        project_id,
+        ESTIMATE_SAMPLE_SIZE,
+        record_count,
+        only_untokenized=task_type == metrics.TASK_TYPE_PROJECT,
+    )
+    sample_size = len(records)
+    if not sample_size:
+        return __to_estimate(record_count, 0, 0, 0, metrics.get_rss_bytes(), 0, 0)
+
+    rows = []
+    start = time.perf_counter()
+    for record_item in records:
+        rows.append(
+            SimpleNamespace(
+                record_id=record_item.id,
+                columns=text_attributes,
+                bytes=get_doc_bin_dry_run(tokenizer, record_item, text_attributes),
+                data={key: record_item.data.get(key) for key in non_text_attributes},
+            )
+        )
+    seconds_per_record = (time.perf_counter() - start) / sample_size
+    seconds_per_record *= __get_overhead_factor(task_type)
+
+    characters = sum(get_text_length(r, text_attributes) for r in records)
+    doc_bin_bytes = sum(len(row.bytes) for row in rows) / sample_size
+    shard, index = export.build_shard(rows)
+    export_bytes = (len(shard) + len(str(index))) / sample_size
+    # from serialized sizes, the task fetches all records at once and holds the docbins
+    # of a chunk. A lower bound, python objects add their overhead on top
+    record_bytes = (
+        sum(len(json.dumps(r.data, default=str).encode()) for r in records)
+        / sample_size
+    )
+    peak_memory_bytes = (
+        metrics.get_rss_bytes()
+        + record_count * record_bytes
+        + CHUNK_SIZE * doc_bin_bytes
+        + max(len(row.bytes) for row in rows)
+    )
+    return __to_estimate(
+        record_count,
+        sample_size,
+        characters / sample_size,
+        seconds_per_record,
+        peak_memory_bytes,
+        doc_bin_bytes,
+        export_bytes,
+    )
+
+
+def __get_overhead_factor(task_type: str) -> float:
+    # the sample only tokenizes and serializes, chunks of earlier tasks of this process
+    # show how much fetching, writing and exporting add on top
+    seconds = metrics.get_stage_seconds(task_type)
+    timed = seconds.get("tokenize", 0) + seconds.get("serialize", 0)
+    if not timed:
+        return 1.0
+    return max(sum(seconds.values()) / timed, 1.0)
+
+
+def __to_estimate(
+    record_count: int,
+    sample_size: int,
+    mean_characters: float,
+    seconds_per_record: float,
+    peak_memory_bytes: float,
+    doc_bin_bytes: float,
+    export_bytes: float,
+) -> Dict[str, Any]:
+    return {
+        "records": record_count,
+        "sample_size": sample_size,
+        "mean_characters": round(mean_characters, 2),
+        "seconds_per_record": round(seconds_per_record, 6),
+        "wall_seconds": round(seconds_per_record * record_count, 2),
+        "peak_memory_bytes": int(peak_memory_bytes),
+        "doc_bin_bytes": int(doc_bin_bytes * record_count),
+        "export_bytes": int(export_bytes * record_count),
+    }
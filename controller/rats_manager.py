@@ -1,16 +1,19 @@
-import time
 import traceback
 from datetime import datetime
 from typing import Optional
 
-from misc import daemon
+from misc import (
+    cancellation,
+    metrics,
+    query,
+    rats_request,
+    task_queue,
+    token_statistics,
+)
 from submodules.model import enums
 from misc.notification import (
     send_notification_created,
 )
-from submodules.model import (
-    RecordAttributeTokenStatistics,
-)
 from submodules.model.enums import AttributeState
 from submodules.model.business_objects import (
     project,
@@ -21,35 +24,80 @@ from submodules.model.business_objects import (
     notification,
 )
 from handler.tokenizer_handler import get_tokenizer_by_project
+from misc.progress import ProgressTracker
 from misc.util import get_docs_from_db, send_websocket_update
 from submodules.model.models import RecordTokenizationTask
 
 
+def request_after_doc_bin_creation(
+    project_id: str,
+    user_id: str,
+    only_uploaded_attributes: bool = False,
+    attribute_id: Optional[str] = None,
+    profile: bool = False,
+) -> None:
+    rats_request.add(
+        project_id, user_id, only_uploaded_attributes, attribute_id, profile
+    )
+    general.commit()
+    # the last docbin task may have ended between the caller's check and the commit
+    start_requested_rats(project_id)
+
+
+def start_requested_rats(project_id: str) -> None:
+    # called by every docbin task when it ends, whether it finished or not
+    if tokenization.is_doc_bin_creation_running_or_queued(project_id):
+        return
+    requests = rats_request.pop(project_id)
+    general.commit()
+    for request in requests:
+        trigger_rats_creation(
+            project_id,
+            str(request.user_id),
+            only_uploaded_attributes=request.only_uploaded_attributes,
+            attribute_id=str(request.attribute_id) if request.attribute_id else None,
+            profile=request.profile,
+        )
+
+
 def trigger_rats_creation(
     project_id: str,
     user_id: str,
     tokenization_task: Optional[RecordTokenizationTask] = None,
     only_uploaded_attributes: bool = False,
+    attribute_id: Optional[str] = None,
+    profile: bool = False,
 ) -> None:
-    initial_count = record.count_missing_rats_records(project_id)
+    initial_count = record.count_missing_rats_records(project_id, attribute_id)
     if initial_count == 0:
         return
+    if tokenization_task:
+        scope = tokenization_task.scope
+        attribute_name = tokenization_task.attribute_name
+    elif attribute_id:
+        scope = enums.RecordTokenizationScope.ATTRIBUTE.value
+        attribute_name = attribute.get(project_id, attribute_id).name
+    else:
+        scope = enums.RecordTokenizationScope.PROJECT.value
+        attribute_name = None
     task = tokenization.create_tokenization_task(
         project_id,
         user_id,
         enums.TokenizerTask.TYPE_TOKEN_STATISTICS.value,
-        scope=tokenization_task.scope,
-        attribute_name=tokenization_task.attribute_name,
+        scope=scope,
+        attribute_name=attribute_name,
         with_commit=True,
     )
-    daemon.run(
+    task_queue.run_task(
+        str(task.id),
+        profile,
         create_rats_entries,
         project_id,
         user_id,
         str(task.id),
         initial_count,
         only_uploaded_attributes,
-        None,
+        attribute_id,
     )
 
 
@@ -66,17 +114,13 @@ def create_rats_entries(
     if not project.get(project_id):
         # project was deleted in the meantime
         return
+    cancelled = cancellation.register(task_id)
+    chunk_metrics = metrics.ChunkMetrics(metrics.TASK_TYPE_RATS)
     try:
+        # only started once docbin creation committed (see finalize_task), no need to wait
         tokenization_task = __set_up_statistic_calculation(
             project_id, task_id, initial_count
         )
-        i = 0
-        while initial_count > record.count_tokenized_records(project_id):
-            if i > 9:
-                print("Docbins missing", flush=True)
-                raise Exception("Docbins missing")
-            time.sleep(1)
-            i += 1
         if attribute_id:
             text_attribute = attribute.get(project_id, attribute_id)
             text_attributes = {text_attribute.name: text_attribute.id}
@@ -98,44 +142,65 @@ def create_rats_entries(
                     ],
                 )
         vocab = get_tokenizer_by_project(project_id).vocab
-        record_set = record.get_missing_rats_records(project_id, attribute_id, 100)
+        with chunk_metrics.stage("fetch"):
+            record_set = record.get_missing_rats_records(project_id, attribute_id, 100)
+        progress_tracker = ProgressTracker(project_id, task_id, "rats", initial_count)
         chunk = 0
         while record_set:
             entries = []
             if len(text_attributes) == 0:
                 break
             for record_item in record_set:
-                docs = get_docs_from_db(record_item, vocab)
+                if cancelled.is_set():
+                    break
+                with chunk_metrics.stage("deserialize"):
+                    docs = get_docs_from_db(record_item, vocab, project_id)
                 attribute_ids = [str(id) for id in record_item.attribute_ids]
+                num_tokens = 0
                 for col in text_attributes:
                     if text_attributes[col] in attribute_ids:
+                        num_tokens += len(docs[col])
                         entries.append(
-                            RecordAttributeTokenStatistics(
-                                project_id=project_id,
-                                record_id=record_item.record_id,
-                                attribute_id=text_attributes[col],
-                                num_token=len(docs[col]),
-                            )
+                            {
+                                "project_id": project_id,
+                                "record_id": record_item.record_id,
+                                "attribute_id": text_attributes[col],
+                                "num_token": len(docs[col]),
+                            }
                         )
-            if not project.get(project_id):
-                # rats cant be added (e.g. project deleted)
+                chunk_metrics.add_record(num_tokens)
+            if cancelled.is_set() or not project.get(project_id):
+                # rats cant be added (e.g. task cancelled or project deleted)
                 break
             else:
-                general.add_all(entries)
-                general.commit()
+                with chunk_metrics.stage("db_write"):
+                    query.upsert_token_statistics(entries)
+                    token_statistics.merge_entries(project_id, entries)
+                    general.commit()
             if chunk % 20 == 0:
                 # ensure session isn't used up to refresh occasionally
                 session_token = general.remove_and_refresh_session(session_token, True)
                 tokenization_task = tokenization.get(project_id, task_id)
-                __update_progress(
-                    project_id, attribute_id, tokenization_task, initial_count
+            with chunk_metrics.stage("notify"):
+                progress_tracker.add(len(record_set))
+            chunk_metrics.observe()
+            with chunk_metrics.stage("fetch"):
+                record_set = record.get_missing_rats_records(
+                    project_id, attribute_id, 100
                 )
-            record_set = record.get_missing_rats_records(project_id, attribute_id, 100)
             chunk += 1
-        __finalize_rats_calculation(project_id, user_id, tokenization_task)
+        if cancelled.is_set():
+            send_websocket_update(
+                project_id,
+                False,
+                ["rats", "state", enums.TokenizerTask.STATE_FAILED.value],
+            )
+        else:
+            __finalize_rats_calculation(project_id, user_id, tokenization_task)
     except Exception:
         __handle_error(project_id, user_id, task_id)
     finally:
+        cancellation.unregister(task_id)
         general.remove_and_refresh_session(session_token, False)
 
 
@@ -150,24 +215,9 @@ def __set_up_statistic_calculation(
     return tokenization_task
 
 
-def __update_progress(
-    project_id: str,
-    attribute_id: str,
-    tokenization_task: RecordTokenizationTask,
-    initial_count: int,
-) -> None:
-    current_count = record.count_missing_rats_records(project_id, attribute_id)
-    tokenization_task.progress = round(1 - current_count / initial_count, 4)
-    send_websocket_update(
-        project_id, True, ["rats", "progress", str(tokenization_task.progress)]
-    )
-    general.commit()
-
-
 def __finalize_rats_calculation(
     project_id: str, user_id: str, tokenization_task: RecordTokenizationTask
 ) -> None:
-    record.delete_duplicated_rats()
     tokenization_task.progress = 1
     send_websocket_update(
         project_id, False, ["rats", "progress", str(tokenization_task.progress)]
@@ -0,0 +1,111 @@
+import asyncio
+import os
+import traceback
+from typing import Dict, List, Set, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+from controller import tokenization_manager
+from misc import metrics
+from submodules.model.business_objects import general
+
+# on-demand requests of the same project arriving within the window are tokenized together
+BATCH_WINDOW = int(os.getenv("TOKENIZE_RECORD_BATCH_WINDOW_MS", 20)) / 1000
+MAX_BATCH_SIZE = int(os.getenv("TOKENIZE_RECORD_MAX_BATCH_SIZE", 64))
+MAX_QUEUED_RECORDS = int(os.getenv("TOKENIZE_RECORD_MAX_QUEUED", 1000))
+
+__pending_by_project: Dict[str, List[Tuple[str, asyncio.Future]]] = {}
+# window timer of the pending batch, cancelled when the batch is flushed by size
+__timer_by_project: Dict[str, asyncio.TimerHandle] = {}
+# batches being tokenized, referenced until done so they are not garbage collected
+__running_batches: Set[asyncio.Task] = set()
+__queued_count = 0
+
+
+class QueueFullError(Exception):
+    pass
+
+
+async def submit(project_id: str, record_id: str) -> int:
+    global __queued_count
+    if __queued_count >= MAX_QUEUED_RECORDS:
+        raise QueueFullError(
+            f"Too many records queued for tokenization ({__queued_count})"
+        )
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    __queued_count += 1
+    metrics.RECORD_QUEUE_DEPTH.inc()
+
+    pending = __pending_by_project.get(project_id)
+    if pending is None:
+        pending = []
+        __pending_by_project[project_id] = pending
+        __timer_by_project[project_id] = loop.call_later(
+            BATCH_WINDOW, __flush, project_id
+        )
+    pending.append((record_id, future))
+    if len(pending) >= MAX_BATCH_SIZE:
+        __flush(project_id)
+    return await future
+
+
+def __flush(project_id: str) -> None:
+    pending = __pending_by_project.pop(project_id, None)
+    timer = __timer_by_project.pop(project_id, None)
+    if timer:
+        timer.cancel()
+    if pending:
+        batch = asyncio.ensure_future(__process(project_id, pending))
+        __running_batches.add(batch)
+        batch.add_done_callback(__batch_done)
+
+
+def __batch_done(batch: asyncio.Task) -> None:
+    __running_batches.discard(batch)
+    if not batch.cancelled() and batch.exception():
+        exception = batch.exception()
+        print(
+            "".join(
+                traceback.format_exception(
+                    type(exception), exception, exception.__traceback__
+                )
+            ),
+            flush=True,
+        )
+
+
+async def shutdown() -> None:
+    # flush the open windows and wait for every batch so no request is left hanging
+    for project_id in list(__pending_by_project):
+        __flush(project_id)
+    if __running_batches:
+        await asyncio.gather(*__running_batches, return_exceptions=True)
+
+
+async def __process(project_id: str, pending: List[Tuple[str, asyncio.Future]]) -> None:
+    global __queued_count
+    record_ids = [record_id for record_id, _ in pending]
+    try:
+        status_by_record = await run_in_threadpool(
+            __tokenize_batch, project_id, record_ids
+        )
+    except Exception:
+        print(traceback.format_exc(), flush=True)
+        status_by_record = {}
+    finally:
+        __queued_count -= len(pending)
+        metrics.RECORD_QUEUE_DEPTH.dec(len(pending))
+
+    for record_id, future in pending:
+        if not future.done():
+            future.set_result(status_by_record.get(record_id, 418))
+
+
+def __tokenize_batch(project_id: str, record_ids: List[str]) -> Dict[str, int]:
+    # runs in a worker thread so it needs its own session
+    session_token = general.get_ctx_token()
+    try:
+        return tokenization_manager.tokenize_records(project_id, record_ids)
+    finally:
+        general.remove_and_refresh_session(session_token)
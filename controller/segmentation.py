@@ -0,0 +1,76 @@
+import os
+from typing import Iterable, List, Optional
+
+from spacy.language import Language
+from spacy.tokens import Doc
+
+# texts longer than this (in characters) are tokenized in segments and stitched together
+LONG_TEXT_THRESHOLD = int(os.getenv("LONG_TEXT_THRESHOLD", 100_000))
+# > 1 tokenizes the segments of a long text in worker processes
+LONG_TEXT_PROCESSES = int(os.getenv("LONG_TEXT_PROCESSES", 1))
+
+
+def tokenize_text(
+    tokenizer: Language, text: str, threshold: int = LONG_TEXT_THRESHOLD
+) -> Doc:
+    if len(text) <= threshold:
+        return tokenizer(text)
+    segments = split_text(text, threshold)
+    docs = list(tokenizer.pipe(segments, n_process=LONG_TEXT_PROCESSES))
+    return Doc.from_docs(docs, ensure_whitespace=False)
+
+
+def tokenize_texts(
+    tokenizer: Language, texts: Iterable[str], threshold: int = LONG_TEXT_THRESHOLD
+) -> List[Doc]:
+    texts = list(texts)
+    docs = [None] * len(texts)
+    short_idx = [idx for idx, text in enumerate(texts) if len(text) <= threshold]
+    for idx, doc in zip(short_idx, tokenizer.pipe(texts[idx] for idx in short_idx)):
+        docs[idx] = doc
+    for idx, text in enumerate(texts):
+        if docs[idx] is None:
+            docs[idx] = tokenize_text(tokenizer, text, threshold)
+    return docs
+
+
+def split_text(text: str, max_length: int) -> List[str]:
+    segments = []
+    start = 0
+    while len(text) - start > max_length:
+        end = __find_boundary(text, start, start + max_length)
+        if end is None:
+            # no safe boundary (e.g. one huge token), keep the rest in one piece
+            break
+        segments.append(text[start:end])
+        start = end
+    segments.append(text[start:])
+    return segments
+
+
+def __find_boundary(text: str, start: int, limit: int) -> Optional[int]:
+    # a single space between two non-whitespace characters never belongs to a token,
+    # so cutting right behind it yields the same tokens and whitespace as one pass.
+    # sentence ends are preferred to keep the context of the pipeline components intact
+    fallback = None
+    for idx in range(limit, start + 1, -1):
+        if not __is_safe_boundary(text, idx):
+            continue
+        if text[idx - 2] in ".!?":
+            return idx
+        if fallback is None:
+            fallback = idx
+            # don't search the whole segment for a sentence end
+            search_until = max(start + 1, idx - 1000)
+        if idx < search_until:
+            break
+    return fallback
+
+
+def __is_safe_boundary(text: str, idx: int) -> bool:
+    return (
+        idx < len(text)
+        and text[idx - 1] == " "
+        and not text[idx].isspace()
+        and not text[idx - 2].isspace()
+    )
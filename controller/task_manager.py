@@ -1,14 +1,30 @@
-from typing import Optional
-from controller.rats_manager import create_rats_entries
+from typing import Any, Callable, Optional
+from controller.rats_manager import (
+    create_rats_entries,
+    request_after_doc_bin_creation,
+)
 from controller.tokenization_manager import (
+    migrate_tokenizer,
+    retokenize_changed_records,
     tokenize_calculated_attribute,
     tokenize_initial_project,
 )
 from submodules.model import enums
-from submodules.model.business_objects import attribute, general, notification, record
+from submodules.model.business_objects import (
+    attribute,
+    general,
+    notification,
+    project,
+    record,
+)
 from submodules.model.business_objects import tokenization
 from submodules.model.business_objects.tokenization import create_tokenization_task
-from misc import daemon, notification as notification_util
+from misc import (
+    cancellation,
+    notification as notification_util,
+    shadow_generation,
+    task_queue,
+)
 from submodules.model.models import RecordTokenizationTask
 from fastapi import status
 
@@ -41,14 +57,21 @@ def start_tokenization_task(
     include_rats: bool = True,
     only_uploaded_attributes: bool = False,
     attribute_id: Optional[str] = None,
+    profile: bool = False,
 ) -> int:
+    if is_tokenizer_migration_running(project_id):
+        # the swap of the migration would overwrite what the task writes, records
+        # added meanwhile are tokenized once the migration is done
+        return None
     if type == enums.RecordTokenizationScope.PROJECT.value:
         initial_count = record.count_records_without_tokenization(project_id)
         if initial_count != 0:
             task = set_up_tokenization_task(
                 project_id, user_id, enums.RecordTokenizationScope.PROJECT.value
             )
-            daemon.run(
+            __run_task(
+                str(task.id),
+                profile,
                 tokenize_initial_project,
                 project_id,
                 user_id,
@@ -58,7 +81,9 @@ def start_tokenization_task(
                 include_rats,
             )
         elif include_rats:
-            start_rats_task(project_id, user_id, only_uploaded_attributes)
+            start_rats_task(
+                project_id, user_id, only_uploaded_attributes, profile=profile
+            )
 
     elif type == enums.RecordTokenizationScope.ATTRIBUTE.value:
         attribute_name = attribute.get(project_id, attribute_id).name
@@ -69,7 +94,9 @@ def start_tokenization_task(
             enums.RecordTokenizationScope.ATTRIBUTE.value,
             attribute_name,
         )
-        daemon.run(
+        __run_task(
+            str(task.id),
+            profile,
             tokenize_calculated_attribute,
             project_id,
             user_id,
@@ -84,16 +111,99 @@ def start_tokenization_task(
     return record_tokenization_task_id
 
 
+def start_retokenization_task(
+    project_id: str, user_id: str, include_rats: bool = True, profile: bool = False
+) -> Optional[str]:
+    if is_tokenizer_migration_running(project_id):
+        return None
+    initial_count = record.get_count_all_records(project_id)
+    task = set_up_tokenization_task(
+        project_id, user_id, enums.RecordTokenizationScope.PROJECT.value
+    )
+    __run_task(
+        str(task.id),
+        profile,
+        retokenize_changed_records,
+        project_id,
+        user_id,
+        str(task.id),
+        initial_count,
+        include_rats,
+    )
+    return task.id
+
+
+def start_tokenizer_migration_task(
+    project_id: str, user_id: str, target_config: str, profile: bool = False
+) -> Optional[str]:
+    if project.get(project_id).tokenizer == target_config:
+        return None
+    # checked in the database since the task may run in a worker process
+    if tokenization.is_doc_bin_creation_running_or_queued(project_id):
+        return None
+    if is_tokenizer_migration_running(project_id):
+        return None
+    initial_count = record.get_count_all_records(project_id)
+    task = set_up_tokenization_task(
+        project_id, user_id, enums.RecordTokenizationScope.PROJECT.value
+    )
+    # claimed right away so tokenization tasks are blocked while it's queued
+    if not shadow_generation.claim(project_id, str(task.id), target_config):
+        task.state = enums.TokenizerTask.STATE_FAILED.value
+        general.commit()
+        return None
+    general.commit()
+    __run_task(
+        str(task.id),
+        profile,
+        run_tokenizer_migration,
+        project_id,
+        user_id,
+        str(task.id),
+        initial_count,
+        target_config,
+    )
+    return task.id
+
+
+def run_tokenizer_migration(
+    project_id: str,
+    user_id: str,
+    task_id: str,
+    initial_count: int,
+    target_config: str,
+) -> None:
+    if not migrate_tokenizer(
+        project_id, user_id, task_id, initial_count, target_config
+    ):
+        return
+    # records added after the last pass of the migration have no docbin since the swap
+    session_token = general.get_ctx_token()
+    try:
+        if record.count_records_without_tokenization(project_id):
+            start_tokenization_task(
+                project_id, user_id, enums.RecordTokenizationScope.PROJECT.value
+            )
+    finally:
+        general.remove_and_refresh_session(session_token)
+
+
+def is_tokenizer_migration_running(project_id: str) -> bool:
+    return shadow_generation.get_running(project_id) is not None
+
+
 def start_rats_task(
     project_id: str,
     user_id: str,
     only_uploaded_attributes: bool = False,
     attribute_id: Optional[str] = None,
+    profile: bool = False,
 ) -> int:
-    if tokenization.is_doc_bin_creation_running_or_queued(
-        project_id, only_running=True
-    ):
-        # at the end of doc bin creation rats will be calculated
+    if tokenization.is_doc_bin_creation_running_or_queued(project_id):
+        # stored in the database, the last docbin task to end calculates the rats
+        request_after_doc_bin_creation(
+            project_id, user_id, only_uploaded_attributes, attribute_id, profile
+        )
         return
 
     initial_count = record.count_missing_rats_records(project_id, attribute_id)
@@ -115,7 +225,9 @@ def start_rats_task(
             attribute_name=attribute_name,
             with_commit=True,
         )
-        daemon.run(
+        __run_task(
+            str(task.id),
+            profile,
             create_rats_entries,
             project_id,
             user_id,
@@ -134,3 +246,31 @@ def start_rats_task(
         )
         general.commit()
     return status.HTTP_200_OK
+
+
+def cancel_task(project_id: str, task_id: str) -> int:
+    tokenization_task = tokenization.get(project_id, task_id)
+    if not tokenization_task:
+        return status.HTTP_404_NOT_FOUND
+    tokenization_task.state = enums.TokenizerTask.STATE_FAILED.value
+    general.commit()
+    # running tasks react on the next record instead of waiting for the state check
+    cancellation.cancel(task_id)
+    return status.HTTP_200_OK
+
+
+def __run_task(task_id: str, profile: bool, target: Callable, *args: Any) -> None:
+    task_queue.run_task(task_id, profile, target, *args)
+
+
+# everything a worker may be asked to run, see task_queue
+TASK_FUNCTIONS = {
+    function.__name__: function
+    for function in [
+        tokenize_initial_project,
+        tokenize_calculated_attribute,
+        retokenize_changed_records,
+        run_tokenizer_migration,
+        create_rats_entries,
+    ]
+}
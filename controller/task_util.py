@@ -1,9 +1,13 @@
+import traceback
 from typing import List
 from datetime import datetime
-from controller.rats_manager import trigger_rats_creation
+from controller.rats_manager import (
+    request_after_doc_bin_creation,
+    start_requested_rats,
+    trigger_rats_creation,
+)
 from submodules.model import enums
-from submodules.model.business_objects import general
-from submodules.model.business_objects import tokenization
+from submodules.model.business_objects import general, tokenization
 from misc.util import put_data_in_minio_bucket, send_websocket_update
 from submodules.model.models import RecordTokenizationTask
 
@@ -19,20 +23,6 @@ def set_task_to_started(
     general.commit()
 
 
-def update_tokenization_progress(
-    project_id: str,
-    tokenization_task: RecordTokenizationTask,
-    progress_per_chunk: float,
-) -> None:
-    tokenization_task.progress += progress_per_chunk
-    send_websocket_update(
-        project_id,
-        True,
-        ["docbin", "progress", str(tokenization_task.progress)],
-    )
-    general.commit()
-
-
 def finalize_task(
     project_id: str,
     user_id: str,
@@ -41,8 +31,7 @@ def finalize_task(
     include_rats: bool = True,
     only_uploaded_attributes: bool = False,
 ) -> None:
-    tokenization.delete_dublicated_tokenization(project_id)
-    put_data_in_minio_bucket(project_id, non_text_attributes)
+    put_data_in_minio_bucket(project_id, non_text_attributes, with_shards=True)
     tokenization_task.progress = 1
     send_websocket_update(
         project_id, False, ["docbin", "progress", str(tokenization_task.progress)]
@@ -53,7 +42,26 @@ def finalize_task(
     send_websocket_update(
         project_id, False, ["docbin", "state", str(tokenization_task.state)]
     )
+    # docbins are committed at this point so the statistics can start right away,
+    # unless another docbin task of the project still runs or is queued. The last one
+    # to end starts the statistics requested meanwhile, see end_doc_bin_task
+    if tokenization.is_doc_bin_creation_running_or_queued(project_id):
+        if include_rats:
+            request_after_doc_bin_creation(
+                project_id, user_id, only_uploaded_attributes
+            )
+        return
     if include_rats:
         trigger_rats_creation(
             project_id, user_id, tokenization_task, only_uploaded_attributes
         )
+
+
+def end_doc_bin_task(project_id: str) -> None:
+    # in the finally block of every docbin task, a failed or cancelled last task
+    # still starts the statistics requested while it ran
+    try:
+        start_requested_rats(project_id)
+    except Exception:
+        general.rollback()
+        print(traceback.format_exc(), flush=True)
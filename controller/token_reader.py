@@ -0,0 +1,51 @@
+from typing import Any, Dict, List, Optional
+
+from spacy.tokens import Doc
+
+from handler.tokenizer_handler import get_tokenizer_by_project
+from misc import query, token_cache
+from misc.util import get_docs_from_db
+
+
+def get_tokens(
+    project_id: str, record_ids: List[str], attribute_names: Optional[List[str]] = None
+) -> Dict[str, Dict[str, Any]]:
+    # records without docbin are left out of the result
+    record_ids = list(dict.fromkeys(record_ids))
+    tokens_by_record = {}
+    missing_ids = []
+    versions = query.get_record_tokenized_versions(project_id, record_ids)
+    for record_id, version in versions.items():
+        tokens = token_cache.get(project_id, record_id, version)
+        if tokens is None:
+            missing_ids.append(record_id)
+        else:
+            tokens_by_record[record_id] = tokens
+
+    if missing_ids:
+        vocab = get_tokenizer_by_project(project_id).vocab
+        for row in query.get_record_tokenized_with_versions(project_id, missing_ids):
+            tokens = {
+                column: __get_token_data(doc)
+                for column, doc in get_docs_from_db(row, vocab, project_id).items()
+            }
+            token_cache.put(project_id, row.record_id, row.version, tokens)
+            tokens_by_record[str(row.record_id)] = tokens
+
+    if attribute_names is not None:
+        tokens_by_record = {
+            record_id: {
+                name: tokens[name] for name in attribute_names if name in tokens
+            }
+            for record_id, tokens in tokens_by_record.items()
+        }
+    return tokens_by_record
+
+
+def __get_token_data(doc: Doc) -> Dict[str, List[Any]]:
+    # columnar to keep cache entries and responses small
+    return {
+        "text": [token.text for token in doc],
+        "idx": [token.idx for token in doc],
+        "whitespace": [token.whitespace_ for token in doc],
+    }
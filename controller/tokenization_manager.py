@@ -1,15 +1,19 @@
-from typing import Any, Dict, List, Tuple
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
+from spacy.language import Language
 from controller.tokenizer import (
     add_attribute_to_docbin,
+    get_fingerprint,
     tokenize_record as tokenize_single_record,
+    tokenize_records_in_batch,
 )
 import traceback
-from controller.task_util import (
-    finalize_task,
-    set_task_to_started,
-    update_tokenization_progress,
-)
-from submodules.model.models import Attribute, RecordTokenizationTask
+from controller import cost_estimator
+from controller.task_util import end_doc_bin_task, finalize_task, set_task_to_started
+from submodules.model.models import Attribute, RecordTokenizationTask, RecordTokenized
 from misc.notification import send_notification_created
 from submodules.model import enums
 from submodules.model.business_objects import (
@@ -20,10 +24,33 @@ from submodules.model.business_objects import (
     record,
     tokenization,
 )
-from handler.tokenizer_handler import get_tokenizer_by_project
+from handler.tokenizer_handler import get_tokenizer, get_tokenizer_by_project
+from misc import (
+    cancellation,
+    fingerprint,
+    metrics,
+    query,
+    shadow_generation,
+    string_table,
+    task_estimate,
+    token_cache,
+    token_statistics,
+)
+from misc.progress import ProgressTracker
 from misc.util import send_websocket_update, upload_to_minio_after_every_10th_chunk
 
+# a tokenizer migration tokenizes in the background at this rate to leave room for others
+MIGRATION_RECORDS_PER_SECOND = float(
+    os.getenv("TOKENIZER_MIGRATION_RECORDS_PER_SECOND", 200)
+)
+
+# project_id -> records tokenized on demand while a project task of this process runs,
+# that task skips them. Only kept while such a task runs. With TASK_EXECUTION=worker the
+# project task runs in another process and simply tokenizes them again
 __prioritized_records = {}
+# project_id -> project tasks running in this process
+__project_task_count = {}
+__priority_lock = threading.Lock()
 
 
 def tokenize_calculated_attribute(
@@ -35,6 +62,8 @@ def tokenize_calculated_attribute(
     include_rats: bool = True,
 ) -> None:
     session_token = general.get_ctx_token()
+    cancelled = cancellation.register(task_id)
+    chunk_metrics = metrics.ChunkMetrics(metrics.TASK_TYPE_ATTRIBUTE)
     try:
         tokenization_task, tokenizer = __set_up_tokenization(
             project_id, task_id, initial_count
@@ -43,41 +72,79 @@ def tokenize_calculated_attribute(
         attribute_item = attribute.get_by_name(project_id, attribute_name)
         non_text_attributes = attribute.get_non_text_attributes(project_id).keys()
         __check_attribute_is_text(attribute_item)
+        tokenizer_config = project.get(project_id).tokenizer
+        # the attribute might not be in a usable state yet, so it's added explicitly
+        previous_text_attributes = [
+            name
+            for name in attribute.get_text_attributes(project_id).keys()
+            if name != attribute_name
+        ]
 
-        chunk_size, progress_per_chunk = __get_chunk_size_and_progress_per_chunk(
-            initial_count
+        chunk_size = __get_chunk_size()
+        seconds_per_record = __estimate_task(
+            project_id,
+            task_id,
+            tokenizer,
+            metrics.TASK_TYPE_ATTRIBUTE,
+            [attribute_name],
+            non_text_attributes,
+            initial_count,
         )
-        record_tokenized_entries = record.get_attribute_data_with_doc_bins_of_records(
-            project_id, attribute_name
+        progress_tracker = ProgressTracker(
+            project_id, task_id, "docbin", initial_count, seconds_per_record
         )
+        with chunk_metrics.stage("fetch"):
+            record_tokenized_entries = (
+                record.get_attribute_data_with_doc_bins_of_records(
+                    project_id, attribute_name
+                )
+            )
+            stored_fingerprints = fingerprint.get_by_record(project_id)
         chunks = [
             record_tokenized_entries[x : x + chunk_size]
             for x in range(0, len(record_tokenized_entries), chunk_size)
         ]
         tokenization_cancelled = False
         for idx, chunk in enumerate(chunks):
-            record_tokenization_task = tokenization.get(project_id, task_id)
-            if (
-                not record_tokenization_task
-                or record_tokenization_task.state
-                == enums.TokenizerTask.STATE_FAILED.value
-            ):
+            values = []
+            for record_tokenized_item in chunk:
+                if cancelled.is_set():
+                    break
+                values.append(
+                    add_attribute_to_docbin(
+                        project_id, tokenizer, record_tokenized_item, chunk_metrics
+                    )
+                )
+            if cancelled.is_set():
                 tokenization_cancelled = True
                 break
-            values = [
-                add_attribute_to_docbin(tokenizer, record_tokenized_item)
-                for record_tokenized_item in chunk
-            ]
 
-            record.update_bytes_of_record_tokenized(values, project_id)
-            rt_ids_string_for_update = __get_value_ids_string_for_update(values)
-            record.update_columns_of_tokenized_records(
-                rt_ids_string_for_update, attribute_name
-            )
-            upload_to_minio_after_every_10th_chunk(idx, project_id, non_text_attributes)
-            update_tokenization_progress(
-                project_id, tokenization_task, progress_per_chunk
-            )
+            with chunk_metrics.stage("fetch"):
+                fingerprint_by_record = __get_fingerprints_with_attribute(
+                    project_id,
+                    tokenizer_config,
+                    [value["_id"] for value in values],
+                    previous_text_attributes,
+                    attribute_name,
+                    stored_fingerprints,
+                )
+            with chunk_metrics.stage("db_write"):
+                record.update_bytes_of_record_tokenized(values, project_id)
+                rt_ids_string_for_update = __get_value_ids_string_for_update(values)
+                record.update_columns_of_tokenized_records(
+                    rt_ids_string_for_update, attribute_name
+                )
+                fingerprint.upsert(project_id, fingerprint_by_record)
+                string_table.commit(project_id)
+                # values only know the record_tokenized ids
+                token_cache.invalidate(project_id)
+            with chunk_metrics.stage("minio_export"):
+                upload_to_minio_after_every_10th_chunk(
+                    idx, project_id, non_text_attributes
+                )
+            with chunk_metrics.stage("notify"):
+                progress_tracker.add(len(chunk))
+            chunk_metrics.observe()
         if not tokenization_cancelled:
             finalize_task(
                 project_id,
@@ -90,11 +157,13 @@ def tokenize_calculated_attribute(
             send_websocket_update(
                 project_id,
                 False,
-                ["docbin", "state", str(record_tokenization_task.state)],
+                ["docbin", "state", enums.TokenizerTask.STATE_FAILED.value],
             )
     except Exception:
         __handle_error(project_id, user_id, task_id)
     finally:
+        cancellation.unregister(task_id)
+        end_doc_bin_task(project_id)
         general.remove_and_refresh_session(session_token, False)
 
 
@@ -107,6 +176,9 @@ def tokenize_initial_project(
     include_rats: bool = True,
 ) -> None:
     session_token = general.get_ctx_token()
+    cancelled = cancellation.register(task_id)
+    chunk_metrics = metrics.ChunkMetrics(metrics.TASK_TYPE_PROJECT)
+    __start_prioritizing(project_id)
     try:
         tokenization_task, tokenizer = __set_up_tokenization(
             project_id, task_id, initial_count
@@ -128,38 +200,64 @@ def tokenize_initial_project(
             text_attributes = attribute.get_text_attributes(project_id).keys()
             non_text_attributes = attribute.get_non_text_attributes(project_id).keys()
 
+        tokenizer_config = project.get(project_id).tokenizer
         full_count = record.count_records_without_tokenization(project_id)
-        chunk_size, progress_per_chunk = __get_chunk_size_and_progress_per_chunk(
-            full_count
+        chunk_size = __get_chunk_size()
+        seconds_per_record = __estimate_task(
+            project_id,
+            task_id,
+            tokenizer,
+            metrics.TASK_TYPE_PROJECT,
+            text_attributes,
+            non_text_attributes,
+            full_count,
         )
-        records = record.get_records_without_tokenization(project_id)
+        progress_tracker = ProgressTracker(
+            project_id, task_id, "docbin", full_count, seconds_per_record
+        )
+        with chunk_metrics.stage("fetch"):
+            records = query.get_records_without_tokenization(
+                project_id, text_attributes
+            )
         chunks = [
             records[x : x + chunk_size] for x in range(0, len(records), chunk_size)
         ]
         tokenization_cancelled = False
         for idx, record_chunk in enumerate(chunks):
-            record_tokenization_task = tokenization.get(project_id, task_id)
-            if (
-                not record_tokenization_task
-                or record_tokenization_task.state
-                == enums.TokenizerTask.STATE_FAILED.value
-            ):
-                tokenization_cancelled = True
-                break
             entries = []
+            fingerprint_by_record = {}
             for record_item in record_chunk:
+                if cancelled.is_set():
+                    break
                 if __remove_from_priority_queue(project_id, record_item.id):
                     continue
+                fingerprint_by_record[record_item.id] = get_fingerprint(
+                    tokenizer_config, record_item, text_attributes
+                )
                 entries.append(
                     tokenize_single_record(
-                        project_id, tokenizer, record_item, text_attributes
+                        project_id,
+                        tokenizer,
+                        record_item,
+                        text_attributes,
+                        chunk_metrics,
                     )
                 )
-            general.add_all(entries)
-            upload_to_minio_after_every_10th_chunk(idx, project_id, non_text_attributes)
-            update_tokenization_progress(
-                project_id, tokenization_task, progress_per_chunk
-            )
+            if cancelled.is_set():
+                tokenization_cancelled = True
+                break
+            with chunk_metrics.stage("db_write"):
+                query.upsert_record_tokenized(entries)
+                fingerprint.upsert(project_id, fingerprint_by_record)
+                string_table.commit(project_id)
+                token_cache.invalidate(project_id, fingerprint_by_record.keys())
+            with chunk_metrics.stage("minio_export"):
+                upload_to_minio_after_every_10th_chunk(
+                    idx, project_id, non_text_attributes
+                )
+            with chunk_metrics.stage("notify"):
+                progress_tracker.add(len(record_chunk))
+            chunk_metrics.observe()
         if not tokenization_cancelled:
             finalize_task(
                 project_id,
@@ -173,19 +271,350 @@ def tokenize_initial_project(
             send_websocket_update(
                 project_id,
                 False,
-                ["docbin", "state", str(record_tokenization_task.state)],
+                ["docbin", "state", enums.TokenizerTask.STATE_FAILED.value],
+            )
+    except Exception:
+        __handle_error(project_id, user_id, task_id)
+    finally:
+        __stop_prioritizing(project_id)
+        cancellation.unregister(task_id)
+        end_doc_bin_task(project_id)
+        general.remove_and_refresh_session(session_token)
+
+
+def retokenize_changed_records(
+    project_id: str,
+    user_id: str,
+    task_id: str,
+    initial_count: int,
+    include_rats: bool = True,
+) -> None:
+    # only records whose content fingerprint differs from the stored one are tokenized,
+    # records without docbin or without fingerprint count as changed
+    session_token = general.get_ctx_token()
+    task_type = metrics.TASK_TYPE_DELTA
+    cancelled = cancellation.register(task_id)
+    chunk_metrics = metrics.ChunkMetrics(task_type)
+    try:
+        tokenization_task, tokenizer = __set_up_tokenization(
+            project_id, task_id, initial_count
+        )
+        tokenizer_config = project.get(project_id).tokenizer
+        text_attributes = attribute.get_text_attributes(project_id)
+        non_text_attributes = attribute.get_non_text_attributes(project_id).keys()
+
+        chunk_size = __get_chunk_size()
+        progress_tracker = ProgressTracker(project_id, task_id, "docbin", initial_count)
+        with chunk_metrics.stage("fetch"):
+            records = query.get_records_with_text_attributes(
+                project_id, text_attributes.keys()
+            )
+            fingerprint.delete_orphans(project_id)
+            stored_fingerprints = fingerprint.get_by_record(project_id)
+        chunks = [
+            records[x : x + chunk_size] for x in range(0, len(records), chunk_size)
+        ]
+        skipped_count = 0
+        tokenization_cancelled = False
+        for idx, record_chunk in enumerate(chunks):
+            if cancelled.is_set():
+                tokenization_cancelled = True
+                break
+            changed_records = []
+            fingerprint_by_record = {}
+            for record_item in record_chunk:
+                record_fingerprint = get_fingerprint(
+                    tokenizer_config, record_item, text_attributes
+                )
+                if stored_fingerprints.get(str(record_item.id)) == record_fingerprint:
+                    continue
+                changed_records.append(record_item)
+                fingerprint_by_record[record_item.id] = record_fingerprint
+            skipped_count += len(record_chunk) - len(changed_records)
+            metrics.RECORDS_SKIPPED.labels(task_type).inc(
+                len(record_chunk) - len(changed_records)
+            )
+            if changed_records:
+                # statistics are rewritten as well, rats only fills in missing ones
+                tokenized_entries, statistic_entries = tokenize_records_in_batch(
+                    project_id,
+                    tokenizer,
+                    changed_records,
+                    text_attributes,
+                    chunk_metrics,
+                )
+                with chunk_metrics.stage("db_write"):
+                    query.upsert_record_tokenized(tokenized_entries)
+                    query.upsert_token_statistics(statistic_entries)
+                    fingerprint.upsert(project_id, fingerprint_by_record)
+                    string_table.commit(project_id)
+                    token_cache.invalidate(project_id, fingerprint_by_record.keys())
+                with chunk_metrics.stage("minio_export"):
+                    upload_to_minio_after_every_10th_chunk(
+                        idx, project_id, non_text_attributes
+                    )
+            with chunk_metrics.stage("notify"):
+                progress_tracker.add(len(record_chunk))
+            chunk_metrics.observe()
+        if skipped_count < len(records):
+            # statistics of changed records were overwritten, merging would count twice
+            with chunk_metrics.stage("db_write"):
+                token_statistics.rebuild(project_id)
+                general.commit()
+        print(
+            f"Re-tokenization of project {project_id}: "
+            f"{len(records) - skipped_count} records tokenized, "
+            f"{skipped_count} unchanged records skipped",
+            flush=True,
+        )
+        if not tokenization_cancelled:
+            notification.create(
+                project_id,
+                user_id,
+                f"Re-tokenized {len(records) - skipped_count} changed records, "
+                f"skipped {skipped_count} unchanged records.",
+                "INFO",
+                enums.NotificationType.TOKEN_CREATION_DONE.value,
+            )
+            general.commit()
+            send_websocket_update(
+                project_id, False, ["docbin", "skipped", str(skipped_count)]
+            )
+            finalize_task(
+                project_id,
+                user_id,
+                non_text_attributes,
+                tokenization_task,
+                include_rats,
+            )
+        else:
+            send_websocket_update(
+                project_id,
+                False,
+                ["docbin", "state", enums.TokenizerTask.STATE_FAILED.value],
+            )
+    except Exception:
+        __handle_error(project_id, user_id, task_id)
+    finally:
+        cancellation.unregister(task_id)
+        end_doc_bin_task(project_id)
+        general.remove_and_refresh_session(session_token)
+
+
+def migrate_tokenizer(
+    project_id: str,
+    user_id: str,
+    task_id: str,
+    initial_count: int,
+    target_config: str,
+) -> bool:
+    # True once the new generation is live
+    session_token = general.get_ctx_token()
+    task_type = metrics.TASK_TYPE_MIGRATION
+    cancelled = cancellation.register(task_id)
+    chunk_metrics = metrics.ChunkMetrics(task_type)
+    swapped = False
+    try:
+        tokenization_task = tokenization.get(project_id, task_id)
+        # a restarted migration keeps the shadow rows it already wrote
+        claimed = shadow_generation.claim(project_id, task_id, target_config)
+        general.commit()
+        if not claimed:
+            print(f"Tokenizer migration of {project_id} already running", flush=True)
+            tokenization_task.state = enums.TokenizerTask.STATE_FAILED.value
+            general.commit()
+            send_websocket_update(
+                project_id,
+                False,
+                ["docbin", "state", enums.TokenizerTask.STATE_FAILED.value],
+            )
+            return False
+        tokenizer = get_tokenizer(target_config)
+        set_task_to_started(project_id, tokenization_task, initial_count)
+        text_attributes = attribute.get_text_attributes(project_id)
+        non_text_attributes = attribute.get_non_text_attributes(project_id).keys()
+
+        chunk_size = max(1, min(__get_chunk_size(), int(MIGRATION_RECORDS_PER_SECOND)))
+        progress_tracker = ProgressTracker(project_id, task_id, "docbin", initial_count)
+        # repeated until a pass finds nothing left, records added by other tasks
+        # while a pass runs are picked up by the next one
+        while not cancelled.is_set():
+            with chunk_metrics.stage("fetch"):
+                records = query.get_records_without_shadow(
+                    project_id, task_id, text_attributes.keys()
+                )
+            if not records:
+                break
+            for x in range(0, len(records), chunk_size):
+                if cancelled.is_set():
+                    break
+                chunk_start = time.perf_counter()
+                record_chunk = records[x : x + chunk_size]
+                __write_shadow_generation(
+                    project_id,
+                    task_id,
+                    tokenizer,
+                    target_config,
+                    record_chunk,
+                    text_attributes,
+                    chunk_metrics,
+                )
+                with chunk_metrics.stage("db_write"):
+                    shadow_generation.renew_claim(project_id, task_id)
+                    string_table.commit(project_id)
+                with chunk_metrics.stage("notify"):
+                    progress_tracker.add(len(record_chunk))
+                chunk_metrics.observe()
+                time.sleep(
+                    max(
+                        0,
+                        len(record_chunk) / MIGRATION_RECORDS_PER_SECOND
+                        - (time.perf_counter() - chunk_start),
+                    )
+                )
+        if cancelled.is_set():
+            send_websocket_update(
+                project_id,
+                False,
+                ["docbin", "state", enums.TokenizerTask.STATE_FAILED.value],
             )
+            return False
+
+        with chunk_metrics.stage("swap"):
+            # the claim isn't renewed while the swap transaction is open
+            shadow_generation.renew_claim(project_id, task_id)
+            general.commit()
+            __swap_generation(
+                project_id, task_id, target_config, tokenizer.lang, chunk_size
+            )
+        chunk_metrics.observe()
+        swapped = True
+        finalize_task(
+            project_id, user_id, non_text_attributes, tokenization_task, False
+        )
     except Exception:
         __handle_error(project_id, user_id, task_id)
     finally:
+        if not swapped:
+            # the superseded shadow generation of an aborted migration
+            try:
+                shadow_generation.release(project_id, task_id)
+                general.commit()
+            except Exception:
+                print(traceback.format_exc(), flush=True)
+        cancellation.unregister(task_id)
+        end_doc_bin_task(project_id)
         general.remove_and_refresh_session(session_token)
+    return swapped
+
+
+def __write_shadow_generation(
+    project_id: str,
+    task_id: str,
+    tokenizer: Any,
+    target_config: str,
+    record_items: List[Any],
+    text_attributes: Dict[str, str],
+    chunk_metrics: metrics.ChunkMetrics,
+) -> None:
+    tokenized_entries, statistic_entries = tokenize_records_in_batch(
+        project_id, tokenizer, record_items, text_attributes, chunk_metrics
+    )
+    num_token_by_record = {}
+    for statistic in statistic_entries:
+        num_token_by_record.setdefault(str(statistic["record_id"]), {})[
+            str(statistic["attribute_id"])
+        ] = statistic["num_token"]
+    with chunk_metrics.stage("db_write"):
+        shadow_generation.upsert(
+            [
+                {
+                    "project_id": project_id,
+                    "record_id": str(entry.record_id),
+                    "task_id": task_id,
+                    "tokenizer": target_config,
+                    "bytes": entry.bytes,
+                    "columns": json.dumps(entry.columns),
+                    "num_token_by_attribute": json.dumps(
+                        num_token_by_record.get(str(entry.record_id), {})
+                    ),
+                    "fingerprint": get_fingerprint(
+                        target_config, record_item, text_attributes
+                    ),
+                }
+                for entry, record_item in zip(tokenized_entries, record_items)
+            ]
+        )
+
+
+def __swap_generation(
+    project_id: str,
+    task_id: str,
+    target_config: str,
+    target_blank: str,
+    chunk_size: int,
+) -> None:
+    # a single transaction, readers see either the old or the new generation. Its size
+    # is the whole project: every docbin, statistic and fingerprint is rewritten, so
+    # postgres needs room for the new row versions and their WAL until the commit, and
+    # writers of the project's docbins wait for it. See the README for the limits
+    for rows in shadow_generation.iterate(project_id, task_id, chunk_size):
+        query.upsert_record_tokenized(
+            [
+                RecordTokenized(
+                    project_id=project_id,
+                    record_id=row.record_id,
+                    bytes=row.bytes,
+                    columns=row.columns,
+                )
+                for row in rows
+            ]
+        )
+        query.upsert_token_statistics(
+            [
+                {
+                    "project_id": project_id,
+                    "record_id": row.record_id,
+                    "attribute_id": attribute_id,
+                    "num_token": num_token,
+                }
+                for row in rows
+                for attribute_id, num_token in row.num_token_by_attribute.items()
+            ]
+        )
+        fingerprint.upsert(project_id, {row.record_id: row.fingerprint for row in rows})
+    shadow_generation.delete_live_without_shadow(project_id, task_id)
+    token_statistics.rebuild(project_id)
+    project_item = project.get(project_id)
+    project_item.tokenizer = target_config
+    project_item.tokenizer_blank = target_blank
+    # the old generation is overwritten, the shadow rows aren't needed anymore and
+    # tokenization tasks of the project can start again
+    shadow_generation.release(project_id, task_id)
+    general.commit()
+    token_cache.invalidate(project_id)
 
 
 def tokenize_record(project_id: str, record_id: str) -> int:
-    if record.has_byte_data(project_id, record_id):
-        return 200
+    # docbin and token statistics are written in one transaction by the batch logic
+    return tokenize_records(project_id, [record_id]).get(record_id, 418)
+
+
+def tokenize_records(project_id: str, record_ids: List[str]) -> Dict[str, int]:
+    record_ids = list(dict.fromkeys(record_ids))
+    status_by_record = {}
+    already_tokenized = query.get_record_ids_with_byte_data(project_id, record_ids)
+    for record_id in already_tokenized:
+        status_by_record[record_id] = 200
+    missing_ids = [
+        record_id for record_id in record_ids if record_id not in already_tokenized
+    ]
+    if not missing_ids:
+        return status_by_record
+    chunk_metrics = metrics.ChunkMetrics(metrics.TASK_TYPE_RECORD)
     try:
-        __add_to_priority_queue(project_id, record_id)
+        for record_id in missing_ids:
+            __add_to_priority_queue(project_id, record_id)
 
         text_attributes = attribute.get_text_attributes(
             project_id,
@@ -196,17 +625,117 @@ def tokenize_record(project_id: str, record_id: str) -> int:
             ],
         )
         tokenizer = get_tokenizer_by_project(project_id)
-        record_item = record.get(project_id, record_id)
-        entry = tokenize_single_record(
-            project_id, tokenizer, record_item, text_attributes, update_statistic=True
+        tokenizer_config = project.get(project_id).tokenizer
+        with chunk_metrics.stage("fetch"):
+            record_items = query.get_records_by_ids(project_id, missing_ids)
+        tokenized_entries, statistic_entries = tokenize_records_in_batch(
+            project_id, tokenizer, record_items, text_attributes, chunk_metrics
         )
-        general.add(entry)
-        general.commit()
-        return 200
+        with chunk_metrics.stage("db_write"):
+            query.upsert_record_tokenized(tokenized_entries)
+            query.upsert_token_statistics(statistic_entries)
+            # only records without docbin get here, so their statistics are new
+            token_statistics.merge_entries(project_id, statistic_entries)
+            fingerprint.upsert(
+                project_id,
+                {
+                    record_item.id: get_fingerprint(
+                        tokenizer_config, record_item, text_attributes
+                    )
+                    for record_item in record_items
+                },
+            )
+            string_table.commit(project_id)
+        token_cache.invalidate(project_id, [r.id for r in record_items])
+        chunk_metrics.observe()
+        __dual_write_migration(project_id, record_items, text_attributes)
+        for record_item in record_items:
+            status_by_record[str(record_item.id)] = 200
+        for record_id in missing_ids:
+            if record_id not in status_by_record:
+                # record doesn't exist (anymore)
+                __remove_from_priority_queue(project_id, record_id)
+                status_by_record[record_id] = 404
+    except Exception:
+        string_table.rollback(project_id)
+        for record_id in missing_ids:
+            __remove_from_priority_queue(project_id, record_id)
+            status_by_record[record_id] = 418
+        print(traceback.format_exc(), flush=True)
+    return status_by_record
+
+
+def __dual_write_migration(
+    project_id: str, record_items: List[Any], text_attributes: Dict[str, str]
+) -> None:
+    if not record_items:
+        return
+    # read from the database, the migration may run in a worker process
+    migration = shadow_generation.get_running(project_id)
+    if not migration:
+        return
+    try:
+        __write_shadow_generation(
+            project_id,
+            str(migration.task_id),
+            get_tokenizer(migration.tokenizer),
+            migration.tokenizer,
+            record_items,
+            text_attributes,
+            metrics.ChunkMetrics(metrics.TASK_TYPE_RECORD),
+        )
+        string_table.commit(project_id)
     except Exception:
-        __remove_from_priority_queue(project_id, record_id)
+        # the next pass of the migration tokenizes records missing in the shadow
+        string_table.rollback(project_id)
         print(traceback.format_exc(), flush=True)
-        return 418
+
+
+def get_token_statistics(project_id: str) -> Dict[str, Any]:
+    aggregates = token_statistics.get_by_attribute(project_id)
+    name_by_id = {
+        str(attribute_id): name
+        for name, attribute_id in attribute.get_text_attributes(project_id).items()
+    }
+    return {
+        attribute_id: {
+            "attribute_name": name_by_id.get(attribute_id),
+            **aggregate.to_dict(),
+        }
+        for attribute_id, aggregate in aggregates.items()
+    }
+
+
+def refresh_token_statistics(project_id: str) -> None:
+    # drops what deleted records and attributes left in the aggregates, also fills them
+    # for statistics written before the aggregates existed
+    token_statistics.rebuild(project_id)
+    general.commit()
+
+
+def __get_fingerprints_with_attribute(
+    project_id: str,
+    tokenizer_config: str,
+    record_tokenized_ids: List[str],
+    previous_text_attributes: List[str],
+    attribute_name: str,
+    stored_fingerprints: Dict[str, str],
+) -> Dict[str, str]:
+    # a docbin that was up to date before the attribute was added is up to date after.
+    # Others keep their outdated fingerprint so a re-tokenization still picks them up
+    text_attributes = previous_text_attributes + [attribute_name]
+    fingerprint_by_record = {}
+    for record_item in query.get_records_of_record_tokenized(
+        project_id, record_tokenized_ids, text_attributes
+    ):
+        previous_fingerprint = get_fingerprint(
+            tokenizer_config, record_item, previous_text_attributes
+        )
+        if stored_fingerprints.get(str(record_item.id)) == previous_fingerprint:
+            fingerprint_by_record[record_item.id] = get_fingerprint(
+                tokenizer_config, record_item, text_attributes
+            )
+    return fingerprint_by_record
 
 
 def __get_value_ids_string_for_update(values: List[Dict[str, Any]]) -> str:
@@ -215,10 +744,8 @@ def __get_value_ids_string_for_update(values: List[Dict[str, Any]]) -> str:
     return "(" + value_ids + ")"
 
 
-def __get_chunk_size_and_progress_per_chunk(full_count: int) -> Tuple[int, float]:
-    chunk_size = 500
-    progress_per_chunk = round(chunk_size / full_count, 3)
-    return chunk_size, progress_per_chunk
+def __get_chunk_size() -> int:
+    return 500
 
 
 def __check_attribute_is_text(attribute_item: Attribute) -> None:
@@ -228,19 +755,29 @@ def __check_attribute_is_text(attribute_item: Attribute) -> None:
         raise Exception("Attribute is not of type text.")
 
 
+def __start_prioritizing(project_id: str) -> None:
+    with __priority_lock:
+        __project_task_count[project_id] = __project_task_count.get(project_id, 0) + 1
+
+
+def __stop_prioritizing(project_id: str) -> None:
+    with __priority_lock:
+        __project_task_count[project_id] -= 1
+        if not __project_task_count[project_id]:
+            del __project_task_count[project_id]
+            __prioritized_records.pop(project_id, None)
+
+
 def __add_to_priority_queue(project_id: str, record_id: str) -> None:
-    if project_id not in __prioritized_records:
-        __prioritized_records[project_id] = {}
-    __prioritized_records[project_id][record_id] = True
+    with __priority_lock:
+        if project_id in __project_task_count:
+            __prioritized_records.setdefault(project_id, {})[record_id] = True
 
 
 def __remove_from_priority_queue(project_id: str, record_id: str) -> bool:
-    if project_id in __prioritized_records:
-        if record_id in __prioritized_records[project_id]:
-            del __prioritized_records[project_id][record_id]
-            return True
-    else:
-        return False
+    with __priority_lock:
+        records = __prioritized_records.get(project_id, {})
+        return records.pop(record_id, None) is not None
 
 
 def __set_up_tokenization(
@@ -253,9 +790,44 @@ def __set_up_tokenization(
     return tokenization_task, tokenizer
 
 
-def __handle_error(project_id: str, user_id: str, task_id: str) -> None:
+def __estimate_task(
+    project_id: str,
+    task_id: str,
+    tokenizer: Language,
+    task_type: str,
+    text_attributes: Iterable[str],
+    non_text_attributes: Iterable[str],
+    record_count: int,
+) -> Optional[float]:
+    # stored on the task, a failing estimate doesn't fail the tokenization. Without it
+    # the eta starts with the throughput of the first records. Small tasks would take
+    # about as long as their sample
+    if (
+        not cost_estimator.ESTIMATE_ON_TASK_START
+        or record_count <= cost_estimator.ESTIMATE_SAMPLE_SIZE
+    ):
+        return None
     try:
+        estimate = cost_estimator.estimate(
+            project_id,
+            tokenizer,
+            task_type,
+            list(text_attributes),
+            list(non_text_attributes),
+            record_count,
+        )
+        task_estimate.store(project_id, task_id, estimate)
+        general.commit()
+    except Exception:
+        print(traceback.format_exc(), flush=True)
         general.rollback()
+        return None
+    return estimate["seconds_per_record"]
+
+
+def __handle_error(project_id: str, user_id: str, task_id: str) -> None:
+    try:
+        string_table.rollback(project_id)
     except Exception:
         print("couldn't rollback session", flush=True)
     project_item = project.get(project_id)
@@ -1,18 +1,149 @@
-from typing import Any, Dict, List
+import os
+from typing import Any, Dict, List, Optional, Tuple
+from spacy.language import Language
 from spacy.tokens import DocBin
-from submodules.model.business_objects import record
+from controller.segmentation import tokenize_text, tokenize_texts
+from misc import fingerprint, string_table
+from misc.metrics import TASK_TYPE_UNTRACKED, ChunkMetrics
 from submodules.model.models import Record, RecordTokenized
 
+# the stored attrs are part of the serialized docbin, so readers decode every profile
+# with a plain DocBin().from_bytes regardless of the profile that wrote it
+DOC_BIN_PROFILES = {
+    "full": {},
+    "compact": {"attrs": ["ORTH", "SPACY"], "store_user_data": False},
+}
+DOC_BIN_PROFILE = os.getenv("DOC_BIN_PROFILE", "full")
+
 
 def get_doc_bin_in_bytes(
     project_id: str,
     tokenizer: str,
     record_item: Record,
     text_attributes: List[str],
-    update_statistic: bool = False,
+    chunk_metrics: Optional[ChunkMetrics] = None,
 ) -> Dict[str, Any]:
-    doc_bin = DocBin()
+    chunk_metrics = chunk_metrics or ChunkMetrics(TASK_TYPE_UNTRACKED)
+    doc_bin = create_doc_bin()
     attribute_names_ordered = []
+    num_tokens = 0
+    for key, to_be_tokenized in __get_values_to_tokenize(record_item, text_attributes):
+        with chunk_metrics.stage("tokenize"):
+            doc = tokenize_text(tokenizer, to_be_tokenized)
+        doc_bin.add(doc)
+        attribute_names_ordered.append(key)
+        num_tokens += len(doc)
+
+    with chunk_metrics.stage("serialize"):
+        string_table.strip_strings(project_id, doc_bin)
+        doc_bin_bytes = doc_bin.to_bytes()
+    chunk_metrics.add_record(num_tokens, len(doc_bin_bytes))
+    return {
+        "bytes": doc_bin_bytes,
+        "attribute_names_ordered": attribute_names_ordered,
+    }
+
+
+def create_doc_bin() -> DocBin:
+    if DOC_BIN_PROFILE not in DOC_BIN_PROFILES:
+        raise ValueError(f"Unknown docbin profile {DOC_BIN_PROFILE}")
+    return DocBin(**DOC_BIN_PROFILES[DOC_BIN_PROFILE])
+
+
+def tokenize_records_in_batch(
+    project_id: str,
+    tokenizer: Language,
+    record_items: List[Record],
+    text_attributes: Dict[str, str],
+    chunk_metrics: Optional[ChunkMetrics] = None,
+) -> Tuple[List[RecordTokenized], List[Dict[str, Any]]]:
+    chunk_metrics = chunk_metrics or ChunkMetrics(TASK_TYPE_UNTRACKED)
+    # all values of the batch go through one pipe call instead of one call per value
+    values_by_record = [
+        __get_values_to_tokenize(record_item, text_attributes)
+        for record_item in record_items
+    ]
+    with chunk_metrics.stage("tokenize"):
+        docs = iter(
+            tokenize_texts(
+                tokenizer,
+                (value for values in values_by_record for _, value in values),
+            )
+        )
+    tokenized_entries = []
+    statistic_entries = []
+    for record_item, values in zip(record_items, values_by_record):
+        doc_bin = create_doc_bin()
+        num_tokens = 0
+        for key, _ in values:
+            doc = next(docs)
+            doc_bin.add(doc)
+            # collected in memory and written with a single multi-row statement
+            statistic_entries.append(
+                {
+                    "project_id": project_id,
+                    "record_id": record_item.id,
+                    "attribute_id": text_attributes[key],
+                    "num_token": len(doc),
+                }
+            )
+            num_tokens += len(doc)
+        with chunk_metrics.stage("serialize"):
+            string_table.strip_strings(project_id, doc_bin)
+            doc_bin_bytes = doc_bin.to_bytes()
+        chunk_metrics.add_record(num_tokens, len(doc_bin_bytes))
+        tokenized_entries.append(
+            RecordTokenized(
+                project_id=project_id,
+                record_id=record_item.id,
+                bytes=doc_bin_bytes,
+                columns=[key for key, _ in values],
+            )
+        )
+    return tokenized_entries, statistic_entries
+
+
+def get_doc_bin_dry_run(
+    tokenizer: Language, record_item: Record, text_attributes: List[str]
+) -> bytes:
+    # get_doc_bin_in_bytes without writing shared strings or metrics, for estimates
+    doc_bin = create_doc_bin()
+    for _, to_be_tokenized in __get_values_to_tokenize(record_item, text_attributes):
+        doc_bin.add(tokenize_text(tokenizer, to_be_tokenized))
+    if string_table.SHARED_STRINGS:
+        doc_bin.strings = set()
+    return doc_bin.to_bytes()
+
+
+def get_text_length(record_item: Record, text_attributes: List[str]) -> int:
+    return sum(
+        len(value)
+        for _, value in __get_values_to_tokenize(record_item, text_attributes)
+    )
+
+
+def get_fingerprint(
+    tokenizer_config: str, record_item: Record, text_attributes: List[str]
+) -> str:
+    return fingerprint.compute(
+        tokenizer_config,
+        get_doc_bin_format(),
+        __get_values_to_tokenize(record_item, text_attributes),
+    )
+
+
+def get_doc_bin_format() -> str:
+    # all settings that change the stored bytes besides tokenizer and values
+    doc_bin_format = DOC_BIN_PROFILE
+    if string_table.SHARED_STRINGS:
+        doc_bin_format += "+shared_strings"
+    return doc_bin_format
+
+
+def __get_values_to_tokenize(
+    record_item: Record, text_attributes: List[str]
+) -> List[Tuple[str, str]]:
+    values = []
     for key in record_item.data:
         if key in text_attributes:
             to_be_tokenized = record_item.data[key]
@@ -22,41 +153,35 @@ def get_doc_bin_in_bytes(
 
             if not isinstance(to_be_tokenized, str):
                 to_be_tokenized = str(to_be_tokenized)
-
-            doc = tokenizer(to_be_tokenized)
-            doc_bin.add(doc)
-            attribute_names_ordered.append(key)
-            if update_statistic:
-                record.create_or_update_token_statistic(
-                    project_id,
-                    record_item.id,
-                    text_attributes[key],
-                    len(doc),
-                    with_commit=True,
-                )
-
-    return {
-        "bytes": doc_bin.to_bytes(),
-        "attribute_names_ordered": attribute_names_ordered,
-    }
+            values.append((key, to_be_tokenized))
+    return values
 
 
 def add_attribute_to_docbin(
+    project_id: str,
     tokenizer: str,
     tokenized_record: Any,  # from get_attribute_data_with_doc_bins_of_records
+    chunk_metrics: Optional[ChunkMetrics] = None,
 ) -> Dict[str, Any]:
-    doc_bin = DocBin()
+    chunk_metrics = chunk_metrics or ChunkMetrics(TASK_TYPE_UNTRACKED)
+    doc_bin = create_doc_bin()
     doc_bin_bytes = tokenized_record.bytes
-    doc_bin.from_bytes(doc_bin_bytes)
+    with chunk_metrics.stage("serialize"):
+        doc_bin.from_bytes(doc_bin_bytes)
     to_be_tokenized = tokenized_record.attribute_data
     if not to_be_tokenized:
         # None / null types can't be tokenized by spacy so dummy string is used
         to_be_tokenized = ""
-    doc = tokenizer(to_be_tokenized)
+    with chunk_metrics.stage("tokenize"):
+        doc = tokenize_text(tokenizer, to_be_tokenized)
     doc_bin.add(doc)
+    with chunk_metrics.stage("serialize"):
+        string_table.strip_strings(project_id, doc_bin)
+        doc_bin_bytes = doc_bin.to_bytes()
+    chunk_metrics.add_record(len(doc), len(doc_bin_bytes))
     return {
         "_id": tokenized_record.id,
-        "bytes": doc_bin.to_bytes(),
+        "bytes": doc_bin_bytes,
     }
 
 
@@ -65,10 +190,10 @@ def tokenize_record(
     tokenizer: str,
     record: Record,
     text_attributes: List[str],
-    update_statistic: bool = False,
+    chunk_metrics: Optional[ChunkMetrics] = None,
 ) -> RecordTokenized:
     tokenization_result = get_doc_bin_in_bytes(
-        project_id, tokenizer, record, text_attributes, update_statistic
+        project_id, tokenizer, record, text_attributes, chunk_metrics
     )
     return RecordTokenized(
         project_id=project_id,
@@ -1,31 +1,158 @@
 from typing import Dict, Any, Optional, Union
-import requests
+import json
+import os
+import threading
 import time
+import traceback
+import requests
 from misc import daemon
 
 __config = None
+# snapshot version the cached config corresponds to, processes sharing the snapshot
+# (the workers of serve.py) pick up a config another one refreshed by its mtime
+__config_mtime = None
+__config_lock = threading.Lock()
+__refresh_requested = threading.Event()
+__refresher_started = False
 
 # meant as a const value since env variables will be removed at some point
 REQUEST_URL = "http://refinery-config:80/full_config"
 
+REFRESH_INTERVAL = 3600  # one hour
+REQUEST_TIMEOUT = 5  # seconds
+MAX_RETRIES = 3
+RETRY_BACKOFF = 1  # seconds, doubled after each failed attempt
+SNAPSHOT_PATH = os.getenv("CONFIG_SNAPSHOT_PATH", "/tmp/refinery-config.json")
+
 
 def __get_config() -> Dict[str, Any]:
     global __config
     if __config:
+        if __get_snapshot_mtime() != __config_mtime:
+            __reload_snapshot()
         return __config
-    refresh_config()
+    with __config_lock:
+        if not __config:
+            # only the very first access without a snapshot has to wait for the service
+            __config = __load_snapshot()
+            if __config:
+                __refresh_requested.set()
+            else:
+                __set_config(__fetch_config())
+    __start_refresher()
     return __config
 
 
-def refresh_config():
-    response = requests.get(REQUEST_URL)
-    if response.status_code != 200:
-        raise ValueError(
-            f"Config service cant be reached -- response.code{response.status_code}"
-        )
-    global __config
-    __config = response.json()
-    daemon.run(invalidate_after, 3600)  # one hour
+def refresh_config() -> None:
+    # blocks until the new config is fetched, raises if the service can't be reached.
+    # Other processes using the same snapshot reload it on their next access
+    __start_refresher()
+    config = __fetch_config()
+    with __config_lock:
+        __set_config(config)
+
+
+def __set_config(config: Dict[str, Any]) -> None:
+    # callers hold the config lock
+    global __config, __config_mtime
+    __config = config
+    __persist_snapshot(config)
+    __config_mtime = __get_snapshot_mtime()
+
+
+def __reload_snapshot() -> None:
+    global __config, __config_mtime
+    with __config_lock:
+        mtime = __get_snapshot_mtime()
+        if mtime == __config_mtime:
+            return
+        config = __load_snapshot()
+        if config:
+            __config = config
+        # a missing or broken snapshot keeps the cached config, no retry per access
+        __config_mtime = mtime
+
+
+def __start_refresher() -> None:
+    global __refresher_started
+    with __config_lock:
+        if __refresher_started:
+            return
+        __refresher_started = True
+    daemon.run(__refresh_loop)
+
+
+def __refresh_loop() -> None:
+    while True:
+        __refresh_requested.wait(REFRESH_INTERVAL)
+        __refresh_requested.clear()
+        try:
+            config = __fetch_config()
+        except Exception:
+            print("Config refresh failed, keeping last known config", flush=True)
+            print(traceback.format_exc(), flush=True)
+            continue
+        with __config_lock:
+            __set_config(config)
+
+
+def __reset_after_fork() -> None:
+    # threads aren't copied into a forked worker (see serve.py), it starts its own
+    global __config_lock, __refresh_requested, __refresher_started
+    __config_lock = threading.Lock()
+    __refresh_requested = threading.Event()
+    __refresher_started = False
+
+
+os.register_at_fork(after_in_child=__reset_after_fork)
+
+
+def __fetch_config() -> Dict[str, Any]:
+    backoff = RETRY_BACKOFF
+    for attempt in range(MAX_RETRIES):
+        try:
+            response = requests.get(REQUEST_URL, timeout=REQUEST_TIMEOUT)
+            if response.status_code == 200:
+                return response.json()
+            error = ValueError(
+                f"Config service cant be reached -- response.code{response.status_code}"
+            )
+        except requests.RequestException as e:
+            error = e
+        if attempt < MAX_RETRIES - 1:
+            time.sleep(backoff)
+            backoff *= 2
+    raise error
+
+
+def __get_snapshot_mtime() -> Optional[int]:
+    try:
+        return os.stat(SNAPSHOT_PATH).st_mtime_ns
+    except OSError:
+        return None
+
+
+def __load_snapshot() -> Optional[Dict[str, Any]]:
+    global __config_mtime
+    if not os.path.exists(SNAPSHOT_PATH):
+        return None
+    try:
+        __config_mtime = __get_snapshot_mtime()
+        with open(SNAPSHOT_PATH, "r") as f:
+            return json.load(f)
+    except Exception:
+        print(f"Couldn't read config snapshot {SNAPSHOT_PATH}", flush=True)
+        return None
+
+
+def __persist_snapshot(config: Dict[str, Any]) -> None:
+    try:
+        tmp_path = SNAPSHOT_PATH + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(config, f)
+        os.replace(tmp_path, SNAPSHOT_PATH)
+    except Exception:
+        print(f"Couldn't persist config snapshot {SNAPSHOT_PATH}", flush=True)
 
 
 def get_config_value(
@@ -43,9 +170,3 @@ def get_config_value(
         return value[subkey]
     else:
         raise ValueError(f"Subkey {subkey} coudn't be found in config[{key}]")
-
-
-def invalidate_after(sec: int) -> None:
-    time.sleep(sec)
-    global __config
-    __config = None
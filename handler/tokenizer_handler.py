@@ -1,14 +1,19 @@
 import os
 import pickle
+import time
 import spacy
 from spacy.language import Language
 from handler.config_handler import get_config_value
+from misc import metrics, tokenizer_artifact
 from submodules.model.business_objects import (
     project,
 )
 import traceback
 import subprocess
 
+# the compact artifact is always written, the pickle only for consumers not migrated yet
+SAVE_PICKLE = os.getenv("SAVE_TOKENIZER_PICKLE", "true").lower() == "true"
+
 __downloaded_language_models = ["en_core_web_sm", "de_core_news_sm"]
 __tokenizer_by_config_str = {}
 
@@ -25,7 +30,15 @@ def init_tokenizer(config_string: str) -> None:
     if config_string not in __downloaded_language_models:
         __download_tokenizer(config_string)
     try:
+        rss_before = metrics.get_rss_bytes()
+        start = time.perf_counter()
         __tokenizer_by_config_str[config_string] = spacy.load(config_string)
+        metrics.MODEL_LOAD_SECONDS.labels(config_string).set(
+            time.perf_counter() - start
+        )
+        metrics.MODEL_MEMORY_BYTES.labels(config_string).set(
+            max(metrics.get_rss_bytes() - rss_before, 0)
+        )
     except Exception:
         print(traceback.format_exc(), flush=True)
 
@@ -63,10 +76,20 @@ def save_tokenizer_as_pickle(config_string: str, overwrite: bool = False) -> Non
     if config_string not in __tokenizer_by_config_str:
         init_tokenizer(config_string)
 
+    artifact_path = tokenizer_artifact.get_artifact_path(config_string)
+    if not os.path.exists(artifact_path) or overwrite:
+        tokenizer_artifact.write_artifact(
+            artifact_path, config_string, __tokenizer_by_config_str[config_string]
+        )
+
+    if not SAVE_PICKLE:
+        return
     pickle_path = os.path.join(
         "/inference/tokenizers", f"tokenizer-{config_string}.pkl"
     )
     if not os.path.exists(pickle_path) or overwrite:
         os.makedirs(os.path.dirname(pickle_path), exist_ok=True)
-        with open(pickle_path, "wb") as f:
+        tmp_path = f"{pickle_path}.tmp"
+        with open(tmp_path, "wb") as f:
             pickle.dump(__tokenizer_by_config_str[config_string], f)
+        os.replace(tmp_path, pickle_path)
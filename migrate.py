@@ -0,0 +1,75 @@
+from sqlalchemy import text
+
+from misc import (
+    fingerprint,
+    query,
+    rats_request,
+    shadow_generation,
+    string_table,
+    task_estimate,
+    task_queue,
+    token_statistics,
+)
+from submodules.model.session import session
+
+# schema of the tables and indexes this service keeps next to the model submodule's.
+# Run "python migrate.py" once per deployment before the api, serve.py or worker.py
+# start, they don't create anything themselves. Applied versions are stored, parallel
+# runs wait for each other.
+VERSION_TABLE_NAME = "tokenizer_schema_version"
+LOCK_KEY = 6_482_193_017
+
+# append only, a version is applied once and never changed afterwards
+MIGRATIONS = [
+    ("0001_unique_indexes", query.ensure_unique_indexes),
+    ("0002_string_table", string_table.ensure_table),
+    ("0003_fingerprint", fingerprint.ensure_table),
+    ("0004_shadow_generation", shadow_generation.ensure_table),
+    ("0005_task_queue", task_queue.ensure_table),
+    ("0006_token_statistics", token_statistics.ensure_table),
+    ("0007_task_estimate", task_estimate.ensure_table),
+    ("0008_rats_request", rats_request.ensure_table),
+    ("0009_fingerprint_without_foreign_key", fingerprint.drop_foreign_key),
+]
+
+
+def main() -> None:
+    with session.get_bind().connect() as connection:
+        connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+        connection.execute(text("SELECT pg_advisory_lock(:key)"), {"key": LOCK_KEY})
+        try:
+            connection.execute(
+                text(
+                    f"""
+                    CREATE TABLE IF NOT EXISTS {VERSION_TABLE_NAME} (
+                        version TEXT PRIMARY KEY,
+                        applied_at TIMESTAMP NOT NULL DEFAULT now()
+                    )
+                    """
+                )
+            )
+            applied = {
+                row.version
+                for row in connection.execute(
+                    text(f"SELECT version FROM {VERSION_TABLE_NAME}")
+                )
+            }
+            for version, migration in MIGRATIONS:
+                if version in applied:
+                    continue
+                print(f"Applying migration {version}", flush=True)
+                migration()
+                connection.execute(
+                    text(
+                        f"INSERT INTO {VERSION_TABLE_NAME} (version) VALUES (:version)"
+                    ),
+                    {"version": version},
+                )
+        finally:
+            connection.execute(
+                text("SELECT pg_advisory_unlock(:key)"), {"key": LOCK_KEY}
+            )
+
+
+if __name__ == "__main__":
+    main()
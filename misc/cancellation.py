@@ -0,0 +1,62 @@
+import os
+import threading
+import time
+import traceback
+from typing import Dict
+
+from misc import daemon, query
+from submodules.model import enums
+from submodules.model.business_objects import general
+
+# one query for all running tasks instead of one query per chunk and task
+CHECK_INTERVAL = int(os.getenv("TASK_CANCEL_CHECK_INTERVAL", 3))
+
+__events: Dict[str, threading.Event] = {}
+__lock = threading.Lock()
+__watcher_started = False
+
+
+def register(task_id: str) -> threading.Event:
+    global __watcher_started
+    with __lock:
+        event = __events.setdefault(task_id, threading.Event())
+        start_watcher = not __watcher_started
+        __watcher_started = True
+    if start_watcher:
+        daemon.run(__watch_task_states)
+    return event
+
+
+def unregister(task_id: str) -> None:
+    with __lock:
+        __events.pop(task_id, None)
+
+
+def cancel(task_id: str) -> None:
+    with __lock:
+        event = __events.get(task_id)
+    if event:
+        event.set()
+
+
+def __watch_task_states() -> None:
+    while True:
+        time.sleep(CHECK_INTERVAL)
+        with __lock:
+            task_ids = [
+                task_id for task_id, event in __events.items() if not event.is_set()
+            ]
+        if not task_ids:
+            continue
+        session_token = general.get_ctx_token()
+        try:
+            states = query.get_task_states(task_ids)
+            for task_id in task_ids:
+                state = states.get(task_id)
+                # a deleted task row counts as cancelled as well
+                if state is None or state == enums.TokenizerTask.STATE_FAILED.value:
+                    cancel(task_id)
+        except Exception:
+            print(traceback.format_exc(), flush=True)
+        finally:
+            general.remove_and_refresh_session(session_token)
@@ -0,0 +1,158 @@
+import base64
+import hashlib
+import json
+import os
+import traceback
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from submodules.s3 import controller as s3
+from . import query, string_table
+
+# the docbin export split by record id range. Per shard a json lines file and an index
+# record_id -> [byte offset, length], so readers can fetch shards in parallel or single
+# records with ranged GETs. Every export gets its own prefix, the manifest is written
+# last, points to that prefix and holds the checksums. The previous export is removed after.
+SHARDED_EXPORT = os.getenv("SHARDED_EXPORT", "false").lower() == "true"
+EXPORT_SHARD_SIZE = int(os.getenv("EXPORT_SHARD_SIZE", 1000))
+FORMAT_VERSION = 2
+PREFIX = "docbin_shards"
+STRING_TABLE_NAME = "docbin_strings.json"
+
+
+def put_sharded_export(
+    org_id: str, project_id: str, missing_columns: List[str]
+) -> None:
+    if not SHARDED_EXPORT:
+        return
+    previous_manifest = __get_manifest(org_id, project_id)
+    export_prefix = (
+        f"{PREFIX}/{datetime.now().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    )
+    shards = []
+    record_count = 0
+    last_record_id = None
+    try:
+        while True:
+            rows = query.get_doc_bin_export_rows(
+                project_id, missing_columns, last_record_id, EXPORT_SHARD_SIZE
+            )
+            if not rows:
+                break
+            shard, index = build_shard(rows)
+            name = f"shard-{len(shards):05d}"
+            index_content = json.dumps(index)
+            shard_entry = {
+                "name": f"{name}.jsonl",
+                "index": f"{name}.index.json",
+                "first_record_id": str(rows[0].record_id),
+                "last_record_id": str(rows[-1].record_id),
+                "record_count": len(rows),
+                "bytes": len(shard),
+                "sha256": get_checksum(shard),
+                "index_sha256": get_checksum(index_content),
+            }
+            shards.append(shard_entry)
+            shard_name = f"{project_id}/{export_prefix}/{shard_entry['name']}"
+            index_name = f"{project_id}/{export_prefix}/{shard_entry['index']}"
+            s3.put_object(org_id, shard_name, shard)
+            s3.put_object(org_id, index_name, index_content)
+            # read back, the manifest must only list shards that arrived intact
+            verify_shard(
+                shard_entry,
+                __get_object_content(org_id, shard_name),
+                __get_object_content(org_id, index_name),
+            )
+            record_count += len(rows)
+            last_record_id = str(rows[-1].record_id)
+    except Exception:
+        # the previous export stays live, the partial one is removed
+        __delete_export(org_id, project_id, {"prefix": export_prefix, "shards": shards})
+        raise
+
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "project_id": str(project_id),
+        "prefix": export_prefix,
+        "created_at": datetime.now().isoformat(),
+        "shard_size": EXPORT_SHARD_SIZE,
+        "record_count": record_count,
+        "shards": shards,
+    }
+    s3.put_object(org_id, __get_manifest_name(project_id), json.dumps(manifest))
+    if previous_manifest:
+        __delete_export(org_id, project_id, previous_manifest)
+
+
+def put_string_table(org_id: str, project_id: str) -> None:
+    # docbins written with DOC_BIN_SHARED_STRINGS only hold hashes, readers add these
+    # strings to their vocab before decoding. Written before the docbins referencing them
+    s3.put_object(
+        org_id,
+        f"{project_id}/{STRING_TABLE_NAME}",
+        json.dumps(string_table.get_strings(project_id)),
+    )
+
+
+def build_shard(rows: List[Any]) -> Tuple[str, Dict[str, List[int]]]:
+    lines = []
+    index = {}
+    offset = 0
+    for row in rows:
+        # ascii only, so string length equals the byte length the offsets refer to
+        line = (
+            json.dumps(
+                {
+                    "record_id": str(row.record_id),
+                    "columns": list(row.columns),
+                    "bytes": base64.b64encode(row.bytes).decode(),
+                    "data": row.data,
+                },
+                ensure_ascii=True,
+            )
+            + "\n"
+        )
+        index[str(row.record_id)] = [offset, len(line)]
+        offset += len(line)
+        lines.append(line)
+    return "".join(lines), index
+
+
+def get_checksum(content: str) -> str:
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def verify_shard(shard_entry: Dict[str, Any], shard: str, index_content: str) -> None:
+    if get_checksum(shard) != shard_entry["sha256"]:
+        raise ValueError(f"Checksum mismatch for {shard_entry['name']}")
+    if get_checksum(index_content) != shard_entry["index_sha256"]:
+        raise ValueError(f"Checksum mismatch for {shard_entry['index']}")
+
+
+def __get_manifest_name(project_id: str) -> str:
+    return f"{project_id}/{PREFIX}/manifest.json"
+
+
+def __get_manifest(org_id: str, project_id: str) -> Optional[Dict[str, Any]]:
+    name = __get_manifest_name(project_id)
+    if not s3.object_exists(org_id, name):
+        return None
+    return json.loads(s3.get_object(org_id, name))
+
+
+def __get_object_content(org_id: str, name: str) -> str:
+    content = s3.get_object(org_id, name)
+    return content.decode() if isinstance(content, bytes) else content
+
+
+def __delete_export(org_id: str, project_id: str, manifest: Dict[str, Any]) -> None:
+    # exports written before versioned prefixes were placed directly under PREFIX
+    export_prefix = manifest.get("prefix", PREFIX)
+    for shard_entry in manifest["shards"]:
+        for name in [shard_entry["name"], shard_entry["index"]]:
+            try:
+                s3.delete_object(org_id, f"{project_id}/{export_prefix}/{name}")
+            except Exception:
+                # a left over object is only storage, the manifest doesn't list it
+                print(traceback.format_exc(), flush=True)
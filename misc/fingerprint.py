@@ -0,0 +1,126 @@
+import hashlib
+import json
+from typing import Dict, List, Tuple
+
+import spacy
+from sqlalchemy import text
+
+from submodules.model.business_objects import general
+from submodules.model.models import RecordTokenized
+from submodules.model.session import session
+
+# content fingerprint of a docbin, lets a re-tokenization skip records that didn't change.
+# Kept in a table of this service keyed like the docbin rows but without a foreign key,
+# so deleting docbins doesn't cascade into it. Fingerprints without a docbin are skipped
+# on read and deleted by re-tokenizations.
+TABLE_NAME = "record_tokenized_fingerprint"
+
+
+def ensure_table() -> None:
+    # relies on the unique index created by query.ensure_unique_indexes
+    session_token = general.get_ctx_token()
+    try:
+        session.execute(
+            text(
+                f"""
+                CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
+                    project_id UUID NOT NULL,
+                    record_id UUID NOT NULL,
+                    fingerprint TEXT NOT NULL,
+                    PRIMARY KEY (project_id, record_id),
+                    FOREIGN KEY (project_id, record_id)
+                        REFERENCES {RecordTokenized.__tablename__} (project_id, record_id)
+                        ON DELETE CASCADE
+                )
+                """
+            )
+        )
+        general.commit()
+    finally:
+        general.remove_and_refresh_session(session_token)
+
+
+def drop_foreign_key() -> None:
+    # migration step, the cascade made every docbin delete touch this table too
+    session_token = general.get_ctx_token()
+    try:
+        session.execute(
+            text(
+                f"""
+                ALTER TABLE {TABLE_NAME}
+                DROP CONSTRAINT IF EXISTS {TABLE_NAME}_project_id_record_id_fkey
+                """
+            )
+        )
+        general.commit()
+    finally:
+        general.remove_and_refresh_session(session_token)
+
+
+def compute(
+    tokenizer_config: str, doc_bin_format: str, values: List[Tuple[str, str]]
+) -> str:
+    # everything the docbin bytes depend on: values in column order, the tokenizer and
+    # the docbin format (profile and string storage)
+    content = json.dumps(
+        [tokenizer_config, spacy.__version__, doc_bin_format, values],
+        ensure_ascii=False,
+    )
+    return hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+
+
+def get_by_record(project_id: str) -> Dict[str, str]:
+    # only fingerprints whose docbin still exists
+    rows = session.execute(
+        text(
+            f"""
+            SELECT f.record_id, f.fingerprint
+            FROM {TABLE_NAME} f
+            INNER JOIN {RecordTokenized.__tablename__} rt
+                ON rt.project_id = f.project_id AND rt.record_id = f.record_id
+            WHERE f.project_id = :project_id
+            """
+        ),
+        {"project_id": project_id},
+    )
+    return {str(row.record_id): row.fingerprint for row in rows}
+
+
+def upsert(project_id: str, fingerprint_by_record: Dict[str, str]) -> None:
+    # no commit, written in the transaction of the docbins they belong to
+    if not fingerprint_by_record:
+        return
+    session.execute(
+        text(
+            f"""
+            INSERT INTO {TABLE_NAME} (project_id, record_id, fingerprint)
+            VALUES (:project_id, :record_id, :fingerprint)
+            ON CONFLICT (project_id, record_id)
+            DO UPDATE SET fingerprint = EXCLUDED.fingerprint
+            """
+        ),
+        [
+            {
+                "project_id": project_id,
+                "record_id": str(record_id),
+                "fingerprint": fingerprint,
+            }
+            for record_id, fingerprint in fingerprint_by_record.items()
+        ],
+    )
+
+
+def delete_orphans(project_id: str) -> None:
+    # no commit, fingerprints of docbins deleted in the meantime (e.g. deleted records)
+    session.execute(
+        text(
+            f"""
+            DELETE FROM {TABLE_NAME} f
+            WHERE f.project_id = :project_id AND NOT EXISTS (
+                SELECT 1 FROM {RecordTokenized.__tablename__} rt
+                WHERE rt.project_id = f.project_id AND rt.record_id = f.record_id
+            )
+            """
+        ),
+        {"project_id": project_id},
+    )
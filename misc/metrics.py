@@ -0,0 +1,287 @@
+import os
+import time
+import traceback
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
+
+from prometheus_client import (
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from prometheus_client.core import GaugeMetricFamily, REGISTRY
+
+from misc import profiling, query, task_queue
+from submodules.model import enums
+from submodules.model.business_objects import general
+
+# values of the task_type label
+TASK_TYPE_PROJECT = "project"
+TASK_TYPE_ATTRIBUTE = "attribute"
+TASK_TYPE_DELTA = "delta"
+TASK_TYPE_MIGRATION = "migration"
+TASK_TYPE_RATS = "rats"
+TASK_TYPE_RECORD = "record"
+TASK_TYPE_UNTRACKED = "untracked"
+
+RECORDS_PROCESSED = Counter(
+    "tokenizer_records_processed_total",
+    "Records processed by the tokenizer",
+    ["task_type"],
+)
+TOKENS_PROCESSED = Counter(
+    "tokenizer_tokens_processed_total",
+    "Tokens created by the tokenizer",
+    ["task_type"],
+)
+RECORDS_SKIPPED = Counter(
+    "tokenizer_records_skipped_total",
+    "Records skipped by a re-tokenization since their content didn't change",
+    ["task_type"],
+)
+CHUNK_STAGE_SECONDS = Histogram(
+    "tokenizer_chunk_stage_seconds",
+    "Time spent per chunk in a processing stage",
+    ["task_type", "stage"],
+    buckets=(0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+DOCBIN_BYTES = Histogram(
+    "tokenizer_docbin_bytes",
+    "Size of serialized docbins per record",
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304),
+)
+MODEL_LOAD_SECONDS = Gauge(
+    "tokenizer_model_load_seconds",
+    "Time it took to load a spacy model",
+    ["config_string"],
+    multiprocess_mode="mostrecent",
+)
+MODEL_MEMORY_BYTES = Gauge(
+    "tokenizer_model_memory_bytes",
+    "Resident memory growth caused by loading a spacy model",
+    ["config_string"],
+    multiprocess_mode="mostrecent",
+)
+TOKEN_CACHE_REQUESTS = Counter(
+    "tokenizer_token_cache_requests_total",
+    "Lookups of decoded tokens by result (hit or miss)",
+    ["result"],
+)
+TOKEN_CACHE_ENTRIES = Gauge(
+    "tokenizer_token_cache_entries",
+    "Records with decoded tokens in the cache",
+    multiprocess_mode="livesum",
+)
+RECORD_QUEUE_DEPTH = Gauge(
+    "tokenizer_record_queue_depth",
+    "On-demand records queued or in flight",
+    multiprocess_mode="livesum",
+)
+
+
+class ChunkMetrics:
+    """
+    Collects stage timings and counts of one chunk in plain python values and
+    reports them with a single observe call per stage once the chunk is done.
+    """
+
+    def __init__(self, task_type: str) -> None:
+        self.task_type = task_type
+        self.stage_seconds = {}
+        self.stage_cpu_seconds = {}
+        self.records = 0
+        self.tokens = 0
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield
+        finally:
+            self.stage_seconds[name] = (
+                self.stage_seconds.get(name, 0) + time.perf_counter() - start
+            )
+            self.stage_cpu_seconds[name] = (
+                self.stage_cpu_seconds.get(name, 0) + time.thread_time() - cpu_start
+            )
+
+    def add_record(self, num_tokens: int, num_bytes: int = 0) -> None:
+        self.records += 1
+        self.tokens += num_tokens
+        if num_bytes:
+            DOCBIN_BYTES.observe(num_bytes)
+
+    def observe(self) -> None:
+        for name, seconds in self.stage_seconds.items():
+            CHUNK_STAGE_SECONDS.labels(self.task_type, name).observe(seconds)
+        RECORDS_PROCESSED.labels(self.task_type).inc(self.records)
+        TOKENS_PROCESSED.labels(self.task_type).inc(self.tokens)
+        profiling.add_chunk(
+            self.stage_seconds, self.stage_cpu_seconds, self.records, self.tokens
+        )
+        self.stage_seconds = {}
+        self.stage_cpu_seconds = {}
+        self.records = 0
+        self.tokens = 0
+
+
+def get_stage_seconds(task_type: str) -> Dict[str, float]:
+    # summed chunk stage timings of this process since it started
+    seconds = {}
+    for metric in CHUNK_STAGE_SECONDS.collect():
+        for sample in metric.samples:
+            if (
+                sample.name.endswith("_sum")
+                and sample.labels.get("task_type") == task_type
+            ):
+                seconds[sample.labels["stage"]] = sample.value
+    return seconds
+
+
+def get_rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def get_memory_breakdown(pid: str = "self") -> Dict[str, int]:
+    # unique = pages only this process maps (what another worker costs),
+    # shared = pages shared e.g. copy-on-write with the preloading master
+    values = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    values[parts[0].rstrip(":")] = int(parts[1]) * 1024
+    except (OSError, ValueError):
+        return {}
+    return {
+        "rss": values.get("Rss", 0),
+        "pss": values.get("Pss", 0),
+        "unique": values.get("Private_Clean", 0) + values.get("Private_Dirty", 0),
+        "shared": values.get("Shared_Clean", 0) + values.get("Shared_Dirty", 0),
+    }
+
+
+def is_multiprocess() -> bool:
+    # set by serve.py, the http workers write their values to files in that directory
+    return bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+
+def generate() -> bytes:
+    if not is_multiprocess():
+        return generate_latest()
+    # a scrape reaches one of the http workers, the values of all of them are read
+    # from the files. The collectors evaluated on scrape are added as they are
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    for collector in __scrape_collectors:
+        registry.register(collector)
+    return generate_latest(registry)
+
+
+def get_serving_pids() -> List[str]:
+    # with serve.py the master and all of its http workers, otherwise this process
+    if not is_multiprocess():
+        return [str(os.getpid())]
+    master_pid = os.getppid()
+    try:
+        with open(f"/proc/{master_pid}/task/{master_pid}/children", "r") as f:
+            return [str(master_pid)] + f.read().split()
+    except OSError:
+        return [str(os.getpid())]
+
+
+class ProcessMemoryCollector:
+    def collect(self):
+        memory = GaugeMetricFamily(
+            "tokenizer_process_memory_bytes",
+            "Memory of the serving processes by kind (rss, pss, unique, shared)",
+            labels=["pid", "kind"],
+        )
+        for pid in get_serving_pids():
+            for kind, value in get_memory_breakdown(pid).items():
+                memory.add_metric([pid, kind], value)
+        yield memory
+
+
+class TaskBacklogCollector:
+    # read from the database on scrape, so tasks and jobs of every process count
+    # whichever process answers
+    def describe(self):
+        # registering would otherwise collect, i.e. query the database on import
+        return self.__get_families()
+
+    def collect(self):
+        depth, age, job_depth, job_age = self.__get_families()
+        session_token = general.get_ctx_token()
+        try:
+            tasks = query.get_open_task_backlog()
+            jobs = task_queue.get_backlog()
+        except Exception:
+            print(traceback.format_exc(), flush=True)
+            return
+        finally:
+            general.remove_and_refresh_session(session_token)
+        count_by_label = {}
+        oldest_by_label = {}
+        for row in tasks:
+            labels = (self.__get_task_type(row.type, row.scope), row.state.lower())
+            count_by_label[labels] = count_by_label.get(labels, 0) + row.count
+            oldest_by_label[labels] = max(
+                oldest_by_label.get(labels, 0), row.oldest_seconds or 0
+            )
+        for labels, count in count_by_label.items():
+            depth.add_metric(list(labels), count)
+            age.add_metric(list(labels), oldest_by_label[labels])
+        for row in jobs:
+            job_depth.add_metric([row.state], row.count)
+            job_age.add_metric([row.state], row.oldest_seconds or 0)
+        yield depth
+        yield age
+        yield job_depth
+        yield job_age
+
+    def __get_families(self) -> List[GaugeMetricFamily]:
+        depth = GaugeMetricFamily(
+            "tokenizer_task_queue_depth",
+            "Tokenization tasks queued (created) or running (in progress)",
+            labels=["task_type", "state"],
+        )
+        age = GaugeMetricFamily(
+            "tokenizer_task_oldest_age_seconds",
+            "Age of the oldest queued or running tokenization task",
+            labels=["task_type", "state"],
+        )
+        job_depth = GaugeMetricFamily(
+            "tokenizer_task_jobs",
+            "Jobs of TASK_EXECUTION=worker waiting for (queued) or run by a worker",
+            labels=["state"],
+        )
+        job_age = GaugeMetricFamily(
+            "tokenizer_task_job_oldest_age_seconds",
+            "Age of the oldest job by state",
+            labels=["state"],
+        )
+        return [depth, age, job_depth, job_age]
+
+    def __get_task_type(self, type: str, scope: str) -> str:
+        if type == enums.TokenizerTask.TYPE_TOKEN_STATISTICS.value:
+            return TASK_TYPE_RATS
+        if scope == enums.RecordTokenizationScope.ATTRIBUTE.value:
+            return TASK_TYPE_ATTRIBUTE
+        return TASK_TYPE_PROJECT
+
+
+# bulk tasks of serve.py run in the worker (TASK_EXECUTION=worker), the memory is
+# read for all http workers and the backlog from the database
+__scrape_collectors = [TaskBacklogCollector(), ProcessMemoryCollector()]
+for __collector in __scrape_collectors:
+    REGISTRY.register(__collector)
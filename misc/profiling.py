@@ -0,0 +1,72 @@
+import cProfile
+import json
+import os
+import random
+import threading
+import time
+import traceback
+from typing import Callable, Dict
+
+# share of tasks profiled without being requested explicitly, e.g. 0.05 for every 20th task
+PROFILE_SAMPLE_RATE = float(os.getenv("TASK_PROFILE_SAMPLE_RATE", 0))
+PROFILE_DIR = os.getenv("TASK_PROFILE_DIR", "/inference/task-profiles")
+
+__current = threading.local()
+
+
+def run_task(task_id: str, profile: bool, target: Callable, *args, **kwargs) -> None:
+    if not profile and random.random() >= PROFILE_SAMPLE_RATE:
+        target(*args, **kwargs)
+        return
+
+    # tasks run in their own thread, the profiler only sees this thread
+    profiler = cProfile.Profile()
+    __current.chunks = []
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+    profiler.enable()
+    try:
+        target(*args, **kwargs)
+    finally:
+        profiler.disable()
+        summary = {
+            "task_id": task_id,
+            "target": target.__name__,
+            "wall_seconds": time.perf_counter() - wall_start,
+            "cpu_seconds": time.thread_time() - cpu_start,
+            "chunks": __current.chunks,
+        }
+        __current.chunks = None
+        __save_profile(task_id, profiler, summary)
+
+
+def add_chunk(
+    stage_seconds: Dict[str, float],
+    stage_cpu_seconds: Dict[str, float],
+    records: int,
+    tokens: int,
+) -> None:
+    chunks = getattr(__current, "chunks", None)
+    if chunks is None:
+        return
+    chunks.append(
+        {
+            "records": records,
+            "tokens": tokens,
+            "wall_seconds": dict(stage_seconds),
+            "cpu_seconds": dict(stage_cpu_seconds),
+        }
+    )
+
+
+def __save_profile(task_id: str, profiler: cProfile.Profile, summary: Dict) -> None:
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        # .prof can be opened with pstats, snakeviz etc.
+        profiler.dump_stats(os.path.join(PROFILE_DIR, f"{task_id}.prof"))
+        with open(os.path.join(PROFILE_DIR, f"{task_id}.json"), "w") as f:
+            json.dump(summary, f, indent=2)
+        print(f"Stored profile of task {task_id} in {PROFILE_DIR}", flush=True)
+    except Exception:
+        print(f"Couldn't store profile of task {task_id}", flush=True)
+        print(traceback.format_exc(), flush=True)
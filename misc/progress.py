@@ -0,0 +1,83 @@
+import os
+import time
+from typing import Optional
+
+from misc import task_estimate
+from misc.util import send_websocket_update
+from submodules.model.business_objects import general, tokenization
+
+PROGRESS_INTERVAL = float(os.getenv("TASK_PROGRESS_INTERVAL", 2))
+
+
+class ProgressTracker:
+    """
+    Counts processed records in memory and only persists / broadcasts the progress
+    every PROGRESS_INTERVAL seconds. Final progress and state changes are still
+    sent by the tasks themselves. The ETA starts from the pre-flight estimate and
+    follows the measured throughput as soon as records are processed.
+    """
+
+    def __init__(
+        self,
+        project_id: str,
+        task_id: str,
+        channel: str,
+        workload: int,
+        estimated_seconds_per_record: Optional[float] = None,
+    ) -> None:
+        self.project_id = project_id
+        self.task_id = task_id
+        self.channel = channel
+        self.workload = max(workload, 1)
+        self.estimated_seconds_per_record = estimated_seconds_per_record
+        self.processed = 0
+        self.started = time.monotonic()
+        self.last_flush = self.started
+
+    @property
+    def progress(self) -> float:
+        # 1 is reserved for the finalization of the task
+        return min(round(self.processed / self.workload, 4), 0.9999)
+
+    @property
+    def records_per_second(self) -> Optional[float]:
+        elapsed = time.monotonic() - self.started
+        if not self.processed or elapsed <= 0:
+            return None
+        return self.processed / elapsed
+
+    @property
+    def eta_seconds(self) -> Optional[float]:
+        remaining = max(self.workload - self.processed, 0)
+        records_per_second = self.records_per_second
+        if records_per_second:
+            return round(remaining / records_per_second, 1)
+        if self.estimated_seconds_per_record is not None:
+            return round(remaining * self.estimated_seconds_per_record, 1)
+        return None
+
+    def add(self, processed: int) -> None:
+        self.processed += processed
+        if time.monotonic() - self.last_flush >= PROGRESS_INTERVAL:
+            self.flush()
+
+    def flush(self) -> None:
+        self.last_flush = time.monotonic()
+        tokenization_task = tokenization.get(self.project_id, self.task_id)
+        if not tokenization_task:
+            return
+        tokenization_task.progress = self.progress
+        eta_seconds = self.eta_seconds
+        task_estimate.update_throughput(
+            self.task_id, self.records_per_second, eta_seconds
+        )
+        general.commit()
+        send_websocket_update(
+            self.project_id,
+            False,
+            [self.channel, "progress", str(tokenization_task.progress)],
+        )
+        if eta_seconds is not None:
+            send_websocket_update(
+                self.project_id, False, [self.channel, "eta", str(eta_seconds)]
+            )
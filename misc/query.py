@@ -0,0 +1,387 @@
+import traceback
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Set
+
+from sqlalchemy import and_, func, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
+
+from submodules.model.models import (
+    Record,
+    RecordAttributeTokenStatistics,
+    RecordTokenizationTask,
+    RecordTokenized,
+)
+from submodules.model import enums
+from submodules.model.business_objects import general
+from submodules.model.session import session
+from . import shadow_generation, token_statistics
+
+# batch queries used by the tokenizer that aren't (yet) part of the model submodule
+
+__SAMPLE_OVERSAMPLING = 2
+
+
+class ProjectedRecord(NamedTuple):
+    # duck types the parts of Record the tokenizer uses, data only holds text attributes
+    id: Any
+    data: Dict[str, Any]
+
+
+def get_records_without_tokenization(
+    project_id: str, text_attributes: Iterable[str]
+) -> List[ProjectedRecord]:
+    return __get_projected_records(
+        project_id,
+        text_attributes,
+        f"""
+        LEFT JOIN {RecordTokenized.__tablename__} rt
+            ON rt.project_id = r.project_id AND rt.record_id = r.id
+        WHERE r.project_id = :project_id AND rt.id IS NULL
+        """,
+    )
+
+
+def get_records_with_text_attributes(
+    project_id: str, text_attributes: Iterable[str]
+) -> List[ProjectedRecord]:
+    return __get_projected_records(
+        project_id, text_attributes, "WHERE r.project_id = :project_id"
+    )
+
+
+def get_records_without_shadow(
+    project_id: str, task_id: str, text_attributes: Iterable[str]
+) -> List[ProjectedRecord]:
+    # records a tokenizer migration hasn't written to its shadow generation yet
+    return __get_projected_records(
+        project_id,
+        text_attributes,
+        f"""
+        LEFT JOIN {shadow_generation.TABLE_NAME} s
+            ON s.project_id = r.project_id AND s.record_id = r.id
+                AND s.task_id = :task_id
+        WHERE r.project_id = :project_id AND s.record_id IS NULL
+        """,
+        {"task_id": task_id},
+    )
+
+
+def get_records_of_record_tokenized(
+    project_id: str, record_tokenized_ids: Iterable[str], text_attributes: Iterable[str]
+) -> List[ProjectedRecord]:
+    return __get_projected_records(
+        project_id,
+        text_attributes,
+        f"""
+        INNER JOIN {RecordTokenized.__tablename__} rt
+            ON rt.project_id = r.project_id AND rt.record_id = r.id
+        WHERE r.project_id = :project_id
+            AND rt.id = ANY(CAST(:record_tokenized_ids AS UUID[]))
+        """,
+        {"record_tokenized_ids": [str(id) for id in record_tokenized_ids]},
+    )
+
+
+def __get_projected_records(
+    project_id: str,
+    text_attributes: Iterable[str],
+    condition: str,
+    condition_parameters: Optional[Dict[str, Any]] = None,
+) -> List[ProjectedRecord]:
+    text_attributes = list(text_attributes)
+    value_columns = "".join(
+        f", r.data -> CAST(:key_{idx} AS TEXT) AS value_{idx}"
+        for idx in range(len(text_attributes))
+    )
+    # keys are selected in storage order to keep the column order of the full fetch
+    sql = f"""
+    SELECT
+        r.id,
+        ARRAY(
+            SELECT key
+            FROM json_object_keys(r.data) key
+            WHERE key = ANY(CAST(:keys AS TEXT[]))
+        ) AS keys
+        {value_columns}
+    FROM {Record.__tablename__} r
+    {condition}
+    """
+    parameters = {
+        "project_id": project_id,
+        "keys": text_attributes,
+        **(condition_parameters or {}),
+    }
+    for idx, key in enumerate(text_attributes):
+        parameters[f"key_{idx}"] = key
+    position_by_key = {key: idx + 2 for idx, key in enumerate(text_attributes)}
+    return [
+        ProjectedRecord(
+            row[0], {key: row[position_by_key[key]] for key in row[1] or []}
+        )
+        for row in session.execute(text(sql), parameters)
+    ]
+
+
+def get_records_by_ids(project_id: str, record_ids: Iterable[str]) -> List[Record]:
+    return (
+        session.query(Record)
+        .filter(Record.project_id == project_id, Record.id.in_(list(record_ids)))
+        .all()
+    )
+
+
+def get_sample_records(
+    project_id: str, size: int, record_count: int, only_untokenized: bool = False
+) -> List[Record]:
+    # record_count are the records matching. Rows of the project are read through its
+    # index and kept with a probability covering the sample size (Bernoulli sampling
+    # within the project), only those are sorted randomly for the limit
+    query = session.query(Record).filter(Record.project_id == project_id)
+    fraction = size * __SAMPLE_OVERSAMPLING / max(record_count, 1)
+    if fraction < 1:
+        query = query.filter(func.random() < fraction)
+    if only_untokenized:
+        query = query.outerjoin(
+            RecordTokenized,
+            and_(
+                RecordTokenized.project_id == Record.project_id,
+                RecordTokenized.record_id == Record.id,
+            ),
+        ).filter(RecordTokenized.id.is_(None))
+    query = query.order_by(func.random())
+    return query.limit(size).all()
+
+
+def get_record_ids_with_byte_data(
+    project_id: str, record_ids: Iterable[str]
+) -> Set[str]:
+    rows = (
+        session.query(RecordTokenized.record_id)
+        .filter(
+            RecordTokenized.project_id == project_id,
+            RecordTokenized.record_id.in_(list(record_ids)),
+            RecordTokenized.bytes.isnot(None),
+        )
+        .all()
+    )
+    return {str(row.record_id) for row in rows}
+
+
+def get_doc_bin_export_rows(
+    project_id: str,
+    missing_columns: Iterable[str],
+    after_record_id: Optional[str],
+    limit: int,
+) -> List[Any]:
+    # keyset pagination by record id, data holds the non text attributes
+    missing_columns = list(missing_columns)
+    data_columns = ", ".join(
+        f"CAST(:key_{idx} AS TEXT), r.data -> CAST(:key_{idx} AS TEXT)"
+        for idx in range(len(missing_columns))
+    )
+    sql = f"""
+    SELECT rt.record_id, rt.bytes, rt.columns, json_build_object({data_columns}) AS data
+    FROM {RecordTokenized.__tablename__} rt
+    INNER JOIN {Record.__tablename__} r
+        ON r.project_id = rt.project_id AND r.id = rt.record_id
+    WHERE rt.project_id = :project_id
+        AND (CAST(:after_record_id AS UUID) IS NULL
+            OR rt.record_id > CAST(:after_record_id AS UUID))
+    ORDER BY rt.record_id
+    LIMIT :limit
+    """
+    parameters = {
+        "project_id": project_id,
+        "after_record_id": after_record_id,
+        "limit": limit,
+    }
+    for idx, key in enumerate(missing_columns):
+        parameters[f"key_{idx}"] = key
+    return session.execute(text(sql), parameters).all()
+
+
+def get_record_tokenized_versions(
+    project_id: str, record_ids: Iterable[str]
+) -> Dict[str, str]:
+    # xmin changes with every write of the row, so it serves as docbin version
+    rows = session.execute(
+        text(
+            f"""
+            SELECT record_id, CAST(xmin AS TEXT) AS version
+            FROM {RecordTokenized.__tablename__}
+            WHERE project_id = :project_id
+                AND record_id = ANY(CAST(:record_ids AS UUID[]))
+                AND bytes IS NOT NULL
+            """
+        ),
+        {"project_id": project_id, "record_ids": [str(r) for r in record_ids]},
+    )
+    return {str(row.record_id): row.version for row in rows}
+
+
+def get_record_tokenized_with_versions(
+    project_id: str, record_ids: Iterable[str]
+) -> List[Any]:
+    return session.execute(
+        text(
+            f"""
+            SELECT id, record_id, bytes, columns, CAST(xmin AS TEXT) AS version
+            FROM {RecordTokenized.__tablename__}
+            WHERE project_id = :project_id
+                AND record_id = ANY(CAST(:record_ids AS UUID[]))
+                AND bytes IS NOT NULL
+            """
+        ),
+        {"project_id": project_id, "record_ids": [str(r) for r in record_ids]},
+    ).all()
+
+
+# unique keys the upserts below rely on, see ensure_unique_indexes
+__RECORD_TOKENIZED_KEY = ["project_id", "record_id"]
+__TOKEN_STATISTICS_KEY = ["project_id", "record_id", "attribute_id"]
+__UNIQUE_INDEX_ATTEMPTS = 3
+
+
+def upsert_record_tokenized(entries: List[RecordTokenized]) -> None:
+    # no commit, writing the same record twice only replaces the docbin
+    if not entries:
+        return
+    statement = insert(RecordTokenized).values(
+        [
+            {
+                "project_id": entry.project_id,
+                "record_id": entry.record_id,
+                "bytes": entry.bytes,
+                "columns": entry.columns,
+            }
+            for entry in entries
+        ]
+    )
+    session.execute(
+        statement.on_conflict_do_update(
+            index_elements=__RECORD_TOKENIZED_KEY,
+            set_={
+                "bytes": statement.excluded.bytes,
+                "columns": statement.excluded.columns,
+            },
+        )
+    )
+
+
+def upsert_token_statistics(values: List[Dict[str, Any]]) -> None:
+    # no commit, the caller writes the statistics in the same transaction as the docbins
+    if not values:
+        return
+    statement = insert(RecordAttributeTokenStatistics).values(values)
+    session.execute(
+        statement.on_conflict_do_update(
+            index_elements=__TOKEN_STATISTICS_KEY,
+            set_={"num_token": statement.excluded.num_token},
+        )
+    )
+
+
+def delete_duplicates(project_id: str) -> None:
+    # repair for data written before the unique indexes existed
+    for table_name, key in [
+        (RecordTokenized.__tablename__, __RECORD_TOKENIZED_KEY),
+        (RecordAttributeTokenStatistics.__tablename__, __TOKEN_STATISTICS_KEY),
+    ]:
+        session.execute(
+            text(__get_delete_duplicates_sql(table_name, key, "AND a.project_id = :p")),
+            {"p": project_id},
+        )
+    token_statistics.rebuild(project_id)
+    general.commit()
+
+
+def ensure_unique_indexes() -> None:
+    # migration step, see migrate.py. Built concurrently so writes continue meanwhile,
+    # which needs a connection outside of a transaction
+    with session.get_bind().connect() as connection:
+        connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+        for table_name, key in [
+            (RecordTokenized.__tablename__, __RECORD_TOKENIZED_KEY),
+            (RecordAttributeTokenStatistics.__tablename__, __TOKEN_STATISTICS_KEY),
+        ]:
+            __create_unique_index(connection, table_name, key)
+
+
+def __create_unique_index(connection: Any, table_name: str, key: List[str]) -> None:
+    index_name = f"uq_{table_name}_{'_'.join(key)}"
+    valid = __get_index_validity(connection, index_name)
+    if valid:
+        return
+    # a duplicate written between the delete and the end of the build fails it
+    for _ in range(__UNIQUE_INDEX_ATTEMPTS):
+        if valid is not None:
+            # left behind by a failed concurrent build
+            connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}"))
+        print(f"Creating unique index {index_name}", flush=True)
+        connection.execute(text(__get_delete_duplicates_sql(table_name, key)))
+        try:
+            connection.execute(
+                text(
+                    f"CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {index_name} "
+                    f"ON {table_name} ({', '.join(key)})"
+                )
+            )
+        except IntegrityError:
+            print(traceback.format_exc(), flush=True)
+        valid = __get_index_validity(connection, index_name)
+        if valid:
+            return
+    raise RuntimeError(f"Couldn't create unique index {index_name}")
+
+
+def __get_index_validity(connection: Any, index_name: str) -> Optional[bool]:
+    # None if the index doesn't exist
+    return connection.execute(
+        text(
+            """
+            SELECT i.indisvalid
+            FROM pg_index i
+            INNER JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE c.relname = :index_name
+            """
+        ),
+        {"index_name": index_name},
+    ).scalar()
+
+
+def __get_delete_duplicates_sql(
+    table_name: str, key: List[str], condition: str = ""
+) -> str:
+    key_condition = " AND ".join(f"a.{column} = b.{column}" for column in key)
+    return f"""
+    DELETE FROM {table_name} a
+    USING {table_name} b
+    WHERE {key_condition} AND a.id < b.id {condition}
+    """
+
+
+def get_open_task_backlog() -> List[Any]:
+    return session.execute(
+        text(
+            f"""
+            SELECT type, scope, state, COUNT(*) AS count,
+                EXTRACT(EPOCH FROM now() - MIN(started_at)) AS oldest_seconds
+            FROM {RecordTokenizationTask.__tablename__}
+            WHERE state IN (:state_created, :state_in_progress)
+            GROUP BY type, scope, state
+            """
+        ),
+        {
+            "state_created": enums.TokenizerTask.STATE_CREATED.value,
+            "state_in_progress": enums.TokenizerTask.STATE_IN_PROGRESS.value,
+        },
+    ).all()
+
+
+def get_task_states(task_ids: Iterable[str]) -> Dict[str, str]:
+    rows = (
+        session.query(RecordTokenizationTask.id, RecordTokenizationTask.state)
+        .filter(RecordTokenizationTask.id.in_(list(task_ids)))
+        .all()
+    )
+    return {str(row.id): row.state for row in rows}
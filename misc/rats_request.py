@@ -0,0 +1,89 @@
+from typing import Any, List, Optional
+
+from sqlalchemy import text
+
+from submodules.model.business_objects import general
+from submodules.model.session import session
+
+# rats requests that arrived while docbins of the project were created. Kept in the
+# database since the docbin task may run in another process, the last docbin task to
+# end (finished, failed or cancelled) starts them
+TABLE_NAME = "record_tokenization_rats_request"
+
+
+def ensure_table() -> None:
+    session_token = general.get_ctx_token()
+    try:
+        session.execute(
+            text(
+                f"""
+                CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
+                    id BIGSERIAL PRIMARY KEY,
+                    project_id UUID NOT NULL,
+                    user_id UUID NOT NULL,
+                    only_uploaded_attributes BOOLEAN NOT NULL,
+                    attribute_id UUID,
+                    profile BOOLEAN NOT NULL,
+                    created_at TIMESTAMP NOT NULL DEFAULT now()
+                )
+                """
+            )
+        )
+        session.execute(
+            text(
+                f"CREATE INDEX IF NOT EXISTS ix_{TABLE_NAME}_project_id "
+                f"ON {TABLE_NAME} (project_id)"
+            )
+        )
+        general.commit()
+    finally:
+        general.remove_and_refresh_session(session_token)
+
+
+def add(
+    project_id: str,
+    user_id: str,
+    only_uploaded_attributes: bool,
+    attribute_id: Optional[str],
+    profile: bool,
+) -> None:
+    # no commit, the same request twice would only calculate the same statistics twice
+    session.execute(
+        text(
+            f"""
+            INSERT INTO {TABLE_NAME} (
+                project_id, user_id, only_uploaded_attributes, attribute_id, profile
+            )
+            SELECT :project_id, :user_id, :only_uploaded_attributes,
+                CAST(:attribute_id AS UUID), :profile
+            WHERE NOT EXISTS (
+                SELECT 1 FROM {TABLE_NAME}
+                WHERE project_id = :project_id AND user_id = :user_id
+                    AND only_uploaded_attributes = :only_uploaded_attributes
+                    AND attribute_id IS NOT DISTINCT FROM CAST(:attribute_id AS UUID)
+                    AND profile = :profile
+            )
+            """
+        ),
+        {
+            "project_id": str(project_id),
+            "user_id": str(user_id),
+            "only_uploaded_attributes": only_uploaded_attributes,
+            "attribute_id": str(attribute_id) if attribute_id else None,
+            "profile": profile,
+        },
+    )
+
+
+def pop(project_id: str) -> List[Any]:
+    # no commit, in arrival order. Concurrent callers get disjoint rows
+    rows = session.execute(
+        text(
+            f"""
+            DELETE FROM {TABLE_NAME} WHERE project_id = :project_id
+            RETURNING id, user_id, only_uploaded_attributes, attribute_id, profile
+            """
+        ),
+        {"project_id": str(project_id)},
+    ).all()
+    return sorted(rows, key=lambda row: row.id)
@@ -0,0 +1,242 @@
+import os
+from typing import Any, Dict, Iterator, List, Optional
+
+from sqlalchemy import text
+
+from submodules.model import enums
+from submodules.model.business_objects import general
+from submodules.model.models import (
+    Record,
+    RecordAttributeTokenStatistics,
+    RecordTokenizationTask,
+    RecordTokenized,
+)
+from submodules.model.session import session
+from . import fingerprint
+
+# docbins of a tokenizer migration are written here first and copied over the live
+# docbins in one transaction once every record is done, readers never see a mix
+TABLE_NAME = "record_tokenized_shadow"
+# the migration running per project, claimed_at is renewed after every chunk
+MIGRATION_TABLE_NAME = "record_tokenizer_migration"
+# a migration not renewing its claim for this long died with its process
+MIGRATION_LEASE_SECONDS = int(os.getenv("TOKENIZER_MIGRATION_LEASE_SECONDS", 300))
+
+
+def ensure_table() -> None:
+    session_token = general.get_ctx_token()
+    try:
+        session.execute(
+            text(
+                f"""
+                CREATE TABLE IF NOT EXISTS {MIGRATION_TABLE_NAME} (
+                    project_id UUID PRIMARY KEY,
+                    task_id UUID NOT NULL
+                        REFERENCES {RecordTokenizationTask.__tablename__} (id)
+                        ON DELETE CASCADE,
+                    tokenizer TEXT NOT NULL,
+                    claimed_at TIMESTAMP NOT NULL DEFAULT now()
+                )
+                """
+            )
+        )
+        session.execute(
+            text(
+                f"""
+                CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
+                    project_id UUID NOT NULL,
+                    record_id UUID NOT NULL,
+                    task_id UUID NOT NULL
+                        REFERENCES {RecordTokenizationTask.__tablename__} (id)
+                        ON DELETE CASCADE,
+                    tokenizer TEXT NOT NULL,
+                    bytes BYTEA NOT NULL,
+                    columns JSONB NOT NULL,
+                    num_token_by_attribute JSONB NOT NULL,
+                    fingerprint TEXT NOT NULL,
+                    PRIMARY KEY (project_id, record_id)
+                )
+                """
+            )
+        )
+        general.commit()
+    finally:
+        general.remove_and_refresh_session(session_token)
+
+
+def __get_running_condition() -> str:
+    # queued migrations count as running, started ones only while they renew the claim
+    return """
+        t.state = :state_created OR (
+            t.state = :state_in_progress
+            AND m.claimed_at > now() - make_interval(secs => :lease_seconds)
+        )
+    """
+
+
+def __get_running_parameters() -> Dict[str, Any]:
+    return {
+        "state_created": enums.TokenizerTask.STATE_CREATED.value,
+        "state_in_progress": enums.TokenizerTask.STATE_IN_PROGRESS.value,
+        "lease_seconds": MIGRATION_LEASE_SECONDS,
+    }
+
+
+def claim(project_id: str, task_id: str, tokenizer: str) -> bool:
+    # no commit. Registers the migration when it's created and again when it starts or
+    # resumes. Fails while another migration of the project is running, rows left by
+    # migrations that aren't running anymore are removed, rows of the same task resumed
+    session.execute(
+        text(
+            f"""
+            DELETE FROM {MIGRATION_TABLE_NAME} m
+            USING {RecordTokenizationTask.__tablename__} t
+            WHERE m.project_id = :project_id AND m.task_id != :task_id
+                AND t.id = m.task_id AND NOT ({__get_running_condition()})
+            """
+        ),
+        {"project_id": project_id, "task_id": task_id, **__get_running_parameters()},
+    )
+    claimed = session.execute(
+        text(
+            f"""
+            INSERT INTO {MIGRATION_TABLE_NAME} (project_id, task_id, tokenizer)
+            VALUES (:project_id, :task_id, :tokenizer)
+            ON CONFLICT (project_id) DO UPDATE SET claimed_at = now()
+            WHERE {MIGRATION_TABLE_NAME}.task_id = EXCLUDED.task_id
+            RETURNING task_id
+            """
+        ),
+        {"project_id": project_id, "task_id": task_id, "tokenizer": tokenizer},
+    ).first()
+    if not claimed:
+        return False
+    session.execute(
+        text(
+            f"DELETE FROM {TABLE_NAME} "
+            "WHERE project_id = :project_id AND task_id != :task_id"
+        ),
+        {"project_id": project_id, "task_id": task_id},
+    )
+    return True
+
+
+def renew_claim(project_id: str, task_id: str) -> None:
+    # no commit
+    session.execute(
+        text(
+            f"UPDATE {MIGRATION_TABLE_NAME} SET claimed_at = now() "
+            "WHERE project_id = :project_id AND task_id = :task_id"
+        ),
+        {"project_id": project_id, "task_id": task_id},
+    )
+
+
+def get_running(project_id: str) -> Optional[Any]:
+    # task_id and tokenizer of the running migration of the project
+    return session.execute(
+        text(
+            f"""
+            SELECT m.task_id, m.tokenizer
+            FROM {MIGRATION_TABLE_NAME} m
+            INNER JOIN {RecordTokenizationTask.__tablename__} t ON t.id = m.task_id
+            WHERE m.project_id = :project_id AND ({__get_running_condition()})
+            """
+        ),
+        {"project_id": project_id, **__get_running_parameters()},
+    ).first()
+
+
+def release(project_id: str, task_id: str) -> None:
+    # no commit, the shadow rows of the migration and its claim
+    for table_name in [TABLE_NAME, MIGRATION_TABLE_NAME]:
+        session.execute(
+            text(
+                f"DELETE FROM {table_name} "
+                "WHERE project_id = :project_id AND task_id = :task_id"
+            ),
+            {"project_id": project_id, "task_id": task_id},
+        )
+
+
+def upsert(entries: List[Dict[str, Any]]) -> None:
+    # no commit, entries hold all columns of the table
+    if not entries:
+        return
+    session.execute(
+        text(
+            f"""
+            INSERT INTO {TABLE_NAME} (
+                project_id, record_id, task_id, tokenizer, bytes, columns,
+                num_token_by_attribute, fingerprint
+            )
+            VALUES (
+                :project_id, :record_id, :task_id, :tokenizer, :bytes,
+                CAST(:columns AS JSONB), CAST(:num_token_by_attribute AS JSONB),
+                :fingerprint
+            )
+            ON CONFLICT (project_id, record_id) DO UPDATE SET
+                task_id = EXCLUDED.task_id,
+                tokenizer = EXCLUDED.tokenizer,
+                bytes = EXCLUDED.bytes,
+                columns = EXCLUDED.columns,
+                num_token_by_attribute = EXCLUDED.num_token_by_attribute,
+                fingerprint = EXCLUDED.fingerprint
+            """
+        ),
+        entries,
+    )
+
+
+def iterate(project_id: str, task_id: str, chunk_size: int) -> Iterator[List[Any]]:
+    # keyset pagination, only rows of records that still exist
+    last_record_id = None
+    while True:
+        rows = session.execute(
+            text(
+                f"""
+                SELECT s.*
+                FROM {TABLE_NAME} s
+                INNER JOIN {Record.__tablename__} r
+                    ON r.project_id = s.project_id AND r.id = s.record_id
+                WHERE s.project_id = :project_id AND s.task_id = :task_id
+                    AND (CAST(:last_record_id AS UUID) IS NULL
+                        OR s.record_id > CAST(:last_record_id AS UUID))
+                ORDER BY s.record_id
+                LIMIT :limit
+                """
+            ),
+            {
+                "project_id": project_id,
+                "task_id": task_id,
+                "last_record_id": last_record_id,
+                "limit": chunk_size,
+            },
+        ).all()
+        if not rows:
+            return
+        yield rows
+        last_record_id = str(rows[-1].record_id)
+
+
+def delete_live_without_shadow(project_id: str, task_id: str) -> None:
+    # no commit, records tokenized with the old tokenizer after the last migration pass
+    # lose their docbin, fingerprint and statistics, the migration tokenizes them again
+    for table_name in [
+        RecordAttributeTokenStatistics.__tablename__,
+        fingerprint.TABLE_NAME,
+        RecordTokenized.__tablename__,
+    ]:
+        session.execute(
+            text(
+                f"""
+                DELETE FROM {table_name} t
+                WHERE t.project_id = :project_id AND NOT EXISTS (
+                    SELECT 1 FROM {TABLE_NAME} s
+                    WHERE s.project_id = t.project_id AND s.record_id = t.record_id
+                        AND s.task_id = :task_id
+                )
+                """
+            ),
+            {"project_id": project_id, "task_id": task_id},
+        )
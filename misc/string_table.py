@@ -0,0 +1,187 @@
+import os
+import threading
+from typing import Dict, Iterable, List, Set
+
+import numpy as np
+from spacy.attrs import (
+    DEP,
+    ENT_ID,
+    ENT_KB_ID,
+    ENT_TYPE,
+    LEMMA,
+    LOWER,
+    MORPH,
+    NORM,
+    ORTH,
+    PREFIX,
+    SHAPE,
+    SUFFIX,
+    TAG,
+)
+from spacy.strings import hash_string
+from spacy.tokens import DocBin
+from spacy.vocab import Vocab
+from sqlalchemy import text
+
+from submodules.model.business_objects import general
+from submodules.model.session import session
+
+# docbins only store token hashes plus the strings behind them. With shared strings the
+# strings are kept once per project instead of once per record. The hashes don't depend
+# on the tokenizer, so one append-only table per project covers tokenizer changes too.
+# New strings are written in the transaction of their docbins, see commit.
+SHARED_STRINGS = os.getenv("DOC_BIN_SHARED_STRINGS", "false").lower() == "true"
+TABLE_NAME = "record_tokenized_string"
+
+# docbin columns holding string hashes
+__STRING_ATTRS = {
+    DEP,
+    ENT_ID,
+    ENT_KB_ID,
+    ENT_TYPE,
+    LEMMA,
+    LOWER,
+    MORPH,
+    NORM,
+    ORTH,
+    PREFIX,
+    SHAPE,
+    SUFFIX,
+    TAG,
+}
+
+__persisted_strings: Dict[str, Set[str]] = {}
+__lock = threading.Lock()
+# strings stripped by this thread that aren't written yet, project_id -> strings
+__pending = threading.local()
+
+
+def ensure_table() -> None:
+    session_token = general.get_ctx_token()
+    try:
+        session.execute(
+            text(
+                f"""
+                CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
+                    project_id UUID NOT NULL,
+                    hash BIGINT NOT NULL,
+                    string TEXT NOT NULL,
+                    PRIMARY KEY (project_id, hash)
+                )
+                """
+            )
+        )
+        general.commit()
+    finally:
+        general.remove_and_refresh_session(session_token)
+
+
+def strip_strings(project_id: str, doc_bin: DocBin) -> None:
+    if not SHARED_STRINGS:
+        return
+    project_id = str(project_id)
+    with __lock:
+        if project_id not in __persisted_strings:
+            __persisted_strings[project_id] = __load_strings(project_id)
+        new_strings = doc_bin.strings - __persisted_strings[project_id]
+    __get_pending().setdefault(project_id, set()).update(new_strings)
+    doc_bin.strings = set()
+
+
+def commit(project_id: str) -> None:
+    # commits the session together with the strings stripped since the last commit,
+    # a rollback removes both and a docbin never references strings that aren't stored
+    strings = __get_pending().pop(str(project_id), set())
+    if strings:
+        session.execute(
+            text(
+                f"""
+                INSERT INTO {TABLE_NAME} (project_id, hash, string)
+                SELECT :project_id, h, s
+                FROM unnest(CAST(:hashes AS BIGINT[]), CAST(:strings AS TEXT[])) AS t(h, s)
+                ON CONFLICT DO NOTHING
+                """
+            ),
+            {
+                "project_id": str(project_id),
+                "hashes": [__get_hash(string) for string in strings],
+                "strings": list(strings),
+            },
+        )
+    general.commit()
+    if strings:
+        with __lock:
+            if str(project_id) in __persisted_strings:
+                __persisted_strings[str(project_id)] |= strings
+
+
+def rollback(project_id: str) -> None:
+    __get_pending().pop(str(project_id), None)
+    general.rollback()
+
+
+def ensure_strings_in_vocab(project_id: str, doc_bin: DocBin, vocab: Vocab) -> None:
+    # only docbins written with shared strings, and only the strings they reference,
+    # like a docbin with its own strings would. Numeric columns (heads, spaces) are
+    # skipped, their values aren't string hashes
+    if not SHARED_STRINGS or doc_bin.strings:
+        return
+    columns = [idx for idx, attr in enumerate(doc_bin.attrs) if attr in __STRING_ATTRS]
+    if not columns:
+        return
+    missing = [
+        value
+        for tokens in doc_bin.tokens
+        for value in np.unique(tokens[:, columns]).tolist()
+        if value and value not in vocab.strings
+    ]
+    if not missing:
+        return
+    for string in __load_strings_by_hash(str(project_id), set(missing)):
+        vocab.strings.add(string)
+
+
+def get_strings(project_id: str) -> List[str]:
+    return sorted(__load_strings(str(project_id)))
+
+
+def __get_pending() -> Dict[str, Set[str]]:
+    if not hasattr(__pending, "strings"):
+        __pending.strings = {}
+    return __pending.strings
+
+
+def __get_hash(string: str) -> int:
+    return __to_signed(hash_string(string))
+
+
+def __to_signed(value: int) -> int:
+    # string store hashes are unsigned 64 bit, postgres only has signed integers
+    return value - 2**64 if value >= 2**63 else value
+
+
+def __load_strings(project_id: str) -> Set[str]:
+    with session.get_bind().connect() as connection:
+        rows = connection.execute(
+            text(f"SELECT string FROM {TABLE_NAME} WHERE project_id = :project_id"),
+            {"project_id": project_id},
+        )
+        return {row.string for row in rows}
+
+
+def __load_strings_by_hash(project_id: str, hashes: Iterable[int]) -> Set[str]:
+    with session.get_bind().connect() as connection:
+        rows = connection.execute(
+            text(
+                f"""
+                SELECT string FROM {TABLE_NAME}
+                WHERE project_id = :project_id
+                    AND hash = ANY(CAST(:hashes AS BIGINT[]))
+                """
+            ),
+            {
+                "project_id": project_id,
+                "hashes": [__to_signed(value) for value in hashes],
+            },
+        )
+        return {row.string for row in rows}
@@ -0,0 +1,95 @@
+import json
+from typing import Any, Dict, Optional
+
+from sqlalchemy import text
+
+from submodules.model.business_objects import general
+from submodules.model.models import RecordTokenizationTask
+from submodules.model.session import session
+
+# pre-flight estimate of a tokenization task and the throughput it actually reaches.
+# Kept in a table of this service referencing the task, so it's deleted with the task.
+TABLE_NAME = "record_tokenization_task_estimate"
+
+
+def ensure_table() -> None:
+    session_token = general.get_ctx_token()
+    try:
+        session.execute(
+            text(
+                f"""
+                CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
+                    task_id UUID PRIMARY KEY
+                        REFERENCES {RecordTokenizationTask.__tablename__} (id)
+                        ON DELETE CASCADE,
+                    project_id UUID NOT NULL,
+                    estimate JSONB NOT NULL,
+                    records_per_second DOUBLE PRECISION,
+                    eta_seconds DOUBLE PRECISION,
+                    created_at TIMESTAMP NOT NULL DEFAULT NOW()
+                )
+                """
+            )
+        )
+        general.commit()
+    finally:
+        general.remove_and_refresh_session(session_token)
+
+
+def store(project_id: str, task_id: str, estimate: Dict[str, Any]) -> None:
+    # no commit
+    session.execute(
+        text(
+            f"""
+            INSERT INTO {TABLE_NAME} (task_id, project_id, estimate)
+            VALUES (:task_id, :project_id, CAST(:estimate AS JSONB))
+            ON CONFLICT (task_id) DO UPDATE SET estimate = EXCLUDED.estimate
+            """
+        ),
+        {
+            "task_id": str(task_id),
+            "project_id": str(project_id),
+            "estimate": json.dumps(estimate),
+        },
+    )
+
+
+def update_throughput(
+    task_id: str, records_per_second: Optional[float], eta_seconds: Optional[float]
+) -> None:
+    # no commit, written together with the task progress
+    session.execute(
+        text(
+            f"""
+            UPDATE {TABLE_NAME}
+            SET records_per_second = :records_per_second, eta_seconds = :eta_seconds
+            WHERE task_id = :task_id
+            """
+        ),
+        {
+            "task_id": str(task_id),
+            "records_per_second": records_per_second,
+            "eta_seconds": eta_seconds,
+        },
+    )
+
+
+def get(project_id: str, task_id: str) -> Optional[Dict[str, Any]]:
+    row = session.execute(
+        text(
+            f"""
+            SELECT estimate, records_per_second, eta_seconds, created_at
+            FROM {TABLE_NAME}
+            WHERE project_id = :project_id AND task_id = :task_id
+            """
+        ),
+        {"project_id": project_id, "task_id": task_id},
+    ).first()
+    if not row:
+        return None
+    return {
+        "estimate": row.estimate,
+        "records_per_second": row.records_per_second,
+        "eta_seconds": row.eta_seconds,
+        "created_at": row.created_at.isoformat(),
+    }
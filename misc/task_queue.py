@@ -0,0 +1,140 @@
+import json
+import os
+import uuid
+from typing import Any, Callable, List, Optional
+
+from sqlalchemy import text
+
+from misc import daemon, profiling
+from submodules.model.business_objects import general
+from submodules.model.session import session
+
+# with TASK_EXECUTION=worker the api only creates the tasks and queues them here, a
+# separate process (python worker.py) runs them. "local" runs them as threads of the api.
+RUN_IN_WORKER = os.getenv("TASK_EXECUTION", "local").lower() == "worker"
+TABLE_NAME = "tokenizer_task_job"
+# unique per process unless set, a restarted pod usually doesn't keep its hostname
+WORKER_ID = os.getenv("WORKER_ID") or str(uuid.uuid4())
+# running jobs renew their claim, jobs of a worker that stopped doing so are claimed again
+JOB_LEASE_SECONDS = int(os.getenv("WORKER_JOB_LEASE_SECONDS", 120))
+
+
+def ensure_table() -> None:
+    session_token = general.get_ctx_token()
+    try:
+        session.execute(
+            text(
+                f"""
+                CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
+                    id UUID PRIMARY KEY,
+                    function TEXT NOT NULL,
+                    arguments JSONB NOT NULL,
+                    created_at TIMESTAMP NOT NULL DEFAULT now(),
+                    claimed_by TEXT,
+                    claimed_at TIMESTAMP
+                )
+                """
+            )
+        )
+        general.commit()
+    finally:
+        general.remove_and_refresh_session(session_token)
+
+
+def run_task(task_id: str, profile: bool, target: Callable, *args: Any) -> None:
+    # target must be one of task_manager.TASK_FUNCTIONS. In the worker tasks started by
+    # tasks are queued as well, so WORKER_CONCURRENCY bounds them too
+    if RUN_IN_WORKER:
+        enqueue(task_id, target.__name__, [profile, *args])
+    else:
+        daemon.run(profiling.run_task, task_id, profile, target, *args)
+
+
+def enqueue(job_id: str, function: str, arguments: List[Any]) -> None:
+    session.execute(
+        text(
+            f"INSERT INTO {TABLE_NAME} (id, function, arguments) "
+            "VALUES (:id, :function, CAST(:arguments AS JSONB))"
+        ),
+        {"id": job_id, "function": function, "arguments": json.dumps(arguments)},
+    )
+    general.commit()
+
+
+def claim() -> Optional[Any]:
+    # skip locked lets several workers poll the same table
+    row = session.execute(
+        text(
+            f"""
+            UPDATE {TABLE_NAME}
+            SET claimed_by = :worker_id, claimed_at = now()
+            WHERE id = (
+                SELECT id FROM {TABLE_NAME}
+                WHERE claimed_at IS NULL
+                    OR claimed_at < now() - make_interval(secs => :lease_seconds)
+                ORDER BY created_at
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, function, arguments
+            """
+        ),
+        {"worker_id": WORKER_ID, "lease_seconds": JOB_LEASE_SECONDS},
+    ).first()
+    general.commit()
+    return row
+
+
+def renew_claims(job_ids: List[str]) -> None:
+    if not job_ids:
+        return
+    session.execute(
+        text(
+            f"UPDATE {TABLE_NAME} SET claimed_at = now() "
+            "WHERE id = ANY(CAST(:ids AS UUID[])) AND claimed_by = :worker_id"
+        ),
+        {"ids": job_ids, "worker_id": WORKER_ID},
+    )
+    general.commit()
+
+
+def finish(job_id: str) -> None:
+    # a job claimed again by another worker after the lease expired stays theirs
+    session.execute(
+        text(f"DELETE FROM {TABLE_NAME} WHERE id = :id AND claimed_by = :worker_id"),
+        {"id": job_id, "worker_id": WORKER_ID},
+    )
+    general.commit()
+
+
+def get_backlog() -> List[Any]:
+    # jobs whose lease expired wait for a worker again
+    return session.execute(
+        text(
+            f"""
+            SELECT
+                CASE WHEN claimed_at IS NULL
+                    OR claimed_at < now() - make_interval(secs => :lease_seconds)
+                THEN 'queued' ELSE 'claimed' END AS state,
+                COUNT(*) AS count,
+                EXTRACT(EPOCH FROM now() - MIN(created_at)) AS oldest_seconds
+            FROM {TABLE_NAME}
+            GROUP BY 1
+            """
+        ),
+        {"lease_seconds": JOB_LEASE_SECONDS},
+    ).all()
+
+
+def release_claimed_jobs() -> int:
+    # with a fixed WORKER_ID the jobs claimed before a restart are picked up again
+    # without waiting for the lease to expire, the tasks only write idempotent upserts
+    result = session.execute(
+        text(
+            f"UPDATE {TABLE_NAME} SET claimed_by = NULL, claimed_at = NULL "
+            "WHERE claimed_by = :worker_id"
+        ),
+        {"worker_id": WORKER_ID},
+    )
+    general.commit()
+    return result.rowcount
@@ -0,0 +1,51 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from . import metrics
+
+# decoded tokens of hot records. Entries are keyed by record and docbin version (the
+# row version of record_tokenized), so a rewritten docbin is never served from the cache
+# even if it was written by someone else. Writes of this service invalidate as well.
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 10000))
+
+# (project_id, record_id) -> (version, tokens by attribute)
+__cache: "OrderedDict[Tuple[str, str], Tuple[str, Dict[str, Any]]]" = OrderedDict()
+__lock = threading.Lock()
+
+
+def get(project_id: str, record_id: str, version: str) -> Optional[Dict[str, Any]]:
+    key = (str(project_id), str(record_id))
+    with __lock:
+        entry = __cache.get(key)
+        if entry is None or entry[0] != version:
+            metrics.TOKEN_CACHE_REQUESTS.labels("miss").inc()
+            return None
+        __cache.move_to_end(key)
+    metrics.TOKEN_CACHE_REQUESTS.labels("hit").inc()
+    return entry[1]
+
+
+def put(project_id: str, record_id: str, version: str, tokens: Dict[str, Any]) -> None:
+    if TOKEN_CACHE_SIZE <= 0:
+        return
+    key = (str(project_id), str(record_id))
+    with __lock:
+        __cache[key] = (version, tokens)
+        __cache.move_to_end(key)
+        while len(__cache) > TOKEN_CACHE_SIZE:
+            __cache.popitem(last=False)
+        metrics.TOKEN_CACHE_ENTRIES.set(len(__cache))
+
+
+def invalidate(project_id: str, record_ids: Optional[Iterable[Any]] = None) -> None:
+    project_id = str(project_id)
+    with __lock:
+        if record_ids is None:
+            keys = [key for key in __cache if key[0] == project_id]
+        else:
+            keys = [(project_id, str(record_id)) for record_id in record_ids]
+        for key in keys:
+            __cache.pop(key, None)
+        metrics.TOKEN_CACHE_ENTRIES.set(len(__cache))
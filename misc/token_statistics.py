@@ -0,0 +1,266 @@
+import math
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+from sqlalchemy import text
+
+from submodules.model.business_objects import general
+from submodules.model.models import Attribute, RecordAttributeTokenStatistics
+from submodules.model.session import session
+
+# per attribute aggregates of the token statistics (count, sum, min, max and a histogram)
+# so distributions don't need a scan of all statistic rows. New statistics are merged in
+# chunkwise; paths that overwrite existing statistics rebuild the project instead.
+# Deleted records and attributes stay in the aggregates until an explicit refresh.
+TABLE_NAME = "record_attribute_token_aggregate"
+# bucket 0 holds empty values, bucket i >= 1 holds [2^((i-1)/4), 2^(i/4)), four buckets
+# per power of two keep the interpolated percentiles within a few percent. The last is open
+BUCKETS_PER_OCTAVE = 4
+BUCKET_COUNT = 24 * BUCKETS_PER_OCTAVE + 1
+PERCENTILES = [50, 90, 95, 99]
+
+
+def __get_bucket_threshold(i: int) -> int:
+    # ceil of the fourth root of 2^i, the fourth root is the square root twice
+    root = math.isqrt(math.isqrt(2**i))
+    return root if root**BUCKETS_PER_OCTAVE >= 2**i else root + 1
+
+
+# smallest token count of bucket i + 1, i.e. ceil(2^(i/4)) computed on integers. Numpy
+# (searchsorted) and postgres (width_bucket) bucket against the same list, so both agree
+# exactly, also at powers of two where a floating point log can be off by one
+BUCKET_THRESHOLDS = [__get_bucket_threshold(i) for i in range(BUCKET_COUNT - 1)]
+
+
+class TokenAggregate:
+    def __init__(
+        self,
+        count: int = 0,
+        sum: int = 0,
+        min: Optional[int] = None,
+        max: Optional[int] = None,
+        histogram: Optional[np.ndarray] = None,
+    ) -> None:
+        self.count = count
+        self.sum = sum
+        self.min = min
+        self.max = max
+        self.histogram = (
+            np.zeros(BUCKET_COUNT, dtype=np.int64) if histogram is None else histogram
+        )
+
+    @classmethod
+    def from_values(cls, values: np.ndarray) -> "TokenAggregate":
+        values = np.asarray(values, dtype=np.int64)
+        if not len(values):
+            return cls()
+        return cls(
+            int(len(values)),
+            int(values.sum()),
+            int(values.min()),
+            int(values.max()),
+            np.bincount(get_buckets(values), minlength=BUCKET_COUNT),
+        )
+
+    def merge(self, other: "TokenAggregate") -> None:
+        if not other.count:
+            return
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        self.count += other.count
+        self.sum += other.sum
+        self.histogram = self.histogram + other.histogram
+
+    def get_percentile(self, percentile: float) -> Optional[float]:
+        # interpolated within the bucket, exact at the bucket edges and for min / max
+        if not self.count:
+            return None
+        rank = percentile / 100 * self.count
+        cumulative = np.cumsum(self.histogram)
+        bucket = min(int(np.searchsorted(cumulative, rank)), BUCKET_COUNT - 1)
+        lower, upper = get_bucket_bounds(bucket)
+        lower = max(lower, self.min)
+        upper = min(upper, self.max)
+        before = cumulative[bucket - 1] if bucket else 0
+        in_bucket = self.histogram[bucket]
+        fraction = (rank - before) / in_bucket if in_bucket else 0
+        return round(float(lower + (upper - lower) * fraction), 2)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": round(self.sum / self.count, 2) if self.count else None,
+            "min": self.min,
+            "max": self.max,
+            "histogram": {
+                "lower_bounds": [
+                    round(get_bucket_bounds(i)[0], 2) for i in range(BUCKET_COUNT)
+                ],
+                "counts": [int(count) for count in self.histogram],
+            },
+            "percentiles": {
+                f"p{percentile}": self.get_percentile(percentile)
+                for percentile in PERCENTILES
+            },
+        }
+
+
+def get_buckets(values: np.ndarray) -> np.ndarray:
+    return np.searchsorted(
+        np.array(BUCKET_THRESHOLDS, dtype=np.int64),
+        np.asarray(values, dtype=np.int64),
+        side="right",
+    )
+
+
+def get_bucket_bounds(bucket: int) -> List[float]:
+    if bucket == 0:
+        return [0, 0]
+    upper = float("inf")
+    if bucket < BUCKET_COUNT - 1:
+        upper = 2 ** (bucket / BUCKETS_PER_OCTAVE)
+    return [2 ** ((bucket - 1) / BUCKETS_PER_OCTAVE), upper]
+
+
+def ensure_table() -> None:
+    session_token = general.get_ctx_token()
+    try:
+        session.execute(
+            text(
+                f"""
+                CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
+                    project_id UUID NOT NULL,
+                    attribute_id UUID NOT NULL,
+                    count BIGINT NOT NULL,
+                    sum BIGINT NOT NULL,
+                    min INTEGER,
+                    max INTEGER,
+                    histogram BIGINT[] NOT NULL,
+                    PRIMARY KEY (project_id, attribute_id)
+                )
+                """
+            )
+        )
+        general.commit()
+    finally:
+        general.remove_and_refresh_session(session_token)
+
+
+def merge_entries(project_id: str, entries: Iterable[Dict[str, Any]]) -> None:
+    # no commit, entries are the rows written to the statistics table. Merged in sql
+    # so concurrent writers (other threads or processes) don't lose updates
+    values_by_attribute = {}
+    for entry in entries:
+        values_by_attribute.setdefault(str(entry["attribute_id"]), []).append(
+            entry["num_token"]
+        )
+    for attribute_id, values in values_by_attribute.items():
+        aggregate = TokenAggregate.from_values(np.array(values))
+        session.execute(
+            text(
+                f"""
+                INSERT INTO {TABLE_NAME} AS a
+                    (project_id, attribute_id, count, sum, min, max, histogram)
+                VALUES (
+                    :project_id, :attribute_id, :count, :sum, :min, :max,
+                    CAST(:histogram AS BIGINT[])
+                )
+                ON CONFLICT (project_id, attribute_id) DO UPDATE SET
+                    count = a.count + EXCLUDED.count,
+                    sum = a.sum + EXCLUDED.sum,
+                    min = LEAST(a.min, EXCLUDED.min),
+                    max = GREATEST(a.max, EXCLUDED.max),
+                    histogram = ARRAY(
+                        SELECT x + y
+                        FROM unnest(a.histogram, EXCLUDED.histogram) AS h(x, y)
+                    )
+                """
+            ),
+            __get_parameters(project_id, attribute_id, aggregate),
+        )
+
+
+def rebuild(project_id: str) -> None:
+    # no commit, groups in the database so only one row per attribute and bucket is read
+    rows = session.execute(
+        text(
+            f"""
+            SELECT attribute_id,
+                WIDTH_BUCKET(num_token::BIGINT, CAST(:thresholds AS BIGINT[])) AS bucket,
+                COUNT(*) AS count,
+                SUM(num_token) AS sum, MIN(num_token) AS min, MAX(num_token) AS max
+            FROM {RecordAttributeTokenStatistics.__tablename__}
+            WHERE project_id = :project_id
+            GROUP BY attribute_id, bucket
+            """
+        ),
+        {"project_id": project_id, "thresholds": BUCKET_THRESHOLDS},
+    )
+    aggregates = {}
+    for row in rows:
+        histogram = np.zeros(BUCKET_COUNT, dtype=np.int64)
+        histogram[row.bucket] = row.count
+        aggregates.setdefault(str(row.attribute_id), TokenAggregate()).merge(
+            TokenAggregate(
+                int(row.count), int(row.sum), int(row.min), int(row.max), histogram
+            )
+        )
+    session.execute(
+        text(f"DELETE FROM {TABLE_NAME} WHERE project_id = :project_id"),
+        {"project_id": project_id},
+    )
+    for attribute_id, aggregate in aggregates.items():
+        session.execute(
+            text(
+                f"""
+                INSERT INTO {TABLE_NAME}
+                    (project_id, attribute_id, count, sum, min, max, histogram)
+                VALUES (
+                    :project_id, :attribute_id, :count, :sum, :min, :max,
+                    CAST(:histogram AS BIGINT[])
+                )
+                """
+            ),
+            __get_parameters(project_id, attribute_id, aggregate),
+        )
+
+
+def get_by_attribute(project_id: str) -> Dict[str, TokenAggregate]:
+    # read only, aggregates of deleted attributes are skipped until the next refresh
+    rows = session.execute(
+        text(
+            f"""
+            SELECT a.*
+            FROM {TABLE_NAME} a
+            INNER JOIN {Attribute.__tablename__} at
+                ON at.project_id = a.project_id AND at.id = a.attribute_id
+            WHERE a.project_id = :project_id
+            """
+        ),
+        {"project_id": project_id},
+    )
+    return {
+        str(row.attribute_id): TokenAggregate(
+            row.count,
+            row.sum,
+            row.min,
+            row.max,
+            np.array(row.histogram, dtype=np.int64),
+        )
+        for row in rows
+    }
+
+
+def __get_parameters(
+    project_id: str, attribute_id: str, aggregate: TokenAggregate
+) -> Dict[str, Any]:
+    return {
+        "project_id": str(project_id),
+        "attribute_id": attribute_id,
+        "count": aggregate.count,
+        "sum": aggregate.sum,
+        "min": aggregate.min,
+        "max": aggregate.max,
+        "histogram": [int(count) for count in aggregate.histogram],
+    }
@@ -0,0 +1,105 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+from typing import Any, Dict, Tuple
+
+import spacy
+from spacy.language import Language
+
+# compact alternative to pickling the whole Language: only the tokenizer and the vocab
+# (without vectors) are stored. Layout of the file:
+#   MAGIC | manifest length (uint32, big endian) | manifest json | vocab | tokenizer
+# The manifest holds the offsets, so readers can map the file and only touch what they need.
+MAGIC = b"RTOK"
+FORMAT_VERSION = 1
+__HEADER = struct.Struct(">4sI")
+
+
+def get_artifact_path(config_string: str) -> str:
+    return os.path.join("/inference/tokenizers", f"tokenizer-{config_string}.rtok")
+
+
+def write_artifact(path: str, config_string: str, nlp: Language) -> Dict[str, Any]:
+    vocab_bytes = nlp.vocab.to_bytes(exclude=["vectors"])
+    tokenizer_bytes = nlp.tokenizer.to_bytes()
+    content_hash = hashlib.sha256()
+    content_hash.update(vocab_bytes)
+    content_hash.update(tokenizer_bytes)
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "config_string": config_string,
+        "lang": nlp.lang,
+        "spacy_version": spacy.__version__,
+        "sha256": content_hash.hexdigest(),
+        "vocab": [0, len(vocab_bytes)],
+        "tokenizer": [len(vocab_bytes), len(tokenizer_bytes)],
+    }
+    manifest_bytes = json.dumps(manifest, sort_keys=True).encode()
+
+    # written next to the target and renamed, readers never see a partial file
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(__HEADER.pack(MAGIC, len(manifest_bytes)))
+            f.write(manifest_bytes)
+            f.write(vocab_bytes)
+            f.write(tokenizer_bytes)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return manifest
+
+
+def read_manifest(path: str) -> Dict[str, Any]:
+    with open(path, "rb") as f:
+        manifest, _ = __read_manifest(f.read(__HEADER.size), f)
+    return manifest
+
+
+def load_tokenizer(path: str, verify: bool = True) -> Language:
+    with open(path, "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as data:
+        manifest, payload_start = __read_manifest(data[: __HEADER.size], f)
+        vocab_bytes = __get_section(data, payload_start, manifest["vocab"])
+        tokenizer_bytes = __get_section(data, payload_start, manifest["tokenizer"])
+    if verify:
+        content_hash = hashlib.sha256()
+        content_hash.update(vocab_bytes)
+        content_hash.update(tokenizer_bytes)
+        if content_hash.hexdigest() != manifest["sha256"]:
+            raise ValueError(f"Tokenizer artifact {path} is corrupted (hash mismatch)")
+    nlp = spacy.blank(manifest["lang"])
+    nlp.vocab.from_bytes(vocab_bytes)
+    nlp.tokenizer.from_bytes(tokenizer_bytes)
+    return nlp
+
+
+def __read_manifest(header: bytes, f) -> Tuple[Dict[str, Any], int]:
+    if len(header) < __HEADER.size:
+        raise ValueError("Not a tokenizer artifact (file too short)")
+    magic, manifest_length = __HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ValueError("Not a tokenizer artifact (unknown magic bytes)")
+    f.seek(__HEADER.size)
+    manifest = json.loads(f.read(manifest_length))
+    if manifest.get("format_version") != FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported tokenizer artifact version {manifest.get('format_version')}"
+        )
+    return manifest, __HEADER.size + manifest_length
+
+
+def __get_section(
+    data: mmap.mmap, payload_start: int, section: Tuple[int, int]
+) -> bytes:
+    offset, length = section
+    return data[payload_start + offset : payload_start + offset + length]
@@ -1,6 +1,6 @@
 from spacy.tokens import DocBin, Doc
 from spacy.vocab import Vocab
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 from .notification import (
     send_project_update,
     send_project_update_throttle,
@@ -14,6 +14,7 @@ from submodules.model.business_objects import (
     organization,
 )
 from submodules.s3 import controller as s3
+from . import export, string_table
 
 
 def get_attribute_names_string(attribute_names: List[str]) -> str:
@@ -22,20 +23,32 @@ def get_attribute_names_string(attribute_names: List[str]) -> str:
     return "{" + attribute_names + "}"
 
 
-def put_data_in_minio_bucket(project_id: str, missing_columns: List[str]) -> None:
+def put_data_in_minio_bucket(
+    project_id: str, missing_columns: List[str], with_shards: bool = False
+) -> None:
+    # the sharded export is a full copy as well, so only for finished docbins
     missing_columns_str = ",\n".join(
         ["'" + k + "',r.data->'" + k + "'" for k in missing_columns]
     )
     org_id = organization.get_id_by_project_id(project_id)
+    if string_table.SHARED_STRINGS:
+        export.put_string_table(org_id, project_id)
     data = tokenization.get_doc_bin_table_to_json(project_id, missing_columns_str)
     s3.upload_tokenizer_data(org_id, project_id, data)
+    if with_shards:
+        export.put_sharded_export(org_id, project_id, missing_columns)
 
 
-def get_docs_from_db(tbl_entry: Any, vocab: Vocab) -> Dict[str, Doc]:
+def get_docs_from_db(
+    tbl_entry: Any, vocab: Vocab, project_id: Optional[str] = None
+) -> Dict[str, Doc]:
     if not tbl_entry.bytes or not tbl_entry.columns:
         raise ValueError(f"Can't find docbin for record {tbl_entry.id}")
 
     doc_bin_loaded = DocBin().from_bytes(tbl_entry.bytes)
+    if project_id:
+        # docbins written with shared strings only hold the hashes
+        string_table.ensure_strings_in_vocab(project_id, doc_bin_loaded, vocab)
     docs = list(doc_bin_loaded.get_docs(vocab))
     doc_dict = {}
     for col, doc in zip(tbl_entry.columns, docs):
@@ -53,7 +66,7 @@ def reupload_docbins(project_id: str) -> int:
             AttributeState.RUNNING.value,
         ],
     ).keys()
-    put_data_in_minio_bucket(project_id, missing_columns)
+    put_data_in_minio_bucket(project_id, missing_columns, with_shards=True)
     return 200
 
 
@@ -1,3 +1,4 @@
+from typing import List, Optional
 from pydantic import BaseModel
 
 
@@ -7,6 +8,12 @@ class Request(BaseModel):
     user_id: str
     include_rats: bool
     only_uploaded_attributes: bool  # for uploading later project records, we only need the uploaded ones, the other ones are handled in the gateway
+    profile: bool = False
+
+
+class RecordsTokenizationRequest(BaseModel):
+    project_id: str
+    record_ids: List[str]
 
 
 class AttributeTokenizationRequest(BaseModel):
@@ -14,18 +21,49 @@ class AttributeTokenizationRequest(BaseModel):
     user_id: str
     attribute_id: str
     include_rats: bool
+    profile: bool = False
 
 
 class RatsRequest(BaseModel):
     project_id: str
     user_id: str
     attribute_id: str
+    profile: bool = False
+
+
+class RetokenizationRequest(BaseModel):
+    project_id: str
+    user_id: str
+    include_rats: bool = True
+    profile: bool = False
+
+
+class TokenizerMigrationRequest(BaseModel):
+    project_id: str
+    user_id: str
+    tokenizer: str
+    profile: bool = False
+
+
+class EstimateRequest(BaseModel):
+    project_id: str
+    attribute_id: Optional[str] = None
+
+
+class TokenRequest(BaseModel):
+    project_id: str
+    record_ids: List[str]
+    attribute_names: Optional[List[str]] = None
 
 
 class ReuploadDocbins(BaseModel):
     project_id: str
 
 
+class RemoveDuplicates(BaseModel):
+    project_id: str
+
+
 class SaveTokenizer(BaseModel):
     config_string: str
     overwrite: bool = False
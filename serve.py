@@ -0,0 +1,151 @@
+import gc
+import glob
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import time
+import traceback
+from typing import Dict
+
+# before prometheus_client is imported. The http workers write their metric values to
+# files in this directory, a scrape of any of them reports all
+__created_metrics_dir = None
+if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+    # values of an earlier run
+    for path in glob.glob(os.path.join(os.environ["PROMETHEUS_MULTIPROC_DIR"], "*.db")):
+        os.remove(path)
+else:
+    __created_metrics_dir = tempfile.mkdtemp(prefix="tokenizer-metrics-")
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = __created_metrics_dir
+
+from prometheus_client import multiprocess  # noqa: E402
+
+import migrate  # noqa: E402
+from handler import tokenizer_handler  # noqa: E402
+from handler.config_handler import get_config_value  # noqa: E402
+from misc import metrics, task_queue  # noqa: E402
+from submodules.model.session import session  # noqa: E402
+
+# multi-worker mode, start with "python serve.py" instead of uvicorn. The models are
+# loaded once here and the http workers are forked afterwards, so they share the model
+# pages copy-on-write instead of loading one copy each.
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", 80))
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", 2))
+MEMORY_REPORT_INTERVAL = int(os.getenv("MEMORY_REPORT_INTERVAL", 300))
+
+__workers: Dict[int, int] = {}  # pid -> worker number
+__stopping = False
+
+
+def main() -> None:
+    if not task_queue.RUN_IN_WORKER:
+        print(
+            "Warning: bulk tasks run inside every http worker, "
+            "use TASK_EXECUTION=worker with several workers",
+            flush=True,
+        )
+    # one-time setup, done here instead of once per http worker
+    migrate.main()
+    # connections of the pool would be shared by the forks
+    session.get_bind().dispose()
+    for config_string in get_config_value("spacy_downloads"):
+        tokenizer_handler.init_tokenizer(config_string)
+    # objects that exist now are never collected, the collector doesn't write to
+    # their pages and the sharing survives
+    gc.collect()
+    gc.freeze()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((HOST, PORT))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    signal.signal(signal.SIGTERM, __stop)
+    signal.signal(signal.SIGINT, __stop)
+    for number in range(WEB_WORKERS):
+        __spawn(sock, number)
+    print(
+        f"Serving on {HOST}:{PORT} with {WEB_WORKERS} workers "
+        f"(master memory {__format_memory(metrics.get_memory_breakdown())})",
+        flush=True,
+    )
+
+    last_report = time.monotonic()
+    while __workers:
+        try:
+            pid, exit_status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid:
+            number = __workers.pop(pid)
+            multiprocess.mark_process_dead(pid)
+            if not __stopping:
+                print(
+                    f"Worker {number} (pid {pid}) exited with {exit_status}, restarting",
+                    flush=True,
+                )
+                __spawn(sock, number)
+            continue
+        if time.monotonic() - last_report >= MEMORY_REPORT_INTERVAL:
+            __report_memory()
+            last_report = time.monotonic()
+        time.sleep(1)
+    if __created_metrics_dir:
+        shutil.rmtree(__created_metrics_dir, ignore_errors=True)
+
+
+def __spawn(sock: socket.socket, number: int) -> None:
+    pid = os.fork()
+    if pid:
+        __workers[pid] = number
+        return
+    exit_code = 0
+    try:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        __run_worker(sock)
+    except Exception:
+        print(traceback.format_exc(), flush=True)
+        exit_code = 1
+    finally:
+        os._exit(exit_code)
+
+
+def __run_worker(sock: socket.socket) -> None:
+    import uvicorn
+
+    # imported after the fork, the app starts its threads and connections per worker
+    from app import app
+
+    server = uvicorn.Server(uvicorn.Config(app))
+    server.run(sockets=[sock])
+
+
+def __stop(signum, frame) -> None:
+    global __stopping
+    __stopping = True
+    for pid in list(__workers):
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+
+def __report_memory() -> None:
+    for pid, number in sorted(__workers.items(), key=lambda item: item[1]):
+        memory = metrics.get_memory_breakdown(str(pid))
+        print(f"Worker {number} (pid {pid}): {__format_memory(memory)}", flush=True)
+
+
+def __format_memory(memory: Dict[str, int]) -> str:
+    return ", ".join(
+        f"{kind} {value / 1024 / 1024:.0f} MiB" for kind, value in memory.items()
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import random
+from types import SimpleNamespace
+from typing import Any, Callable, List, Optional
+
+import numpy as np
+import pytest
+
+# shared fakes of the unit tests. Modules depending on the submodules are imported in
+# the fixtures, so tests that don't use them run without the submodule checkouts
+
+
+@pytest.fixture
+def generate_text() -> Callable[[int, int], str]:
+    # random words, punctuation, abbreviations and whitespace runs, reproducible per seed
+    def generate(seed: int, words: int) -> str:
+        rng = random.Random(seed)
+        parts = []
+        for _ in range(words):
+            word = "".join(rng.choice("abcdefghij") for _ in range(rng.randint(1, 8)))
+            word += rng.choice(["", "", "", ".", ",", "!", "?", "'s", ")", "n't"])
+            if rng.random() < 0.05:
+                word = (
+                    rng.choice(["(", '"', "U.S.", "e.g.", "https://kern.ai", ":)"])
+                    + word
+                )
+            parts.append(word)
+            parts.append(
+                rng.choice([" ", " ", " ", " ", "  ", "\n", "\n\n", " \n", "\t"])
+            )
+        return "".join(parts)
+
+    return generate
+
+
+@pytest.fixture
+def token_counts() -> Callable[..., np.ndarray]:
+    # long tailed like the token counts of real texts, reproducible per seed
+    def generate(seed: int, mean: float, sigma: float, size: int) -> np.ndarray:
+        return np.random.default_rng(seed).lognormal(mean, sigma, size).astype(int)
+
+    return generate
+
+
+class FakeSession:
+    # records the executed statements, every query returns the given row
+    def __init__(self, row: Optional[Any] = None) -> None:
+        self.row = row
+        self.executed = []
+
+    def execute(self, statement: Any, parameters: Optional[Any] = None) -> Any:
+        self.executed.append((str(statement), parameters))
+        return SimpleNamespace(first=lambda: self.row)
+
+
+@pytest.fixture
+def fake_session() -> Callable[..., FakeSession]:
+    return FakeSession
+
+
+@pytest.fixture
+def make_records() -> Callable[[int], List[SimpleNamespace]]:
+    # record i has a text of i + 1 sentences and a non-text label
+    def make(count: int) -> List[SimpleNamespace]:
+        return [
+            SimpleNamespace(
+                id=f"record-{idx}",
+                data={"text": "Tokenize this sentence. " * (idx + 1), "label": idx},
+            )
+            for idx in range(count)
+        ]
+
+    return make
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock() -> Clock:
+    return Clock()
+
+
+@pytest.fixture
+def progress_tracker(monkeypatch, clock: Clock) -> Callable[..., Any]:
+    # trackers of a task with 1000 records on the clock fixture, flushed explicitly only
+    from misc import progress
+
+    monkeypatch.setattr(progress.time, "monotonic", clock)
+    monkeypatch.setattr(progress, "PROGRESS_INTERVAL", 1000)
+
+    def create(estimated_seconds_per_record: Optional[float] = None) -> Any:
+        return progress.ProgressTracker(
+            "project", "task", "docbin", 1000, estimated_seconds_per_record
+        )
+
+    return create
@@ -0,0 +1,51 @@
+from misc import progress
+
+
+def test_eta_starts_from_estimate(progress_tracker):
+    tracker = progress_tracker(0.01)
+    assert tracker.records_per_second is None
+    assert tracker.eta_seconds == 10.0
+
+
+def test_eta_without_estimate_or_throughput(progress_tracker):
+    tracker = progress_tracker()
+    assert tracker.eta_seconds is None
+
+
+def test_eta_follows_measured_throughput(progress_tracker, clock):
+    tracker = progress_tracker(0.01)
+    clock.now += 5
+    tracker.add(250)
+    assert tracker.records_per_second == 50
+    assert tracker.eta_seconds == 15.0
+    assert tracker.progress == 0.25
+
+
+def test_eta_and_progress_at_the_end(progress_tracker, clock):
+    tracker = progress_tracker()
+    clock.now += 2
+    tracker.add(1200)
+    assert tracker.eta_seconds == 0
+    # 1 is only set once the task is finalized
+    assert tracker.progress == 0.9999
+
+
+def test_flush_stores_throughput_and_sends_eta(monkeypatch, progress_tracker, clock):
+    tracker = progress_tracker(0.01)
+    task = type("Task", (), {"progress": 0})()
+    stored, sent = [], []
+    monkeypatch.setattr(progress.tokenization, "get", lambda *args: task)
+    monkeypatch.setattr(progress.general, "commit", lambda: None)
+    monkeypatch.setattr(
+        progress.task_estimate, "update_throughput", lambda *args: stored.append(args)
+    )
+    monkeypatch.setattr(
+        progress, "send_websocket_update", lambda *args: sent.append(args[2])
+    )
+    clock.now += 4
+    tracker.add(400)
+    tracker.flush()
+
+    assert task.progress == 0.4
+    assert stored == [("task", 100, 6.0)]
+    assert sent == [["docbin", "progress", "0.4"], ["docbin", "eta", "6.0"]]
@@ -0,0 +1,38 @@
+import pytest
+import spacy
+
+from controller.segmentation import split_text, tokenize_text, tokenize_texts
+
+
+def __tokens(doc):
+    return [(token.text, token.whitespace_) for token in doc]
+
+
+@pytest.mark.parametrize("language", ["en", "de"])
+@pytest.mark.parametrize("seed", range(5))
+def test_segmented_tokenization_matches_single_pass(
+    language: str, seed: int, generate_text
+):
+    tokenizer = spacy.blank(language)
+    text = generate_text(seed, 3000)
+
+    segmented = tokenize_text(tokenizer, text, threshold=500)
+
+    assert len(split_text(text, 500)) > 1
+    assert segmented.text == text
+    assert __tokens(segmented) == __tokens(tokenizer(text))
+
+
+def test_split_text_keeps_unsplittable_text():
+    text = "x" * 1000
+    assert split_text(text, 100) == [text]
+
+
+def test_tokenize_texts_keeps_order(generate_text):
+    tokenizer = spacy.blank("en")
+    texts = [generate_text(seed, words) for seed, words in enumerate([5, 400, 3])]
+
+    docs = tokenize_texts(tokenizer, texts, threshold=200)
+
+    assert [doc.text for doc in docs] == texts
+    assert [__tokens(doc) for doc in docs] == [__tokens(tokenizer(t)) for t in texts]
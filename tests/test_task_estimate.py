@@ -0,0 +1,87 @@
+import datetime
+import json
+from types import SimpleNamespace
+
+import spacy
+
+from controller import cost_estimator
+from misc import metrics, task_estimate
+
+
+def test_estimate_scales_sample_to_task(monkeypatch, make_records):
+    sampled = []
+
+    def get_sample_records(project_id, size, record_count, only_untokenized):
+        sampled.append((size, record_count, only_untokenized))
+        return make_records(20)
+
+    monkeypatch.setattr(cost_estimator.query, "get_sample_records", get_sample_records)
+    estimate = cost_estimator.estimate(
+        "project",
+        spacy.blank("en"),
+        metrics.TASK_TYPE_PROJECT,
+        ["text"],
+        ["label"],
+        10000,
+    )
+
+    assert sampled == [(cost_estimator.ESTIMATE_SAMPLE_SIZE, 10000, True)]
+    assert estimate["records"] == 10000
+    assert estimate["sample_size"] == 20
+    assert estimate["mean_characters"] == 24 * 10.5
+    assert estimate["wall_seconds"] >= 0
+    assert estimate["doc_bin_bytes"] > 0
+    assert estimate["export_bytes"] > 0
+    assert estimate["peak_memory_bytes"] > estimate["doc_bin_bytes"] / 10000
+
+
+def test_estimate_without_records(monkeypatch):
+    monkeypatch.setattr(
+        cost_estimator.query, "get_sample_records", lambda *args, **kwargs: []
+    )
+    estimate = cost_estimator.estimate(
+        "project", spacy.blank("en"), metrics.TASK_TYPE_ATTRIBUTE, ["text"], [], 0
+    )
+
+    assert estimate["sample_size"] == 0
+    assert estimate["wall_seconds"] == 0
+    assert estimate["doc_bin_bytes"] == 0
+
+
+def test_store_and_update_throughput(monkeypatch, fake_session):
+    session = fake_session()
+    monkeypatch.setattr(task_estimate, "session", session)
+    task_estimate.store("project", "task", {"records": 5})
+    task_estimate.update_throughput("task", 12.5, 3.0)
+
+    (_, stored), (_, updated) = session.executed
+    assert stored == {
+        "task_id": "task",
+        "project_id": "project",
+        "estimate": json.dumps({"records": 5}),
+    }
+    assert updated == {
+        "task_id": "task",
+        "records_per_second": 12.5,
+        "eta_seconds": 3.0,
+    }
+
+
+def test_get_returns_estimate_with_throughput(monkeypatch, fake_session):
+    created_at = datetime.datetime(2024, 1, 1, 12, 0)
+    row = SimpleNamespace(
+        estimate={"records": 5},
+        records_per_second=12.5,
+        eta_seconds=None,
+        created_at=created_at,
+    )
+    monkeypatch.setattr(task_estimate, "session", fake_session(row))
+
+    assert task_estimate.get("project", "task") == {
+        "estimate": {"records": 5},
+        "records_per_second": 12.5,
+        "eta_seconds": None,
+        "created_at": "2024-01-01T12:00:00",
+    }
+    monkeypatch.setattr(task_estimate, "session", fake_session())
+    assert task_estimate.get("project", "task") is None
@@ -0,0 +1,54 @@
+import numpy as np
+
+from misc.token_statistics import (
+    BUCKET_COUNT,
+    BUCKETS_PER_OCTAVE,
+    BUCKET_THRESHOLDS,
+    TokenAggregate,
+    get_bucket_bounds,
+    get_buckets,
+)
+
+
+def test_merged_chunks_equal_single_aggregate(token_counts):
+    values = token_counts(0, 4, 1, 10000)
+    merged = TokenAggregate()
+    for chunk in np.array_split(values, 13):
+        merged.merge(TokenAggregate.from_values(chunk))
+    single = TokenAggregate.from_values(values)
+
+    assert merged.to_dict() == single.to_dict()
+    assert merged.count == len(values)
+    assert merged.sum == values.sum()
+    assert (merged.min, merged.max) == (values.min(), values.max())
+
+
+def test_percentiles_are_close(token_counts):
+    values = token_counts(1, 5, 1.2, 50000)
+    aggregate = TokenAggregate.from_values(values)
+    for percentile in [50, 90, 99]:
+        exact = np.percentile(values, percentile)
+        assert abs(aggregate.get_percentile(percentile) - exact) <= 0.1 * exact
+
+
+def test_buckets_are_exact_at_powers_of_two():
+    # the rebuild buckets in postgres with width_bucket over the same thresholds
+    powers = np.array([2**exponent for exponent in range(24)])
+    assert list(get_buckets(powers)) == [
+        exponent * BUCKETS_PER_OCTAVE + 1 for exponent in range(24)
+    ]
+    # just below a power of two is the last bucket of the octave before
+    assert list(get_buckets(powers - 1)[3:]) == [
+        exponent * BUCKETS_PER_OCTAVE for exponent in range(3, 24)
+    ]
+
+
+def test_buckets_match_bounds():
+    values = np.arange(0, 2**16)
+    buckets = get_buckets(values)
+    assert len(BUCKET_THRESHOLDS) == BUCKET_COUNT - 1
+    for value, bucket in zip(values[1:], buckets[1:]):
+        lower, upper = get_bucket_bounds(bucket)
+        assert lower <= value < upper
+    assert get_buckets(np.array([0, -1]))[0] == 0
+    assert get_buckets(np.array([2**40]))[0] == BUCKET_COUNT - 1
@@ -0,0 +1,31 @@
+import os
+
+import pytest
+import spacy
+
+from misc import tokenizer_artifact
+
+
+def test_artifact_round_trip(tmp_path):
+    nlp = spacy.blank("en")
+    path = os.path.join(tmp_path, "tokenizer-en.rtok")
+    manifest = tokenizer_artifact.write_artifact(path, "en_core_web_sm", nlp)
+
+    assert tokenizer_artifact.read_manifest(path) == manifest
+    assert manifest["spacy_version"] == spacy.__version__
+    text = "Don't split U.S. (e.g. https://kern.ai) differently!"
+    loaded = tokenizer_artifact.load_tokenizer(path)
+    assert [t.text for t in loaded(text)] == [t.text for t in nlp(text)]
+
+
+def test_corrupted_artifact_is_rejected(tmp_path):
+    path = os.path.join(tmp_path, "tokenizer-en.rtok")
+    tokenizer_artifact.write_artifact(path, "en_core_web_sm", spacy.blank("en"))
+    with open(path, "r+b") as f:
+        f.seek(-1, os.SEEK_END)
+        last = f.read(1)
+        f.seek(-1, os.SEEK_END)
+        f.write(bytes([last[0] ^ 0xFF]))
+
+    with pytest.raises(ValueError):
+        tokenizer_artifact.load_tokenizer(path)
@@ -0,0 +1,100 @@
+import os
+import threading
+import time
+import traceback
+
+from prometheus_client import start_http_server
+
+from controller import task_manager
+from misc import profiling, task_queue
+from submodules.model import session
+from submodules.model.business_objects import general
+
+# background worker for TASK_EXECUTION=worker, start with "python worker.py".
+# Runs the queued tokenization tasks so they don't compete with the api for the GIL.
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", 2))
+POLL_INTERVAL = float(os.getenv("WORKER_POLL_INTERVAL", 1))
+METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", 0))
+
+__slots = threading.Semaphore(WORKER_CONCURRENCY)
+__running_job_ids = set()
+__running_lock = threading.Lock()
+
+
+def main() -> None:
+    # tasks started by tasks (e.g. rats after doc bins) are queued as well and wait for
+    # a free slot of any worker
+    task_queue.RUN_IN_WORKER = True
+    session.start_session_cleanup_thread()
+    if METRICS_PORT:
+        start_http_server(METRICS_PORT)
+    threading.Thread(target=__renew_claims, daemon=True).start()
+
+    session_token = general.get_ctx_token()
+    try:
+        released = task_queue.release_claimed_jobs()
+    finally:
+        general.remove_and_refresh_session(session_token)
+    print(
+        f"Worker {task_queue.WORKER_ID} started with {WORKER_CONCURRENCY} slots, "
+        f"{released} interrupted jobs queued again",
+        flush=True,
+    )
+    while True:
+        __slots.acquire()
+        job = None
+        session_token = general.get_ctx_token()
+        try:
+            job = task_queue.claim()
+        except Exception:
+            print(traceback.format_exc(), flush=True)
+        finally:
+            general.remove_and_refresh_session(session_token)
+        if job is None:
+            __slots.release()
+            time.sleep(POLL_INTERVAL)
+            continue
+        with __running_lock:
+            __running_job_ids.add(str(job.id))
+        threading.Thread(target=__run_job, args=(job,), daemon=True).start()
+
+
+def __run_job(job) -> None:
+    job_id = str(job.id)
+    try:
+        profile, *arguments = job.arguments
+        profiling.run_task(
+            job_id, profile, task_manager.TASK_FUNCTIONS[job.function], *arguments
+        )
+    except Exception:
+        print(traceback.format_exc(), flush=True)
+    finally:
+        session_token = general.get_ctx_token()
+        try:
+            task_queue.finish(job_id)
+        except Exception:
+            print(traceback.format_exc(), flush=True)
+        finally:
+            general.remove_and_refresh_session(session_token)
+        with __running_lock:
+            __running_job_ids.discard(job_id)
+        __slots.release()
+
+
+def __renew_claims() -> None:
+    # heartbeat, well within the lease so a slow database doesn't cost a job
+    while True:
+        time.sleep(task_queue.JOB_LEASE_SECONDS / 4)
+        with __running_lock:
+            job_ids = list(__running_job_ids)
+        session_token = general.get_ctx_token()
+        try:
+            task_queue.renew_claims(job_ids)
+        except Exception:
+            print(traceback.format_exc(), flush=True)
+        finally:
+            general.remove_and_refresh_session(session_token)
+
+
+if __name__ == "__main__":
+    main()